@@ -0,0 +1,260 @@
+import copy
+import heapq
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.columnar import CheckTable, CRITICAL, PASSING, SEVERITIES, STATUSES
+from app.models import ComplianceCheck
+
+RECENT_VIOLATIONS = 10
+# Bump whenever the Aggregates attributes change so persisted copies are rebuilt
+AGGREGATES_VERSION = 4
+_US_PER_HOUR = 3_600_000_000
+# Dimensions the hourly counts (for /trends) and risk histograms are split by
+TREND_DIMENSIONS = ("framework", "provider", "severity", "status")
+# Width of the risk histogram bins: scores 0-10 fall in 1,001 bins, so a
+# quantile read from them is within half a step of the exact one
+RISK_STEP = 0.01
+RISK_BINS = int(round(10 / RISK_STEP)) + 1
+_SEVERITY_LABELS = tuple(s.value for s in SEVERITIES)
+_STATUS_LABELS = tuple(s.value for s in STATUSES)
+
+
+class Aggregates:
+    """Running counts over the stored checks.
+
+    Maintained by ``DataStore`` on every mutation (``add``/``remove`` take the
+    delta as a ``CheckTable``) so the read endpoints never rescan the rows.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.risk_sum = 0.0
+        self.severity_counts = np.zeros(len(SEVERITIES), dtype=np.int64)
+        self.status_counts = np.zeros(len(STATUSES), dtype=np.int64)
+        self.framework_counts: Counter = Counter()
+        self.framework_risk: Dict[str, float] = defaultdict(float)
+        self.provider_counts: Counter = Counter()
+        self.provider_critical: Counter = Counter()
+        # Number of checks per hour (microsecond epoch // 1h) of last_checked
+        self.hourly: Counter = Counter()
+        # Per trend dimension: label -> Counter of checks per hour
+        self.hourly_by: Dict[str, Dict[str, Counter]] = {dim: defaultdict(Counter) for dim in TREND_DIMENSIONS}
+        # Per trend dimension: label -> checks per risk_score bin (see risk_bin)
+        self.risk_by: Dict[str, Dict[str, np.ndarray]] = {dim: {} for dim in TREND_DIMENSIONS}
+        # Min-heap of (last_checked, id, check) holding the newest violations; ties go to
+        # the larger id, so the same rows give the same order however they were added
+        self._recent: List[tuple] = []
+        self._recent_stale = False
+
+    def copy(self) -> "Aggregates":
+        """Independent copy, so a published snapshot's aggregates are never mutated"""
+        other = copy.copy(self)
+        other.severity_counts = self.severity_counts.copy()
+        other.status_counts = self.status_counts.copy()
+        other.framework_counts = self.framework_counts.copy()
+        other.framework_risk = self.framework_risk.copy()
+        other.provider_counts = self.provider_counts.copy()
+        other.provider_critical = self.provider_critical.copy()
+        other.hourly = self.hourly.copy()
+        other.hourly_by = {
+            dim: defaultdict(Counter, {label: hours.copy() for label, hours in by_label.items()})
+            for dim, by_label in self.hourly_by.items()
+        }
+        other.risk_by = {dim: {label: bins.copy() for label, bins in by_label.items()}
+                         for dim, by_label in self.risk_by.items()}
+        other._recent = list(self._recent)
+        return other
+
+    @classmethod
+    def from_table(cls, table: CheckTable) -> "Aggregates":
+        aggregates = cls()
+        aggregates.add(table)
+        return aggregates
+
+    @classmethod
+    def from_counts(cls, severity_status: Dict[Tuple[int, int], Tuple[int, float]],
+                    frameworks: Dict[str, Tuple[int, float]], providers: Dict[str, Tuple[int, int]],
+                    hourly: Dict[int, int], recent: List[Tuple[int, ComplianceCheck]],
+                    hourly_by: Optional[Dict[str, Dict[str, Dict[int, int]]]] = None,
+                    risk_by: Optional[Dict[str, Dict[str, Dict[int, int]]]] = None) -> "Aggregates":
+        """Aggregates from counts grouped elsewhere (e.g. by a SQL engine).
+
+        ``severity_status`` maps (severity code, status code) to (count, risk
+        sum); ``frameworks`` label to (count, risk sum); ``providers`` label to
+        (count, critical non-passing count); ``recent`` holds (last_checked in
+        µs, check) of the newest violations; ``hourly_by`` maps a trend
+        dimension to label to hour to count, ``risk_by`` to label to
+        ``risk_bin`` to count.
+        """
+        aggregates = cls()
+        for (severity, status), (n, risk) in severity_status.items():
+            aggregates.total += n
+            aggregates.risk_sum += risk
+            aggregates.severity_counts[severity] += n
+            aggregates.status_counts[status] += n
+        for label, (n, risk) in frameworks.items():
+            aggregates.framework_counts[label] = n
+            aggregates.framework_risk[label] = risk
+        for label, (n, critical) in providers.items():
+            aggregates.provider_counts[label] = n
+            aggregates.provider_critical[label] = critical
+        aggregates.hourly.update(hourly)
+        for dim, by_label in (hourly_by or {}).items():
+            for label, hours in by_label.items():
+                aggregates.hourly_by[dim][label].update(hours)
+        for dim, by_label in (risk_by or {}).items():
+            for label, counts in by_label.items():
+                bins = aggregates.risk_by[dim][label] = np.zeros(RISK_BINS, dtype=np.int64)
+                bins[np.fromiter(counts.keys(), dtype=np.int64)] = np.fromiter(counts.values(), dtype=np.int64)
+        for ts, check in recent[:RECENT_VIOLATIONS]:
+            heapq.heappush(aggregates._recent, (ts, check.id, check))
+        return aggregates
+
+    def add(self, table: CheckTable):
+        """Fold newly stored rows into the aggregates"""
+        self._apply(table, 1)
+        if not self._recent_stale:
+            # A stale heap is rebuilt from the whole table by refresh_recent
+            self._push_recent(table)
+
+    def remove(self, table: CheckTable):
+        """Subtract rows that are being replaced or deleted"""
+        self._apply(table, -1)
+        removed = set(table.ids.tolist())
+        if any(entry[1] in removed for entry in self._recent):
+            self._recent_stale = True
+
+    def refresh_recent(self, table: CheckTable):
+        """Rebuild the recent-violations heap if a removal evicted one of its rows"""
+        if not self._recent_stale:
+            return
+        self._recent = []
+        self._recent_stale = False
+        self._push_recent(table)
+
+    def _push_recent(self, table: CheckTable):
+        idx = top_recent(table, table.status != PASSING, RECENT_VIOLATIONS)
+        timestamps = table.last_checked[idx].view(np.int64).tolist()
+        for ts, check in zip(timestamps, table.rows(idx)):
+            entry = (ts, check.id, check)
+            if len(self._recent) < RECENT_VIOLATIONS:
+                heapq.heappush(self._recent, entry)
+            elif entry > self._recent[0]:
+                heapq.heapreplace(self._recent, entry)
+
+    def _apply(self, table: CheckTable, sign: int):
+        if not len(table):
+            return
+        self.total += sign * len(table)
+        self.risk_sum += sign * float(table.risk_score.sum())
+        self.severity_counts += sign * np.bincount(table.severity, minlength=len(SEVERITIES))
+        self.status_counts += sign * np.bincount(table.status, minlength=len(STATUSES))
+
+        n_fw = len(table.frameworks)
+        fw_counts = np.bincount(table.framework, minlength=n_fw)
+        fw_risk = np.bincount(table.framework, weights=table.risk_score, minlength=n_fw)
+        for label, n, risk in zip(table.frameworks, fw_counts.tolist(), fw_risk.tolist()):
+            if n:
+                self.framework_counts[label] += sign * n
+                self.framework_risk[label] += sign * risk
+
+        n_pr = len(table.providers)
+        critical = (table.severity == CRITICAL) & (table.status != PASSING)
+        pr_counts = np.bincount(table.provider, minlength=n_pr)
+        pr_critical = np.bincount(table.provider[critical], minlength=n_pr)
+        for label, n, c in zip(table.providers, pr_counts.tolist(), pr_critical.tolist()):
+            if n:
+                self.provider_counts[label] += sign * n
+                self.provider_critical[label] += sign * c
+
+        hours = table.last_checked.view(np.int64) // _US_PER_HOUR
+        unique_hours, counts = np.unique(hours, return_counts=True)
+        for hour, n in zip(unique_hours.tolist(), counts.tolist()):
+            self.hourly[hour] += sign * n
+
+        # One (hour, label) key per row: hour * number of labels + label code
+        for dim, codes, labels in (("framework", table.framework, table.frameworks),
+                                   ("provider", table.provider, table.providers),
+                                   ("severity", table.severity, _SEVERITY_LABELS),
+                                   ("status", table.status, _STATUS_LABELS)):
+            keys, counts = np.unique(hours * len(labels) + codes, return_counts=True)
+            by_label = self.hourly_by[dim]
+            for key, n in zip(keys.tolist(), counts.tolist()):
+                hour, code = divmod(key, len(labels))
+                label_hours = by_label[labels[code]]
+                label_hours[hour] += sign * n
+                if label_hours[hour] <= 0:
+                    del label_hours[hour]
+                    if not label_hours:
+                        del by_label[labels[code]]
+
+        risk = risk_bin(table.risk_score)
+        for dim, codes, labels in (("framework", table.framework, table.frameworks),
+                                   ("provider", table.provider, table.providers),
+                                   ("severity", table.severity, _SEVERITY_LABELS),
+                                   ("status", table.status, _STATUS_LABELS)):
+            # One row of bins per label code
+            grid = np.bincount(codes * RISK_BINS + risk, minlength=len(labels) * RISK_BINS)
+            grid = grid.reshape(len(labels), RISK_BINS)
+            by_label = self.risk_by[dim]
+            for code in np.flatnonzero(grid.any(axis=1)).tolist():
+                label = labels[code]
+                bins = by_label.get(label)
+                if bins is None:
+                    bins = by_label[label] = np.zeros(RISK_BINS, dtype=np.int64)
+                bins += sign * grid[code]
+                if not bins.any():
+                    del by_label[label]
+
+        # Drop groups that no longer have any rows
+        for counter, extra in ((self.framework_counts, self.framework_risk),
+                               (self.provider_counts, self.provider_critical),
+                               (self.hourly, None)):
+            for key in [k for k, v in counter.items() if v <= 0]:
+                del counter[key]
+                if extra is not None:
+                    extra.pop(key, None)
+
+    @property
+    def critical_count(self) -> int:
+        return int(self.severity_counts[CRITICAL])
+
+    @property
+    def compliant(self) -> int:
+        return int(self.status_counts[PASSING])
+
+    def recent_violations(self) -> List[ComplianceCheck]:
+        """Newest non-passing checks, most recent first"""
+        return [entry[2] for entry in sorted(self._recent, key=lambda entry: entry[:2], reverse=True)]
+
+    def daily_counts(self, since_hour: Optional[int] = None) -> Dict[str, int]:
+        """Checks per UTC day, optionally only from hour buckets >= ``since_hour``"""
+        days: Counter = Counter()
+        for hour, n in self.hourly.items():
+            if since_hour is None or hour >= since_hour:
+                days[hour // 24] += n
+        return {
+            str(np.datetime64(day, "D")): n for day, n in sorted(days.items())
+        }
+
+
+def risk_bin(risk_score: np.ndarray) -> np.ndarray:
+    """Histogram bin of each score: the score rounded (half up) to ``RISK_STEP``"""
+    return np.clip(np.floor(np.asarray(risk_score) / RISK_STEP + 0.5), 0, RISK_BINS - 1).astype(np.int64)
+
+
+def top_recent(table: CheckTable, mask: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the ``k`` newest rows in ``mask``; ties go to the larger id"""
+    idx = np.flatnonzero(mask)
+    ts = table.last_checked[idx].view(np.int64)
+    if len(idx) > k:
+        keep = np.argpartition(-ts, k - 1)[:k]
+        # Include every row tied with the k-th timestamp, their ids decide which are kept
+        keep = np.flatnonzero(ts >= ts[keep].min())
+        idx, ts = idx[keep], ts[keep]
+    keys = list(zip(ts.tolist(), table.ids[idx].tolist()))
+    order = sorted(range(len(idx)), key=keys.__getitem__, reverse=True)[:k]
+    return idx[np.array(order, dtype=np.int64)]
@@ -1,25 +1,116 @@
-import joblib
 import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import Executor
 from datetime import datetime
-from typing import List, Dict, Any
+from threading import Lock
+from typing import Any, List, Dict, Optional, Tuple
 from fastapi import HTTPException
 import warnings
 
+from app.columnar import CheckTable, CRITICAL, HIGH
+from app.metrics import Counter, Histogram, stage
+
+CACHE_LOOKUPS = Counter("compliance_model_cache_lookups_total",
+                        "Distinct feature rows looked up in the prediction cache", ("result",))
+BATCH_ROWS = Histogram("compliance_model_batch_rows", "Feature rows per model call",
+                       buckets=(1, 8, 32, 128, 512, 1024, 4096, 16384))
+
+def build_features(table: CheckTable, positions: np.ndarray) -> np.ndarray:
+    """Model features straight from the stored columns:
+    [is_critical, is_high, risk_score, len(description)]"""
+    severity = table.severity[positions]
+    descriptions = table.description[positions]
+    return np.column_stack([
+        (severity == CRITICAL).astype(np.float64),
+        (severity == HIGH).astype(np.float64),
+        table.risk_score[positions].astype(np.float64),
+        np.fromiter(map(len, descriptions), dtype=np.float64, count=len(descriptions)),
+    ])
+
+def load_model(model_path: str, mmap: bool = False):
+    """Unpickle the model; ``mmap`` maps its arrays read-only instead of copying them"""
+    # joblib (and the sklearn modules the pickle refers to) are only imported here
+    import joblib
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return joblib.load(model_path, mmap_mode="r" if mmap else None)
+
+# Models loaded inside pool worker processes, by path
+_worker_models: Dict[str, Any] = {}
+
+def preload_model(model_path: str, mmap: bool = False) -> Optional[str]:
+    """Load the model in a pool worker ahead of ``predict_batch``; the error
+    message if it cannot be loaded"""
+    try:
+        if model_path not in _worker_models:
+            _worker_models[model_path] = load_model(model_path, mmap)
+    except Exception as e:
+        return str(e)
+    return None
+
+def predict_batch(X: np.ndarray, model_path: str, model=None, mmap: bool = False) -> List[Tuple[str, str, str]]:
+    """(priority, description, action) per feature row.
+
+    In a pool worker ``model`` is None and the model is loaded from
+    ``model_path`` once per process.
+    """
+    if model is None:
+        if model_path not in _worker_models:
+            _worker_models[model_path] = load_model(model_path, mmap)
+        model = _worker_models[model_path]
+    # Your model's API:
+    priorities   = model.predict_priority(X)
+    descriptions = model.predict_description(X)
+    actions      = model.predict_action(X)
+    return [(str(p), str(d), str(a)) for p, d, a in zip(priorities, descriptions, actions)]
+
 class AIModel:
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, batch_size: int = 1024, cache_size: int = 100_000,
+                 executor: Optional[Executor] = None, mmap: bool = False):
+        # Only loaded here without an executor; the pool workers load their own
         self.model = None
-        try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                self.model = joblib.load(model_path)
-        except Exception as e:
-            print(f"Warning: Failed to load model from {model_path}: {e}")
-            print("AI model will use fallback implementation")
-            self.model = None
+        self.available = False
+        self.model_path = model_path
+        self.mmap = mmap
+        # Batches run here when set (e.g. a process pool); otherwise in the calling thread
+        self.executor = executor
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        # Feature-row hash -> (priority, description, action), least recently used first
+        self._cache: "OrderedDict[int, Tuple[str, str, str]]" = OrderedDict()
+        self._cache_lock = Lock()
+        # The model is loaded by ``load()``: at warm-up, or by the first request needing it
+        self.loaded = False
+        self._load_lock = Lock()
 
-    def generate_insights(self, violations: List[Dict[str, Any]]) -> Dict:
+    def load(self):
+        """Load the model once, or with an executor have one worker load it; on
+        failure insights use the fallback implementation"""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            try:
+                if self.executor is not None:
+                    # The web process never calls the model, so it need not hold a copy
+                    error = self.executor.submit(preload_model, self.model_path, self.mmap).result()
+                else:
+                    self.model = load_model(self.model_path, self.mmap)
+                    error = None
+            except Exception as e:
+                error = str(e)
+            if error is not None:
+                print(f"Warning: Failed to load model from {self.model_path}: {error}")
+                print("AI model will use fallback implementation")
+            self.available = error is None
+            self.loaded = True
+
+    def generate_insights(self, table: CheckTable, positions: np.ndarray) -> Dict:
+        """Insights for the violations at ``positions`` in ``table``"""
         # Guarantee structured output even if no violations
-        if not violations:
+        if not len(positions):
             return {
                 "summary": {
                     "total_violations": 0,
@@ -30,67 +121,97 @@ class AIModel:
                 "recommendations": []
             }
 
+        self.load()
         try:
             # If model is not available, use fallback logic
-            if self.model is None:
-                return self._fallback_insights(violations)
-
-            # Feature‐engineering
-            X = np.array([
-                [
-                    1 if v["severity"] == "Critical" else 0,
-                    1 if v["severity"] == "High" else 0,
-                    v["risk_score"],
-                    len(v["description"])
-                ] for v in violations
-            ])
-
-            # Your model's API:
-            priorities   = self.model.predict_priority(X)
-            descriptions = self.model.predict_description(X)
-            actions      = self.model.predict_action(X)
-
-            recs = [
-                {"priority": p, "description": d, "action": a}
-                for p, d, a in zip(priorities, descriptions, actions)
-            ]
+            if not self.available:
+                return self._fallback_insights(table, positions)
 
+            X = build_features(table, positions)
             return {
-                "summary": {
-                    "total_violations": len(violations),
-                    "critical_violations": sum(v["severity"] == "Critical" for v in violations),
-                    "frameworks_affected": len({v["framework"] for v in violations}),
-                    "last_updated": datetime.utcnow().isoformat()
-                },
-                "recommendations": recs
+                "summary": self._summary(table, positions),
+                "recommendations": self._predict(X)
             }
 
         except Exception as e:
             print(f"AI inference failed: {e}, using fallback")
-            return self._fallback_insights(violations)
+            return self._fallback_insights(table, positions)
+
+    def _predict(self, X: np.ndarray) -> List[Dict[str, str]]:
+        """Run the model only on feature rows not seen before, in fixed-size batches"""
+        keys = pd.util.hash_pandas_object(pd.DataFrame(X), index=False).to_numpy()
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        unique_keys = unique_keys.tolist()
+
+        with self._cache_lock:
+            results = []
+            for key in unique_keys:
+                hit = self._cache.get(key)
+                if hit is not None:
+                    self._cache.move_to_end(key)
+                results.append(hit)
+        missing = [i for i, r in enumerate(results) if r is None]
+        CACHE_LOOKUPS.inc(len(results) - len(missing), result="hit")
+        CACHE_LOOKUPS.inc(len(missing), result="miss")
+
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        inputs = [X[first[batch]] for batch in batches]
+        if batches:
+            for batch in batches:
+                BATCH_ROWS.observe(len(batch))
+            with stage("model_inference"):
+                if self.executor is not None:
+                    # Only the feature rows go to the workers; predictions come back pickled
+                    outputs = self.executor.map(predict_batch, inputs, [self.model_path] * len(inputs),
+                                                [None] * len(inputs), [self.mmap] * len(inputs))
+                else:
+                    outputs = (predict_batch(Xb, self.model_path, self.model) for Xb in inputs)
+                for batch, predictions in zip(batches, outputs):
+                    for i, prediction in zip(batch, predictions):
+                        results[i] = prediction
+
+        if missing:
+            with self._cache_lock:
+                for i in missing:
+                    self._cache[unique_keys[i]] = results[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        recs = [{"priority": p, "description": d, "action": a} for p, d, a in results]
+        return [recs[i] for i in inverse.tolist()]
 
-    def _fallback_insights(self, violations: List[Dict[str, Any]]) -> Dict:
+    @staticmethod
+    def _summary(table: CheckTable, positions: np.ndarray) -> Dict:
+        return {
+            "total_violations": len(positions),
+            "critical_violations": int((table.severity[positions] == CRITICAL).sum()),
+            "frameworks_affected": len(np.unique(table.framework[positions])),
+            "last_updated": datetime.utcnow().isoformat()
+        }
+
+    def _fallback_insights(self, table: CheckTable, positions: np.ndarray) -> Dict:
         """Fallback implementation when model is not available"""
-        critical_violations = [v for v in violations if v["severity"] == "Critical"]
-        high_violations = [v for v in violations if v["severity"] == "High"]
-        
+        severity = table.severity[positions]
+        critical_violations = int((severity == CRITICAL).sum())
+        high_violations = int((severity == HIGH).sum())
+
         recommendations = []
-        
+
         if critical_violations:
             recommendations.append({
                 "priority": "High",
-                "description": f"Address {len(critical_violations)} critical violations immediately",
+                "description": f"Address {critical_violations} critical violations immediately",
                 "action": "Review and fix critical compliance issues"
             })
-        
+
         if high_violations:
             recommendations.append({
-                "priority": "Medium", 
-                "description": f"Address {len(high_violations)} high-severity violations",
+                "priority": "Medium",
+                "description": f"Address {high_violations} high-severity violations",
                 "action": "Schedule remediation for high-priority issues"
             })
-        
-        if len(violations) > len(critical_violations) + len(high_violations):
+
+        if len(positions) > critical_violations + high_violations:
             recommendations.append({
                 "priority": "Low",
                 "description": "Review remaining compliance violations",
@@ -98,11 +219,6 @@ class AIModel:
             })
 
         return {
-            "summary": {
-                "total_violations": len(violations),
-                "critical_violations": len(critical_violations),
-                "frameworks_affected": len({v["framework"] for v in violations}),
-                "last_updated": datetime.utcnow().isoformat()
-            },
+            "summary": self._summary(table, positions),
             "recommendations": recommendations
-        }
\ No newline at end of file
+        }
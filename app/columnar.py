@@ -0,0 +1,283 @@
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.models import ComplianceCheck, SeverityLevel, StatusLevel
+
+# Fixed code order for the enum columns: code == position in these tuples
+SEVERITIES = tuple(SeverityLevel)
+STATUSES = tuple(StatusLevel)
+
+CRITICAL = SEVERITIES.index(SeverityLevel.CRITICAL)
+HIGH = SEVERITIES.index(SeverityLevel.HIGH)
+PASSING = STATUSES.index(StatusLevel.PASSING)
+FAILING = STATUSES.index(StatusLevel.FAILING)
+
+COLUMNS = (
+    "ids", "framework", "provider", "severity", "status",
+    "risk_score", "description", "last_checked", "ai_summary",
+)
+# Typical size of a short Python str, for memory estimates of object columns
+OBJECT_BYTES = 64
+
+
+def column_bytes(column) -> int:
+    """Bytes held by one column; Python objects count ``OBJECT_BYTES`` each"""
+    if isinstance(column, np.ndarray):
+        return column.nbytes + (len(column) * OBJECT_BYTES if column.dtype == object else 0)
+    return column.nbytes
+
+
+def to_naive_utc(values, **kwargs) -> np.ndarray:
+    """Parse timestamps into naive UTC datetime64[us] (tz-aware inputs are converted)"""
+    ts = pd.to_datetime(pd.Series(values), utc=True, **kwargs).dt.tz_convert(None)
+    return ts.to_numpy(dtype="datetime64[us]")
+
+
+class CheckTable:
+    """Immutable, column-oriented set of compliance checks.
+
+    ``framework``/``provider`` are categorical codes into the ``frameworks``/
+    ``providers`` label tuples, ``severity``/``status`` are codes into
+    ``SEVERITIES``/``STATUSES``. Pydantic objects are only built on demand
+    through ``rows()``.
+    """
+
+    __slots__ = COLUMNS + ("frameworks", "providers", "_indexes")
+
+    def __init__(self, ids, framework, provider, severity, status, risk_score,
+                 description, last_checked, ai_summary,
+                 frameworks: Sequence[str], providers: Sequence[str]):
+        self.ids = ids
+        self.framework = framework
+        self.provider = provider
+        self.severity = severity
+        self.status = status
+        self.risk_score = risk_score
+        self.description = description
+        self.last_checked = last_checked
+        self.ai_summary = ai_summary
+        self.frameworks = tuple(frameworks)
+        self.providers = tuple(providers)
+        self._indexes = None
+
+    @classmethod
+    def empty(cls) -> "CheckTable":
+        return cls(
+            ids=np.empty(0, dtype=object),
+            framework=np.empty(0, dtype=np.int32),
+            provider=np.empty(0, dtype=np.int32),
+            severity=np.empty(0, dtype=np.int8),
+            status=np.empty(0, dtype=np.int8),
+            risk_score=np.empty(0, dtype=np.float64),
+            description=np.empty(0, dtype=object),
+            last_checked=np.empty(0, dtype="datetime64[us]"),
+            ai_summary=np.empty(0, dtype=object),
+            frameworks=(), providers=(),
+        )
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "CheckTable":
+        """Build a table from an already validated DataFrame.
+
+        ``severity``/``status`` must hold enum values and ``last_checked``
+        naive UTC timestamps (see ``to_naive_utc``).
+        """
+        framework = pd.Categorical(df["framework"])
+        provider = pd.Categorical(df["provider"])
+        ai_summary = df["ai_summary"] if "ai_summary" in df.columns else pd.Series([None] * len(df))
+        return cls(
+            ids=df["id"].astype(str).to_numpy(dtype=object),
+            framework=framework.codes.astype(np.int32),
+            provider=provider.codes.astype(np.int32),
+            severity=pd.Categorical(df["severity"], categories=[s.value for s in SEVERITIES]).codes.astype(np.int8),
+            status=pd.Categorical(df["status"], categories=[s.value for s in STATUSES]).codes.astype(np.int8),
+            risk_score=df["risk_score"].to_numpy(dtype=np.float64),
+            description=df["description"].to_numpy(dtype=object),
+            last_checked=df["last_checked"].to_numpy(dtype="datetime64[us]"),
+            ai_summary=ai_summary.astype(object).where(ai_summary.notna(), None).to_numpy(dtype=object),
+            frameworks=[str(c) for c in framework.categories],
+            providers=[str(c) for c in provider.categories],
+        )
+
+    @classmethod
+    def from_checks(cls, checks: Sequence[ComplianceCheck]) -> "CheckTable":
+        if not checks:
+            return cls.empty()
+        df = pd.DataFrame([c.dict() for c in checks])
+        df["severity"] = [c.severity.value for c in checks]
+        df["status"] = [c.status.value for c in checks]
+        df["last_checked"] = to_naive_utc(df["last_checked"])
+        return cls.from_frame(df)
+
+    @staticmethod
+    def concat(tables: Sequence["CheckTable"]) -> "CheckTable":
+        """Concatenate tables, merging their category label sets"""
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return CheckTable.empty()
+        if len(tables) == 1:
+            return tables[0]
+
+        def merge(attr, labels_attr):
+            labels = sorted({label for t in tables for label in getattr(t, labels_attr)})
+            position = {label: i for i, label in enumerate(labels)}
+            codes = [
+                np.array([position[label] for label in getattr(t, labels_attr)], dtype=np.int32)[getattr(t, attr)]
+                if len(getattr(t, labels_attr)) else getattr(t, attr)
+                for t in tables
+            ]
+            return np.concatenate(codes), labels
+
+        framework, frameworks = merge("framework", "frameworks")
+        provider, providers = merge("provider", "providers")
+        return CheckTable(
+            ids=np.concatenate([t.ids for t in tables]),
+            framework=framework,
+            provider=provider,
+            severity=np.concatenate([t.severity for t in tables]),
+            status=np.concatenate([t.status for t in tables]),
+            risk_score=np.concatenate([t.risk_score for t in tables]),
+            description=np.concatenate([t.description for t in tables]),
+            last_checked=np.concatenate([t.last_checked for t in tables]),
+            ai_summary=np.concatenate([t.ai_summary for t in tables]),
+            frameworks=frameworks,
+            providers=providers,
+        )
+
+    def apply_delta(self, positions: np.ndarray, updates: "CheckTable",
+                    inserts: "CheckTable", delete: Optional[np.ndarray] = None) -> "CheckTable":
+        """Return a new table with ``updates`` written over the rows at ``positions``,
+        rows at ``delete`` (positions) dropped and ``inserts`` appended"""
+        n = len(self)
+        combined = CheckTable.concat([self, updates, inserts])
+        order = np.arange(n)
+        order[positions] = n + np.arange(len(updates))
+        if delete is not None and len(delete):
+            keep = np.ones(n, dtype=bool)
+            keep[delete] = False
+            order = order[keep]
+        order = np.concatenate([order, n + len(updates) + np.arange(len(inserts))])
+        table = combined.take(order)
+        if self._indexes is not None:
+            self._indexes.derive(table, CheckTable.concat([updates, inserts]), order)
+        return table
+
+    def same_rows(self, other: "CheckTable") -> np.ndarray:
+        """Row-wise equality with an equally long table (labels compared, not codes)"""
+        same = np.ones(len(self), dtype=bool)
+        for col in ("ids", "severity", "status", "risk_score", "description", "last_checked", "ai_summary"):
+            same &= getattr(self, col) == getattr(other, col)
+        same &= self.framework_labels() == other.framework_labels()
+        same &= self.provider_labels() == other.provider_labels()
+        return same
+
+    def framework_labels(self) -> np.ndarray:
+        return np.asarray(self.frameworks, dtype=object)[self.framework] if len(self) else np.empty(0, dtype=object)
+
+    def provider_labels(self) -> np.ndarray:
+        return np.asarray(self.providers, dtype=object)[self.provider] if len(self) else np.empty(0, dtype=object)
+
+    @property
+    def indexes(self):
+        """Secondary indexes over this table (see app.indexes), built lazily"""
+        if self._indexes is None:
+            from app.indexes import TableIndexes
+            self._indexes = TableIndexes(self)
+        return self._indexes
+
+    @property
+    def index_bytes(self) -> int:
+        """Memory of the secondary indexes built so far"""
+        return self._indexes.nbytes if self._indexes is not None else 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory of the columns (memory-mapped ones count in full)"""
+        return sum(column_bytes(getattr(self, col)) for col in COLUMNS)
+
+    def __iter__(self) -> Iterator[ComplianceCheck]:
+        # Kept for callers that still treat the store as a list of checks
+        return iter(self.rows())
+
+    def take(self, idx) -> "CheckTable":
+        """Return the rows at ``idx`` (positions or boolean mask) as a new table"""
+        return CheckTable(
+            **{col: getattr(self, col)[idx] for col in COLUMNS},
+            frameworks=self.frameworks,
+            providers=self.providers,
+        )
+
+    def mask(self, framework: Optional[str] = None, provider: Optional[str] = None,
+             severity: Optional[str] = None, status: Optional[str] = None) -> np.ndarray:
+        """Boolean row mask for exact-match filters; unknown values match nothing"""
+        mask = np.ones(len(self), dtype=bool)
+        for value, codes, labels in (
+            (framework, self.framework, self.frameworks),
+            (provider, self.provider, self.providers),
+            (severity, self.severity, [s.value for s in SEVERITIES]),
+            (status, self.status, [s.value for s in STATUSES]),
+        ):
+            if value is None:
+                continue
+            if value not in labels:
+                return np.zeros(len(self), dtype=bool)
+            mask &= codes == list(labels).index(value)
+        return mask
+
+    def present_frameworks(self) -> List[str]:
+        """Sorted framework labels that occur in at least one row"""
+        return _present(self.framework, self.frameworks)
+
+    def present_providers(self) -> List[str]:
+        """Sorted provider labels that occur in at least one row"""
+        return _present(self.provider, self.providers)
+
+    def records(self, idx=None) -> List[Dict]:
+        """Plain dict rows (enum values as strings) without pydantic overhead"""
+        idx = np.arange(len(self)) if idx is None else np.asarray(idx)
+        frameworks, providers = self.frameworks, self.providers
+        return [
+            {
+                "id": id_,
+                "framework": frameworks[fw],
+                "provider": providers[pr],
+                "severity": SEVERITIES[sev].value,
+                "status": STATUSES[st].value,
+                "risk_score": risk,
+                "description": desc,
+                "last_checked": ts,
+                "ai_summary": summary,
+            }
+            for id_, fw, pr, sev, st, risk, desc, ts, summary in zip(
+                self.ids[idx].tolist(),
+                self.framework[idx].tolist(),
+                self.provider[idx].tolist(),
+                self.severity[idx].tolist(),
+                self.status[idx].tolist(),
+                self.risk_score[idx].tolist(),
+                self.description[idx].tolist(),
+                self.last_checked[idx].tolist(),
+                self.ai_summary[idx].tolist(),
+            )
+        ]
+
+    def rows(self, idx=None) -> List[ComplianceCheck]:
+        """Materialize ComplianceCheck objects for the given positions only.
+
+        Rows were validated on ingest, so ``model_construct`` skips re-validation.
+        """
+        rows = self.records(idx)
+        for r in rows:
+            r["severity"] = SeverityLevel(r["severity"])
+            r["status"] = StatusLevel(r["status"])
+        return [ComplianceCheck.model_construct(**r) for r in rows]
+
+
+def _present(codes: np.ndarray, labels: Sequence[str]) -> List[str]:
+    counts = np.bincount(codes, minlength=len(labels))
+    return sorted(label for label, n in zip(labels, counts) if n)
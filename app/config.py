@@ -1,10 +1,35 @@
 from pydantic_settings import BaseSettings
+import os
 from typing import List
 
 class Settings(BaseSettings):
     frontend_url: str = "*"
     model_path: str
     log_level: str = "INFO"
+    # Rows per model call, and how many distinct feature rows keep a cached prediction
+    ai_batch_size: int = 1024
+    ai_cache_size: int = 100_000
+    # Memory-map the model's arrays (joblib mmap_mode="r") so processes share them; needs an uncompressed dump
+    model_mmap: bool = False
+    # Directory holding the columnar segments and write-ahead log
+    data_dir: str = "compliance_data"
+    # "columnar" (in-memory snapshots over data_dir) or "sqlite" (queries pushed down to sqlite_path)
+    storage_backend: str = "columnar"
+    sqlite_path: str = "compliance_data.sqlite3"
+    # Versions kept for /history and /diff (unchanged rows are stored once); 0 disables history
+    history_versions: int = 20
+    # Header naming a request's tenant (a /tenants/<id> path prefix works too); none means the default tenant
+    tenant_header: str = "X-Tenant-ID"
+    # Directory holding the other tenants' data, a subdirectory (or SQLite file) each
+    tenants_dir: str = "compliance_tenants"
+    # Estimated memory resident tenant stores may take before the least recently used are unloaded
+    tenant_memory_mb: int = 2048
+    # Seconds between checks for new data while /dashboard/stream has subscribers
+    live_poll_interval: float = 0.5
+    # Bytes of CSV read, parsed and validated at a time by /upload
+    upload_chunk_size: int = 8 * 1024 * 1024
+    # Processes for CSV parsing and model inference per web worker; 0 runs them on threads instead
+    worker_processes: int = min(4, os.cpu_count() or 1)
 
     @property
     def frontend_url_list(self) -> List[str]:
@@ -1,64 +1,448 @@
 import json
 import os
-from typing import List
-from app.models import ComplianceCheck
 from datetime import datetime
+from threading import Lock, RLock
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app import startup
+from app.aggregates import Aggregates
+from app.columnar import CheckTable, PASSING
+from app.config import settings
+from app.history import History
+from app.indexes import query_checks, search_checks
+from app.metrics import Gauge, stage
+from app.models import ComplianceCheck
+from app.storage import ColumnarStorage, directory_bytes, table_from_json
+from app.tenants import DEFAULT_TENANT, TenantStores
+
+# The WAL is compacted into a new segment once it holds more rows than this
+# (or than the dataset itself, whichever is larger)
+COMPACT_MIN_ROWS = 10_000
+# Rows materialized at a time by the streaming endpoints
+STREAM_BATCH_ROWS = 1_000
+# Memory of one id index entry (dict slot and int), for memory estimates
+INDEX_ENTRY_BYTES = 100
+
+class Snapshot:
+    """One published version of the dataset.
+
+    Never mutated after it is published: writers build the next table and
+    aggregates alongside it and swap the store's reference, so a reader that
+    took a snapshot sees one consistent version for the whole request.
+    """
+
+    def __init__(self, version: int, table: CheckTable, aggregates: Aggregates, epoch: str = ""):
+        self.version = version
+        self.table = table
+        self.aggregates = aggregates
+        self.created_at = datetime.utcnow()
+        # Distinguishes versions counted by different processes/restarts
+        self.etag = f'W/"{epoch}-{version}"'
+        self._memo: Dict[Any, Any] = {}
+        self._memo_lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def memo(self, key, compute: Callable[[], Any]):
+        """``compute()`` once per snapshot and key; later calls reuse the result"""
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        value = compute()
+        with self._memo_lock:
+            return self._memo.setdefault(key, value)
+
+    # Queries the read endpoints run against a snapshot; SqliteSnapshot
+    # answers the same ones with SQL
+
+    def page(self, filters: Dict[str, Optional[str]], sort: Optional[str] = None, cursor: Optional[str] = None,
+             offset: int = 0, limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """One page of ``/checks`` as plain records, and the cursor of the next one
+        (see ``query_checks``)"""
+        page = query_checks(self.table, filters, sort=sort, cursor=cursor, offset=offset, limit=limit)
+        return self.table.records(page.positions), page.next_cursor
+
+    def stream(self, filters: Dict[str, Optional[str]], sort: Optional[str] = None, cursor: Optional[str] = None,
+               offset: int = 0, limit: Optional[int] = None) -> Iterator[List[Dict]]:
+        """Like ``page`` without a default limit, as batches of plain records.
+
+        Invalid cursors raise here, before anything is streamed; rows are
+        only built one batch at a time as the iterator is consumed.
+        """
+        page = query_checks(self.table, filters, sort=sort, cursor=cursor, offset=offset,
+                            limit=len(self.table) if limit is None else limit)
+        return self._batches(page.positions)
+
+    def search(self, query: str, filters: Dict[str, Optional[str]], offset: int = 0,
+               limit: int = 20) -> Tuple[List[Dict], int]:
+        """One page of ``/checks/search`` as records with a ``score``, best first,
+        and the number of matching rows"""
+        positions, scores, total = search_checks(self.table, query, filters, offset=offset, limit=limit)
+        rows = self.table.records(positions)
+        for row, score in zip(rows, scores.tolist()):
+            row["score"] = round(score, 4)
+        return rows, total
+
+    def stream_violations(self) -> Iterator[List[Dict]]:
+        return self._batches(np.flatnonzero(self.table.status != PASSING))
+
+    def _batches(self, positions: np.ndarray) -> Iterator[List[Dict]]:
+        for start in range(0, len(positions), STREAM_BATCH_ROWS):
+            yield self.table.records(positions[start:start + STREAM_BATCH_ROWS])
+
+    def frameworks(self) -> List[str]:
+        return self.table.present_frameworks()
+
+    def providers(self) -> List[str]:
+        return self.table.present_providers()
+
+    def violations(self) -> CheckTable:
+        """The non-passing checks"""
+        return self.table.take(self.table.status != PASSING)
 
 class DataStore:
-    def __init__(self, storage_file: str = "compliance_data.json"):
-        self.storage_file = storage_file
-        self._store: List[ComplianceCheck] = []
-        self.load_data()
-    
+    """The current snapshot of the dataset, kept in step with ``storage``.
+
+    Several processes (uvicorn workers) may share one storage directory:
+    writers take its exclusive lock and first catch up with changes other
+    processes made; readers compare the storage's change counter with their
+    snapshot's version and catch up when it moved.
+    """
+
+    def __init__(self, storage_dir: str = "compliance_data", legacy_file: Optional[str] = "compliance_data.json"):
+        self.storage = ColumnarStorage(storage_dir)
+        # Pretty-printed JSON written by earlier versions, migrated on first load
+        self.legacy_file = legacy_file
+        self._snapshot = Snapshot(0, CheckTable.empty(), Aggregates(), self.storage.store_id)
+        # Hash index: check id -> row position in the current table, built on first write
+        self._index: Optional[Dict[str, int]] = None
+        # Syncs and writes run on threadpool/ingestion threads; one at a time. Readers never lock.
+        self._write_lock = RLock()
+        # Past versions for /history and /diff
+        self.history: Optional[History] = None
+        if settings.history_versions > 0:
+            self.history = History(os.path.join(storage_dir, "history"), settings.history_versions)
+        # The stored data is loaded by ``ensure_loaded()``: at warm-up, or on first use
+        self.loaded = False
+        self._load_lock = Lock()
+
+    def ensure_loaded(self):
+        """Load the stored data unless that already happened; concurrent callers wait for it"""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if not self.loaded:
+                self.load_data()
+                self.loaded = True
+
+    def _next(self, table: CheckTable, aggregates: Aggregates, version: Optional[int] = None) -> Snapshot:
+        if version is None:
+            version = self.storage.changes()
+        return Snapshot(version, table, aggregates, self.storage.store_id)
+
+    def _publish(self, snapshot: Snapshot):
+        # A single reference assignment: readers see the old or the new version, nothing between
+        self._snapshot = snapshot
+
+    def _commit(self, snapshot: Snapshot):
+        """Publish a change this process wrote; call while holding the exclusive lock"""
+        snapshot.version = self.storage.bump_changes()
+        snapshot.etag = f'W/"{self.storage.store_id}-{snapshot.version}"'
+        self._publish(snapshot)
+
     def load_data(self):
-        """Load data from file if it exists"""
-        if os.path.exists(self.storage_file):
+        """Memory-map the stored columns and replay the write-ahead log"""
+        with self._write_lock, self.storage.lock():
             try:
-                with open(self.storage_file, 'r') as f:
-                    data = json.load(f)
-                    self._store = [ComplianceCheck(**item) for item in data]
-                print(f"Loaded {len(self._store)} records from {self.storage_file}")
+                if self.storage.exists():
+                    self._sync(reload=True)
+                    print(f"Loaded {len(self._snapshot)} records from {self.storage.directory}")
+                    if self.storage.wal_rows:
+                        print(f"Replayed {self.storage.wal_rows} logged changes from {self.storage.wal_file}")
+                elif self.legacy_file and os.path.exists(self.legacy_file):
+                    self._migrate_legacy()
             except Exception as e:
-                print(f"Error loading data from {self.storage_file}: {e}")
-                self._store = []
+                print(f"Error loading data from {self.storage.directory}: {e}")
+                self._publish(self._next(CheckTable.empty(), Aggregates()))
+                self._index = None
+
+    def _sync(self, reload: bool = False):
+        """Catch up with changes committed by other processes; hold the storage lock"""
+        if not self.storage.exists():
+            return
+        version = self.storage.changes()
+        if reload or self.storage.live_generation() != self.storage.generation:
+            table, aggregates = self.storage.load()
+            if aggregates is None:
+                with stage("aggregation"):
+                    aggregates = Aggregates.from_table(table)
+            current = (table, aggregates)
+            self._index = None
+            offset = 0
+        elif version != self._snapshot.version:
+            current = (self._snapshot.table, self._snapshot.aggregates)
+            offset = self.storage.wal_offset
         else:
-            self._store = []
-    
-    def save_data(self):
-        """Save data to file"""
+            return
+        for records, delete_ids in self.storage.read_wal(offset):
+            current = self._upsert(*current, records, delete_ids)[:2]
+        self._publish(self._next(*current, version=version))
+
+    def refresh(self, blocking: bool = True):
+        """Pick up changes committed by other processes.
+
+        Non-blocking refreshes give up while another thread or process is
+        writing, leaving the current snapshot in place.
+        """
+        if not self._write_lock.acquire(blocking=blocking):
+            return
         try:
-            # Convert ComplianceCheck objects to dictionaries for JSON serialization
-            data = []
-            for item in self._store:
-                item_dict = item.dict()
-                # Convert datetime to string for JSON serialization
-                if isinstance(item_dict['last_checked'], datetime):
-                    item_dict['last_checked'] = item_dict['last_checked'].isoformat()
-                data.append(item_dict)
-            
-            with open(self.storage_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            print(f"Saved {len(self._store)} records to {self.storage_file}")
+            with self.storage.lock(shared=True, blocking=blocking) as locked:
+                if locked:
+                    self._sync()
+        finally:
+            self._write_lock.release()
+
+    def _migrate_legacy(self):
+        with open(self.legacy_file, 'r') as f:
+            table = table_from_json(json.load(f))
+        current = (table, Aggregates.from_table(table))
+        journal = os.path.splitext(self.legacy_file)[0] + ".journal"
+        if os.path.exists(journal):
+            with open(journal, 'r') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    current = self._upsert(*current, table_from_json(entry["upsert"]), entry["delete"])[:2]
+        snapshot = self._next(*current)
+        print(f"Migrated {len(snapshot)} records from {self.legacy_file}")
+        self.save_data(snapshot)
+        self._commit(snapshot)
+        self._record(snapshot)
+
+    def save_data(self, snapshot: Optional[Snapshot] = None):
+        """Write the full dataset as a new segment (also compacts the WAL).
+
+        Write errors propagate: a change that was not stored must not be published.
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+        with stage("store_write"):
+            self.storage.write_snapshot(snapshot.table, snapshot.aggregates)
+        print(f"Saved {len(snapshot)} records to {self.storage.directory}")
+
+    def _record(self, snapshot: Snapshot, records: Optional[CheckTable] = None, delete_ids: Sequence[str] = ()):
+        """Add a committed version to the history; call while holding the exclusive lock"""
+        if self.history is None:
+            return
+        try:
+            self.history.record(snapshot.version, lambda: snapshot.table, records, delete_ids)
         except Exception as e:
-            print(f"Error saving data to {self.storage_file}: {e}")
-    
-    def set_data(self, records: List[ComplianceCheck]):
+            print(f"Error recording version {snapshot.version} in {self.history.directory}: {e}")
+
+    def _log_change(self, records: CheckTable, delete_ids: Sequence[str], snapshot: Snapshot):
+        """Append one upsert to the WAL, or compact once the WAL outgrows the data"""
+        if (not self.storage.exists()
+                or self.storage.wal_rows + len(records) + len(delete_ids) > max(len(snapshot), COMPACT_MIN_ROWS)):
+            self.save_data(snapshot)
+            return
+        with stage("store_write"):
+            self.storage.append_wal(records, delete_ids)
+
+    def _ensure_index(self, table: CheckTable) -> Dict[str, int]:
+        if self._index is None:
+            self._index = dict(zip(table.ids.tolist(), range(len(table))))
+        return self._index
+
+    def set_data(self, records: Union[CheckTable, List[ComplianceCheck]]):
         """Set new data and save to file"""
-        self._store = records
-        self.save_data()
-    
-    def get_data(self) -> List[ComplianceCheck]:
+        if not isinstance(records, CheckTable):
+            records = CheckTable.from_checks(records)
+        self.ensure_loaded()
+        with self._write_lock, self.storage.lock():
+            # Catch up first, or the new segment would be numbered from a stale generation
+            self._sync()
+            with stage("aggregation"):
+                aggregates = Aggregates.from_table(records)
+            snapshot = self._next(records, aggregates)
+            self.save_data(snapshot)
+            self._index = None
+            self._commit(snapshot)
+            self._record(snapshot)
+
+    def replace_data(self, chunks: Iterable[CheckTable]) -> int:
+        """Replace every row with the rows of ``chunks``, each written to disk as it
+        arrives so only one is held in memory; returns the number of rows.
+
+        Readers keep the previous version until the last chunk is written and
+        the new segment is published.
+        """
+        self.ensure_loaded()
+        writer = self.storage.segment_writer()
+        try:
+            aggregates = Aggregates()
+            for chunk in chunks:
+                with stage("aggregation"):
+                    aggregates.add(chunk)
+                with stage("store_write"):
+                    writer.append(chunk)
+            with self._write_lock, self.storage.lock():
+                with stage("store_write"):
+                    self.storage.publish(writer, aggregates)
+                print(f"Saved {writer.rows} records to {self.storage.directory}")
+                snapshot = self._next(self.storage.load()[0], aggregates)
+                self._index = None
+                self._commit(snapshot)
+                self._record(snapshot)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.rows
+
+    def append_data(self, records: CheckTable):
+        """Append rows, folding only the new rows into the aggregates"""
+        self.upsert_data(records)
+
+    def upsert_data(self, records: CheckTable, delete_ids: Sequence[str] = ()) -> Dict[str, int]:
+        """Insert or update rows by id and delete ``delete_ids``.
+
+        Only the delta is logged and folded into the aggregates; the new
+        version is published once it is logged.
+        """
+        self.ensure_loaded()
+        with self._write_lock, self.storage.lock():
+            self._sync()
+            table, aggregates, counts = self._upsert(
+                self._snapshot.table, self._snapshot.aggregates, records, delete_ids
+            )
+            if counts["inserted"] or counts["updated"] or counts["deleted"]:
+                snapshot = self._next(table, aggregates)
+                self._log_change(records, delete_ids, snapshot)
+                self._commit(snapshot)
+                self._record(snapshot, records, delete_ids)
+        return counts
+
+    def _upsert(self, table: CheckTable, aggregates: Aggregates, records: CheckTable,
+                delete_ids: Sequence[str]) -> Tuple[CheckTable, Aggregates, Dict[str, int]]:
+        """``table`` and ``aggregates`` with ``records`` upserted and ``delete_ids``
+        deleted; the inputs are left untouched, ``_index`` follows the result"""
+        index = self._ensure_index(table)
+        # Last occurrence of an id within one batch wins
+        if len(records):
+            records = records.take(~pd.Index(records.ids).duplicated(keep="last"))
+        ids = records.ids.tolist()
+        positions = np.fromiter((index.get(i, -1) for i in ids), dtype=np.int64, count=len(ids))
+        existing = positions >= 0
+
+        updates = records.take(existing)
+        update_positions = positions[existing]
+        changed = ~table.take(update_positions).same_rows(updates)
+        updates, update_positions = updates.take(changed), update_positions[changed]
+        inserts = records.take(~existing)
+
+        incoming = set(ids)
+        delete_positions = np.array(
+            sorted({index[i] for i in delete_ids if i in index and i not in incoming}),
+            dtype=np.int64,
+        )
+
+        # Copy-on-write: the published aggregates stay as they are
+        with stage("aggregation"):
+            aggregates = aggregates.copy()
+            aggregates.remove(table.take(np.concatenate([update_positions, delete_positions])))
+            aggregates.add(CheckTable.concat([updates, inserts]))
+
+        n = len(table)
+        table = table.apply_delta(update_positions, updates, inserts, delete_positions)
+        if len(delete_positions):
+            self._index = None
+        else:
+            index.update(zip(inserts.ids.tolist(), range(n, n + len(inserts))))
+        aggregates.refresh_recent(table)
+
+        return table, aggregates, {
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "unchanged": int((~changed).sum()),
+            "deleted": len(delete_positions),
+        }
+
+    def delete_ids(self, ids: Sequence[str]) -> int:
+        """Delete checks by id; returns how many existed"""
+        return self.upsert_data(CheckTable.empty(), ids)["deleted"]
+
+    def snapshot(self) -> Snapshot:
+        """The current version; hold on to it for the rest of a request"""
+        self.ensure_loaded()
+        if self.storage.changes() != self._snapshot.version:
+            # Readers never wait for a writer; they catch up on a later request
+            self.refresh(blocking=False)
+        return self._snapshot
+
+    def get_data(self) -> CheckTable:
         """Get current data"""
-        return self._store
-    
+        return self.snapshot().table
+
+    def get_aggregates(self) -> Aggregates:
+        """Get the materialized counts for the current data"""
+        return self.snapshot().aggregates
+
     def clear_data(self):
         """Clear all data"""
-        self._store = []
-        self.save_data()
-    
+        self.set_data(CheckTable.empty())
+
     def is_empty(self) -> bool:
         """Check if store is empty"""
-        return len(self._store) == 0
+        return len(self.snapshot()) == 0
+
+    def index_text(self):
+        """Build the full-text index of the current version, so the first search
+        doesn't; later upserts carry it forward, tokenizing only new texts"""
+        with stage("text_index"):
+            self.snapshot().table.indexes.text.pairs()
+
+    def disk_bytes(self) -> int:
+        """Size of the segments, WAL and history on disk"""
+        total = self.storage.disk_bytes()
+        if self.history is not None:
+            total += directory_bytes(self.history.directory)
+        return total
+
+    def memory_bytes(self) -> int:
+        """Estimated memory of the current version's columns and indexes"""
+        index = len(self._index) * INDEX_ENTRY_BYTES if self._index is not None else 0
+        return self._snapshot.table.nbytes + self._snapshot.table.index_bytes + index
+
+def create_store(tenant: str = DEFAULT_TENANT):
+    """The store ``settings.storage_backend`` selects for ``tenant`` (not loaded yet)"""
+    if settings.storage_backend == "sqlite":
+        from app.sqlite_store import SqliteStore
+        if tenant == DEFAULT_TENANT:
+            return SqliteStore(settings.sqlite_path)
+        os.makedirs(settings.tenants_dir, exist_ok=True)
+        return SqliteStore(os.path.join(settings.tenants_dir, f"{tenant}.sqlite3"))
+    if tenant == DEFAULT_TENANT:
+        return DataStore(settings.data_dir)
+    return DataStore(os.path.join(settings.tenants_dir, tenant), legacy_file=None)
+
+if settings.storage_backend not in ("columnar", "sqlite"):
+    raise ValueError(f"Unknown storage backend {settings.storage_backend!r}")
+
+# Every tenant's store; attribute access reaches the store of the request's tenant
+data_store = TenantStores(create_store, settings.tenant_memory_mb * 2**20)
+startup.register("data", lambda: data_store.get(DEFAULT_TENANT, record=False))
+
+def _per_tenant(measure: Callable[[Any], float]) -> Callable[[], Dict[Tuple[str], float]]:
+    # Resident, loaded stores only: a scrape never loads a tenant or waits for one
+    return lambda: {(tenant,): measure(store) for tenant, store in data_store.resident().items() if store.loaded}
 
-# Global instance
-data_store = DataStore()
\ No newline at end of file
+Gauge("compliance_store_rows", "Checks in the current data version", ("tenant",),
+      collect=_per_tenant(lambda store: len(store.snapshot())))
+Gauge("compliance_store_memory_bytes", "Estimated memory of the resident data", ("tenant",),
+      collect=_per_tenant(lambda store: store.memory_bytes()))
+Gauge("compliance_store_disk_bytes", "Bytes the stored data and its history take on disk", ("tenant",),
+      collect=_per_tenant(lambda store: store.disk_bytes()))
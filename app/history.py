@@ -0,0 +1,332 @@
+import fcntl
+import itertools
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.columnar import CheckTable, PASSING
+from app.metrics import stage
+from app.storage import WRITE_BATCH_ROWS, _atomic_write, _fsync_dir, json_records, table_from_json
+
+# The row pack is rewritten without unreferenced rows once it holds this many
+# times more rows than the kept versions reference (and at least COMPACT_MIN_ROWS)
+COMPACT_RATIO = 2
+COMPACT_MIN_ROWS = 10_000
+# rows-<gen>.idx holds one (row hash, byte offset into rows-<gen>.ndjson) per stored row
+_INDEX = np.dtype([("hash", "<u8"), ("offset", "<u8")])
+_MANIFEST_COLUMNS = ("id_hash", "row_hash", "status", "risk_score")
+
+
+def row_hashes(table: CheckTable) -> Tuple[np.ndarray, np.ndarray]:
+    """64-bit hashes of each row's id and of its whole content"""
+    frame = pd.DataFrame({
+        "id": np.asarray(table.ids, dtype=object),
+        "framework": table.framework_labels(),
+        "provider": table.provider_labels(),
+        "severity": table.severity,
+        "status": table.status,
+        "risk_score": table.risk_score,
+        "description": np.asarray(table.description, dtype=object),
+        "last_checked": table.last_checked.view(np.int64),
+        "ai_summary": np.asarray(table.ai_summary, dtype=object),
+    })
+    return (pd.util.hash_array(frame["id"].to_numpy()),
+            pd.util.hash_pandas_object(frame, index=False).to_numpy())
+
+
+class Manifest:
+    """One recorded version: id hash, row hash, status and risk of every row,
+    sorted by id hash so two versions join with a binary search"""
+
+    def __init__(self, version: int, created_at: datetime, id_hash: np.ndarray, row_hash: np.ndarray,
+                 status: np.ndarray, risk_score: np.ndarray):
+        self.version = version
+        self.created_at = created_at
+        self.id_hash = id_hash
+        self.row_hash = row_hash
+        self.status = status
+        self.risk_score = risk_score
+
+    @classmethod
+    def build(cls, version: int, created_at: datetime, *columns: np.ndarray) -> "Manifest":
+        """Manifest of rows in any order (ids unique)"""
+        order = np.argsort(columns[0], kind="stable")
+        return cls(version, created_at, *(np.asarray(col)[order] for col in columns))
+
+    def __len__(self) -> int:
+        return len(self.id_hash)
+
+    def merge(self, version: int, incoming: "Manifest", delete_hashes: np.ndarray) -> "Manifest":
+        """This version with ``incoming`` upserted and ``delete_hashes`` removed"""
+        keep = ~np.isin(self.id_hash, np.concatenate([incoming.id_hash, delete_hashes]))
+        return Manifest.build(version, incoming.created_at, *(
+            np.concatenate([getattr(self, col)[keep], getattr(incoming, col)]) for col in _MANIFEST_COLUMNS
+        ))
+
+    def save(self, directory: str):
+        tmp = f"{directory}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for col in _MANIFEST_COLUMNS:
+            np.save(os.path.join(tmp, f"{col}.npy"), getattr(self, col))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"version": self.version, "created_at": self.created_at.isoformat(), "rows": len(self)}, f)
+        os.rename(tmp, directory)
+
+    @classmethod
+    def load(cls, directory: str) -> "Manifest":
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        return cls(meta["version"], datetime.fromisoformat(meta["created_at"]), *(
+            np.load(os.path.join(directory, f"{col}.npy"), mmap_mode="r") for col in _MANIFEST_COLUMNS
+        ))
+
+
+class History:
+    """Past versions of the dataset, rows stored once by content hash.
+
+    Layout under ``directory``::
+
+        v-<version>/       manifest of one version (see ``Manifest``)
+        rows-<gen>.ndjson  every distinct row any kept version holds, as JSON
+        rows-<gen>.idx     row hash -> offset into the .ndjson file
+        PACK               live <gen> of the row files (swapped on compaction)
+        LOCK               flock()ed: shared while diffing, exclusive while recording
+
+    A check that did not change between uploads is stored once no matter how
+    many versions contain it; each version only costs its 25-byte-per-row
+    manifest, which is built from the previous one and the upsert delta.
+    """
+
+    def __init__(self, directory: str, keep_versions: int = 20):
+        self.directory = directory
+        self.keep_versions = keep_versions
+        os.makedirs(directory, exist_ok=True)
+        # Sorted row hashes/offsets of the pack and the (gen, idx size) they were read at
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._offsets = np.empty(0, dtype=np.uint64)
+        self._index_state: Optional[Tuple[int, int]] = None
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.directory, *parts)
+
+    @contextmanager
+    def lock(self, shared: bool = False):
+        # A descriptor per acquisition, so threads of one process exclude each other too
+        fd = os.open(self._path("LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def versions(self) -> List[int]:
+        return sorted(int(name[2:]) for name in os.listdir(self.directory)
+                      if name.startswith("v-") and not name.endswith(".tmp"))
+
+    def manifest(self, version: int) -> Optional[Manifest]:
+        try:
+            return Manifest.load(self._path(f"v-{version:012d}"))
+        except FileNotFoundError:
+            return None
+
+    def _generation(self) -> int:
+        try:
+            with open(self._path("PACK")) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+
+    def _pack_files(self, generation: int) -> Tuple[str, str]:
+        return self._path(f"rows-{generation:06d}.ndjson"), self._path(f"rows-{generation:06d}.idx")
+
+    def _load_index(self) -> int:
+        """Re-read the pack index if another process appended to or compacted it"""
+        generation = self._generation()
+        index_file = self._pack_files(generation)[1]
+        size = os.path.getsize(index_file) if os.path.exists(index_file) else 0
+        if (generation, size) != self._index_state:
+            # A torn final record (crash mid-append) is ignored
+            entries = (np.fromfile(index_file, dtype=_INDEX, count=size // _INDEX.itemsize)
+                       if size else np.empty(0, dtype=_INDEX))
+            order = np.argsort(entries["hash"])
+            self._hashes, self._offsets = entries["hash"][order], entries["offset"][order]
+            self._index_state = (generation, size)
+        return generation
+
+    def record(self, version: int, current: Callable[[], Union[CheckTable, Iterable[CheckTable]]],
+               records: Optional[CheckTable] = None, delete_ids: Sequence[str] = ()):
+        """Record ``version``: the result of upserting ``records`` and deleting
+        ``delete_ids`` into the previous version, or all of ``current()`` (the
+        table, or its rows a table at a time)"""
+        with self.lock(), stage("history_record"):
+            versions = self.versions()
+            base = None
+            if records is not None and versions and versions[-1] == version - 1:
+                base = self.manifest(versions[-1])
+            if base is None:
+                # First version, a replace, or versions were missed: hash everything
+                batches, delete_ids = current(), ()
+            else:
+                if len(records):
+                    records = records.take(~pd.Index(records.ids).duplicated(keep="last"))
+                batches = records
+            if isinstance(batches, CheckTable):
+                table = batches
+                batches = (table.take(slice(start, start + WRITE_BATCH_ROWS))
+                           for start in range(0, len(table), WRITE_BATCH_ROWS))
+
+            # A batch at a time: a replaced dataset may not fit in memory as JSON
+            columns = []
+            for batch in itertools.chain(batches, [CheckTable.empty()]):
+                id_hash, row_hash = row_hashes(batch)
+                self._store_rows(batch, row_hash)
+                columns.append((id_hash, row_hash, np.asarray(batch.status), np.asarray(batch.risk_score)))
+            manifest = Manifest.build(version, datetime.utcnow(), *(np.concatenate(c) for c in zip(*columns)))
+            if base is not None:
+                delete_hashes = pd.util.hash_array(np.asarray(list(delete_ids), dtype=object))
+                manifest = base.merge(version, manifest, delete_hashes)
+            manifest.save(self._path(f"v-{version:012d}"))
+            self._prune(versions + [version], manifest)
+
+    def _store_rows(self, table: CheckTable, row_hash: np.ndarray):
+        """Append the rows whose content is not stored yet"""
+        generation = self._load_index()
+        new = np.flatnonzero(~np.isin(row_hash, self._hashes))
+        _, first = np.unique(row_hash[new], return_index=True)
+        new = new[np.sort(first)]
+        if not len(new):
+            return
+        lines = [(json.dumps(item) + "\n").encode() for item in json_records(table, new)]
+        pack_file, index_file = self._pack_files(generation)
+        with open(pack_file, "ab") as f:
+            start = f.seek(0, os.SEEK_END)
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        lengths = np.fromiter((len(line) for line in lines), dtype=np.uint64, count=len(lines))
+        entries = np.empty(len(new), dtype=_INDEX)
+        entries["hash"] = row_hash[new]
+        entries["offset"] = start + np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.uint64)
+        # The rows are durable before the index names them
+        with open(index_file, "ab") as f:
+            end = f.seek(0, os.SEEK_END)
+            f.truncate(end - end % _INDEX.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(entries.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        # Keep the in-memory index sorted without re-reading the file
+        entries = entries[np.argsort(entries["hash"])]
+        positions = np.searchsorted(self._hashes, entries["hash"])
+        self._hashes = np.insert(self._hashes, positions, entries["hash"])
+        self._offsets = np.insert(self._offsets, positions, entries["offset"])
+        self._index_state = (generation, size)
+
+    def _prune(self, versions: List[int], latest: Manifest):
+        """Drop versions beyond ``keep_versions`` and compact the pack once mostly unreferenced"""
+        for version in versions[:-self.keep_versions]:
+            shutil.rmtree(self._path(f"v-{version:012d}"), ignore_errors=True)
+        kept = versions[-self.keep_versions:]
+        generation = self._load_index()
+        # The latest version alone references len(latest) distinct rows: a cheap lower bound
+        if len(self._hashes) <= max(COMPACT_MIN_ROWS, COMPACT_RATIO * len(latest)):
+            return
+        live = np.unique(np.concatenate([self.manifest(v).row_hash for v in kept]))
+        if len(self._hashes) <= COMPACT_RATIO * len(live):
+            return
+
+        offsets = self._offsets[np.searchsorted(self._hashes, live)]
+        old_pack, old_index = self._pack_files(generation)
+        new_pack, new_index = self._pack_files(generation + 1)
+        entries = np.empty(len(live), dtype=_INDEX)
+        entries["hash"] = live
+        with open(old_pack, "rb") as src, open(new_pack, "wb") as dst:
+            for i, offset in enumerate(offsets.tolist()):
+                src.seek(offset)
+                entries["offset"][i] = dst.tell()
+                dst.write(src.readline())
+            dst.flush()
+            os.fsync(dst.fileno())
+        with open(new_index, "wb") as f:
+            f.write(entries.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        _atomic_write(self._path("PACK"), str(generation + 1))
+        _fsync_dir(self.directory)
+        os.remove(old_pack)
+        os.remove(old_index)
+        print(f"Compacted history rows: {len(self._hashes)} -> {len(live)}")
+
+    def _read_rows(self, hashes: np.ndarray) -> CheckTable:
+        """The stored rows with these content hashes, in order"""
+        generation = self._load_index()
+        offsets = self._offsets[np.searchsorted(self._hashes, hashes)]
+        records = []
+        with open(self._pack_files(generation)[0], "rb") as f:
+            for offset in offsets.tolist():
+                f.seek(offset)
+                records.append(json.loads(f.readline()))
+        return table_from_json(records)
+
+    def diff(self, from_version: int, to_version: int, limit: int = 100) -> Dict:
+        """Checks whose status or risk changed between two versions, joined on id.
+
+        Costs O(n log n) array work on the two manifests; only the returned
+        rows (at most ``limit`` per list, highest risk first) are read back.
+        """
+        with self.lock(shared=True):
+            before, after = self.manifest(from_version), self.manifest(to_version)
+            missing = [v for v, m in ((from_version, before), (to_version, after)) if m is None]
+            if missing:
+                raise KeyError(f"Version {missing[0]} is not in the history")
+
+            found = np.searchsorted(before.id_hash, after.id_hash).clip(max=max(len(before) - 1, 0))
+            matched = (before.id_hash[found] == after.id_hash) if len(before) else np.zeros(len(after), bool)
+            old, new = found[matched], np.flatnonzero(matched)
+            changed = before.row_hash[old] != after.row_hash[new]
+            old, new = old[changed], new[changed]
+
+            was_passing = before.status[old] == PASSING
+            is_passing = after.status[new] == PASSING
+            risk_changed = before.risk_score[old] != after.risk_score[new]
+            groups = {
+                "newly_failing": new[was_passing & ~is_passing],
+                "newly_passing": new[~was_passing & is_passing],
+                "risk_changed": new[risk_changed],
+            }
+            previous_risk = dict(zip(after.id_hash[new[risk_changed]].tolist(),
+                                     before.risk_score[old[risk_changed]].tolist()))
+
+            result = {
+                "from_version": from_version,
+                "to_version": to_version,
+                "counts": {
+                    "added": int((~matched).sum()),
+                    "removed": len(before) - int(matched.sum()),
+                    "changed": len(new),
+                    **{name: len(positions) for name, positions in groups.items()},
+                },
+            }
+            for name, positions in groups.items():
+                top = positions[np.argsort(-after.risk_score[positions], kind="stable")[:limit]]
+                rows = self._read_rows(after.row_hash[top]).rows()
+                if name == "risk_changed":
+                    rows = [dict(row.model_dump(), previous_risk_score=previous_risk[h])
+                            for row, h in zip(rows, after.id_hash[top].tolist())]
+                result[name] = rows
+            return result
+
+    def describe(self) -> List[Dict]:
+        """Recorded versions, oldest first"""
+        with self.lock(shared=True):
+            versions = [self.manifest(v) for v in self.versions()]
+        return [{"version": m.version, "created_at": m.created_at, "rows": len(m)}
+                for m in versions if m is not None]
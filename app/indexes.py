@@ -0,0 +1,227 @@
+import base64
+import json
+import math
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.columnar import SEVERITIES, STATUSES
+from app.search import TextIndex
+
+
+class Page(NamedTuple):
+    positions: np.ndarray
+    next_cursor: Optional[str]
+
+
+class TableIndexes:
+    """Inverted and sort indexes over one CheckTable, each built on first use.
+
+    Tables are immutable, so the indexes stay valid for the table's lifetime.
+    Postings are sorted row positions per category code; sort orders break
+    ties by row position so (key, position) totally orders the rows. The
+    text index is the one carried over to the next version of the table
+    (see ``derive``), as tokenizing is what an upsert must not repeat.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._postings: Dict[str, List[np.ndarray]] = {}
+        self._orders: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._text: Optional[TextIndex] = None
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the indexes built so far"""
+        postings = sum(len(self.table) * 8 for _ in self._postings)
+        orders = sum(sum(a.nbytes for a in order) for order in self._orders.values())
+        return postings + orders + (self._text.nbytes if self._text is not None else 0)
+
+    @property
+    def text(self) -> TextIndex:
+        if self._text is None:
+            self._text = TextIndex.build(self.table)
+        return self._text
+
+    def derive(self, table, added, order: np.ndarray):
+        """Give ``table``, which is ``concat([self.table, added]).take(order)``,
+        an up-to-date copy of the text index if this table has one"""
+        if self._text is not None:
+            table.indexes._text = self._text.apply_delta(added, order)
+
+    def labels(self, dim: str) -> List[str]:
+        if dim == "framework":
+            return list(self.table.frameworks)
+        if dim == "provider":
+            return list(self.table.providers)
+        return [s.value for s in (SEVERITIES if dim == "severity" else STATUSES)]
+
+    def postings(self, dim: str, value: str) -> np.ndarray:
+        """Sorted positions of rows whose ``dim`` equals ``value``"""
+        labels = self.labels(dim)
+        if value not in labels:
+            return np.empty(0, dtype=np.int64)
+        if dim not in self._postings:
+            codes = np.asarray(getattr(self.table, dim))
+            # A stable sort by code keeps positions ascending inside each code
+            order = np.argsort(codes, kind="stable")
+            counts = np.bincount(codes, minlength=len(labels))
+            self._postings[dim] = np.split(order.astype(np.int64), np.cumsum(counts)[:-1])
+        return self._postings[dim][labels.index(value)]
+
+    def key(self, sort: str) -> np.ndarray:
+        """Sort key column; descending keys are negated so every order is ascending"""
+        column = np.asarray(getattr(self.table, sort.lstrip("-")))
+        key = column.view(np.int64) if column.dtype.kind == "M" else column.astype(np.float64)
+        return -key if sort.startswith("-") else key
+
+    def order(self, sort: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(permutation, rank of each row, keys in sorted order) for ``sort``"""
+        if sort not in self._orders:
+            key = self.key(sort)
+            perm = np.argsort(key, kind="stable")
+            rank = np.empty_like(perm)
+            rank[perm] = np.arange(len(perm))
+            self._orders[sort] = (perm, rank, key[perm])
+        return self._orders[sort]
+
+
+def intersect_sorted(arrays: List[np.ndarray]) -> np.ndarray:
+    """Intersect sorted position arrays, probing from the smallest one"""
+    arrays = sorted(arrays, key=len)
+    result = arrays[0]
+    for other in arrays[1:]:
+        if not len(result):
+            break
+        idx = np.searchsorted(other, result).clip(max=len(other) - 1) if len(other) else None
+        result = result[other[idx] == result] if idx is not None else result[:0]
+    return result
+
+
+def encode_cursor(sort: Optional[str], key, position: int, check_id: str) -> str:
+    payload = json.dumps({"s": sort, "k": key, "p": position, "i": check_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: Optional[str]) -> dict:
+    """State of a cursor issued for ``sort``; ValueError unless it is well-formed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if (not isinstance(state, dict) or "k" not in state or not _is_int(state.get("p")) or state["p"] < 0
+            or type(state.get("i")) is not str):
+        raise ValueError("Invalid cursor")
+    if state.get("s") != sort:
+        raise ValueError("Cursor was issued for a different sort order")
+    key = state["k"]
+    if sort is None:
+        valid = key is None
+    elif sort.lstrip("-") == "last_checked":
+        # Microseconds since the epoch, as int64
+        valid = _is_int(key) and -2 ** 63 <= key < 2 ** 63
+    else:
+        valid = (_is_int(key) or type(key) is float) and math.isfinite(key)
+    if not valid:
+        raise ValueError("Invalid cursor")
+    return state
+
+
+def _is_int(value) -> bool:
+    # bool is an int subclass; JSON true/false are not positions
+    return type(value) is int
+
+
+def query_checks(table, filters: Dict[str, Optional[str]], sort: Optional[str] = None,
+                 cursor: Optional[str] = None, offset: int = 0, limit: int = 100) -> Page:
+    """Row positions of one page of ``/checks``.
+
+    Unfiltered pages cost O(limit); filtered pages cost O(size of the
+    smallest matching posting list). Cursors hold the sort key, row
+    position and id of the last returned row. Deletes renumber the rows
+    after them, so the id is looked up again when it is no longer at that
+    position; a cursor whose own row was deleted is rejected rather than
+    resumed at the wrong place.
+    """
+    indexes = table.indexes
+    active = {dim: value for dim, value in filters.items() if value is not None}
+    candidates = (
+        intersect_sorted([indexes.postings(dim, value) for dim, value in active.items()])
+        if active else None
+    )
+
+    state = decode_cursor(cursor, sort) if cursor else None
+    if state is not None:
+        state = dict(state, p=_resolve(table, state))
+
+    if sort is None:
+        start = state["p"] + 1 if state else 0
+        if candidates is None:
+            begin = min(start + offset, len(table))
+            positions = np.arange(begin, min(begin + limit, len(table)), dtype=np.int64)
+            more = begin + limit < len(table)
+        else:
+            begin = int(np.searchsorted(candidates, start)) + offset
+            positions = candidates[begin:begin + limit]
+            more = begin + limit < len(candidates)
+    else:
+        perm, rank, sorted_keys = indexes.order(sort)
+        start = _seek(perm, sorted_keys, state) if state else 0
+        if candidates is None:
+            begin = min(start + offset, len(table))
+            positions = perm[begin:begin + limit]
+            more = begin + limit < len(table)
+        else:
+            ranks = rank[candidates]
+            ranks = ranks[ranks >= start]
+            wanted = offset + limit
+            more = len(ranks) > wanted
+            if more:
+                # Only the first offset + limit ranks need ordering
+                ranks = ranks[np.argpartition(ranks, wanted - 1)[:wanted]] if wanted else ranks[:0]
+            positions = perm[np.sort(ranks)[offset:]]
+
+    next_cursor = None
+    if more and len(positions):
+        last = int(positions[-1])
+        last_key = None
+        if sort is not None:
+            _, rank, sorted_keys = indexes.order(sort)
+            last_key = sorted_keys[rank[last]].item()
+        next_cursor = encode_cursor(sort, last_key, last, table.ids[last])
+    return Page(positions, next_cursor)
+
+
+def search_checks(table, query: str, filters: Dict[str, Optional[str]], offset: int = 0,
+                  limit: int = 20) -> Tuple[np.ndarray, np.ndarray, int]:
+    """(positions, scores) of one page of ``/checks/search`` and the number of
+    matching rows; the structured filters narrow the candidates first"""
+    indexes = table.indexes
+    active = {dim: value for dim, value in filters.items() if value is not None}
+    candidates = (
+        intersect_sorted([indexes.postings(dim, value) for dim, value in active.items()])
+        if active else None
+    )
+    return indexes.text.search(query, candidates, offset=offset, limit=limit)
+
+
+def _resolve(table, state: dict) -> int:
+    """Current position of the cursor's last row"""
+    position, check_id = state["p"], state["i"]
+    if position < len(table) and table.ids[position] == check_id:
+        return position
+    found = np.flatnonzero(np.asarray(table.ids) == check_id)
+    # Deletes only move rows to lower positions; one found further on was deleted and inserted again
+    if not len(found) or found[0] > position:
+        raise ValueError("Cursor is no longer valid: its last row was deleted")
+    return int(found[0])
+
+
+def _seek(perm: np.ndarray, sorted_keys: np.ndarray, state: dict) -> int:
+    """Rank of the first row after the cursor's (key, position)"""
+    key = np.asarray(state["k"], dtype=sorted_keys.dtype)
+    lo = int(np.searchsorted(sorted_keys, key, side="left"))
+    hi = int(np.searchsorted(sorted_keys, key, side="right"))
+    # Ties are ordered by position, so perm[lo:hi] is ascending
+    return lo + int(np.searchsorted(perm[lo:hi], state["p"], side="right"))
@@ -0,0 +1,215 @@
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Iterator, List, Optional
+
+from fastapi import HTTPException
+
+from app import metrics
+from app.columnar import CheckTable
+from app.config import settings
+from app.data_store import data_store
+from app.models import JobStatus, UploadJobStatus, UploadMode
+from app.tenants import current_tenant
+from app.utils import InvalidRowsError, MAX_REPORTED_ERRORS, ParsedChunk, parse_csv_block, read_csv_blocks
+from app.workers import pool_width, submit
+
+# Finished jobs kept for polling; older ones are forgotten first
+MAX_FINISHED_JOBS = 100
+
+# Job progress is also written here so any worker process can answer /jobs/{id}
+JOBS_DIR = os.path.join(settings.data_dir, "jobs")
+
+# Uploads are ingested one at a time, in the order they were accepted
+_ingestion = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+_jobs: "OrderedDict[str, UploadJob]" = OrderedDict()
+_jobs_lock = Lock()
+
+
+class UploadJob:
+    """One background upload: a spooled CSV file and its progress.
+
+    The dataset is only replaced (or upserted into) once the whole file has
+    parsed, so readers keep seeing the previous data until then. A
+    replacement is written to disk a chunk at a time as the file parses.
+    """
+
+    def __init__(self, path: str, mode: UploadMode, skip_invalid: bool, tenant: str):
+        self.id = uuid.uuid4().hex
+        self.tenant = tenant
+        self.path = path
+        self.mode = mode
+        self.skip_invalid = skip_invalid
+        self.status = JobStatus.QUEUED
+        self.total_bytes = os.path.getsize(path)
+        self.bytes_processed = 0
+        self.rows_parsed = 0
+        self.rows_rejected = 0
+        self.errors: List[str] = []
+        self.result: Optional[Dict] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._started = 0.0
+        self._elapsed: Optional[float] = None
+        self.future: Optional[Future] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+    def describe(self) -> UploadJobStatus:
+        elapsed = self._elapsed if self._elapsed is not None else (
+            time.perf_counter() - self._started if self._started else 0.0
+        )
+        rate = self.rows_parsed / elapsed if elapsed else 0.0
+        eta = None
+        if self.status == JobStatus.RUNNING and self.bytes_processed:
+            # Assumes the rest of the file parses at the speed seen so far
+            eta = elapsed * (self.total_bytes - self.bytes_processed) / self.bytes_processed
+        elif self.done:
+            eta = 0.0
+        return UploadJobStatus(
+            id=self.id,
+            tenant=self.tenant,
+            status=self.status,
+            mode=self.mode,
+            rows_parsed=self.rows_parsed,
+            rows_rejected=self.rows_rejected,
+            bytes_processed=self.bytes_processed,
+            total_bytes=self.total_bytes,
+            rows_per_second=round(rate, 1),
+            eta_seconds=round(eta, 1) if eta is not None else None,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            errors=self.errors,
+            result=self.result,
+        )
+
+    def save(self):
+        """Publish the job's progress for other processes"""
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        path = os.path.join(JOBS_DIR, f"{self.id}.json")
+        with open(f"{path}.tmp", "w") as f:
+            f.write(self.describe().model_dump_json())
+        os.replace(f"{path}.tmp", path)
+
+    def run(self):
+        self.status = JobStatus.RUNNING
+        self.started_at = datetime.utcnow()
+        self._started = time.perf_counter()
+        try:
+            # Jobs run off the request, so the tenant's store is looked up by name
+            store = data_store.get(self.tenant, record=False)
+            with open(self.path, "rb") as f:
+                if self.mode == UploadMode.UPSERT:
+                    chunks = list(self._parse(f))
+                    records = CheckTable.concat([chunk.records for chunk in chunks])
+                    delete_ids = [i for chunk in chunks for i in chunk.delete_ids]
+                    counts = store.upsert_data(records, delete_ids)
+                    self.result = {"message": f"Upserted {len(records)} records", **counts}
+                else:
+                    rows = store.replace_data(chunk.records for chunk in self._parse(f))
+                    self.result = {"message": f"Loaded {rows} records"}
+            self.bytes_processed = self.total_bytes
+            store.index_text()
+            if self.skip_invalid:
+                self.result["rejected"] = self.rows_rejected
+            self.status = JobStatus.SUCCEEDED
+        except HTTPException as e:
+            self.errors.append(str(e.detail))
+            self.status = JobStatus.FAILED
+        except Exception as e:
+            print(f"Upload job {self.id} failed: {e}")
+            self.errors.append(f"Upload failed: {e}")
+            self.status = JobStatus.FAILED
+        finally:
+            self._elapsed = time.perf_counter() - self._started
+            self.finished_at = datetime.utcnow()
+            os.remove(self.path)
+            self.save()
+            _forget_finished()
+            data_store.trim()
+            metrics.flush()
+
+    def _parse(self, f) -> Iterator[ParsedChunk]:
+        """Parse blocks in the worker pool while the next ones are read; yields them in order"""
+        pending = deque()
+        upsert = self.mode == UploadMode.UPSERT
+
+        def collect():
+            future, size = pending.popleft()
+            try:
+                chunk = future.result()
+            except InvalidRowsError as e:
+                raise e.shifted(self.rows_parsed)
+            if chunk.rejected is not None:
+                rejected = chunk.rejected.shifted(self.rows_parsed)
+                self.rows_rejected += rejected.total
+                self.errors.extend(rejected.messages()[:MAX_REPORTED_ERRORS - len(self.errors)])
+            metrics.STAGE_SECONDS.observe(chunk.parse_seconds, stage="csv_parse")
+            metrics.STAGE_SECONDS.observe(chunk.validate_seconds, stage="validation")
+            self.rows_parsed += chunk.rows
+            self.bytes_processed += size
+            self.save()
+            return chunk
+
+        try:
+            for i, (header, block) in enumerate(read_csv_blocks(f, settings.upload_chunk_size)):
+                future = submit(parse_csv_block, header, block, 0, upsert, self.skip_invalid)
+                # The header is counted with the first block
+                pending.append((future, len(block) + (0 if i else len(header))))
+                if len(pending) > pool_width():
+                    yield collect()
+            while pending:
+                yield collect()
+        finally:
+            for future, _ in pending:
+                future.cancel()
+
+
+def start_upload(path: str, mode: UploadMode, skip_invalid: bool = False) -> UploadJob:
+    """Queue the CSV at ``path`` for ingestion into the current tenant's data;
+    the job deletes the file when done"""
+    job = UploadJob(path, mode, skip_invalid, current_tenant())
+    job.save()
+    with _jobs_lock:
+        _jobs[job.id] = job
+    job.future = _ingestion.submit(job.run)
+    return job
+
+
+def job_status(job_id: str) -> Optional[UploadJobStatus]:
+    """Progress of a job of the current tenant, started by this or any other worker process"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        status = job.describe()
+    else:
+        try:
+            with open(os.path.join(JOBS_DIR, f"{os.path.basename(job_id)}.json")) as f:
+                status = UploadJobStatus.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+    return status if status.tenant == current_tenant() else None
+
+
+def _forget_finished():
+    with _jobs_lock:
+        finished = [job_id for job_id, job in _jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del _jobs[job_id]
+    files = sorted(
+        (entry for entry in os.scandir(JOBS_DIR) if entry.name.endswith(".json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in files[:max(0, len(files) - MAX_FINISHED_JOBS)]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
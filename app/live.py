@@ -0,0 +1,120 @@
+"""Server-sent events pushing dashboard changes to subscribers.
+
+While anyone is subscribed, one task per process polls for the current
+state (a cursor naming it and a JSON-able payload). When the cursor moves,
+every subscriber gets an event carrying what changed since the state it
+last saw, computed and encoded once per (from, to) pair however many
+clients share it. A client that reconnects with a cursor still held here
+(``Last-Event-ID``) resumes with a delta; anyone else starts with a full
+snapshot.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.responses import dumps
+
+# States kept for reconnecting clients; an older cursor gets a full snapshot
+KEPT_STATES = 64
+# Comment lines sent on idle streams so proxies keep the connection open
+HEARTBEAT_SECONDS = 15.0
+# How long EventSource clients wait before reconnecting
+RETRY_MILLISECONDS = 2000
+
+
+def diff(old: Any, new: Any) -> Any:
+    """What changed from ``old`` to ``new``.
+
+    Dicts give their changed keys (recursively, None for removed keys);
+    lists of records with an ``id`` give ``{"added": [...], "removed": [ids]}``
+    (a changed record counts as added); anything else is replaced by ``new``.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = {key: diff(old[key], value) if key in old else value
+                   for key, value in new.items() if key not in old or old[key] != value}
+        changes.update((key, None) for key in old.keys() - new.keys())
+        return changes
+    if _records(old) and _records(new):
+        before = {item["id"]: item for item in old}
+        ids = {item["id"] for item in new}
+        return {"added": [item for item in new if before.get(item["id"]) != item],
+                "removed": [item["id"] for item in old if item["id"] not in ids]}
+    return new
+
+
+def _records(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, dict) and "id" in item for item in value)
+
+
+class LiveFeed:
+    def __init__(self, current: Callable[[], Tuple[str, Dict]], poll_interval: float):
+        # (cursor, state) of the data now; runs on the threadpool
+        self.current = current
+        self.poll_interval = poll_interval
+        self.subscribers = 0
+        self._states: "OrderedDict[str, Dict]" = OrderedDict()
+        self._cursor: Optional[str] = None
+        # Encoded events to the current cursor, by the cursor they start from
+        self._events: Dict[Optional[str], bytes] = {}
+        # Set (and replaced) whenever the cursor moves
+        self._changed = asyncio.Event()
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def subscribe(self, since: Optional[str] = None) -> AsyncIterator[bytes]:
+        """The event stream of one client that last saw ``since`` (None for none)"""
+        self.subscribers += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if self._watcher is None or self._watcher.done() or self._watcher.get_loop() is not loop:
+                self._changed = asyncio.Event()
+                self._watcher = loop.create_task(self._watch())
+            yield f"retry: {RETRY_MILLISECONDS}\n\n".encode()
+            while True:
+                changed = self._changed
+                if self._cursor is not None and since != self._cursor:
+                    yield self._event(since)
+                    since = self._cursor
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            self.subscribers -= 1
+
+    async def _watch(self):
+        while True:
+            try:
+                await self._poll()
+            except Exception as e:
+                print(f"Live feed update failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+            if not self.subscribers:
+                return
+
+    async def _poll(self):
+        cursor, state = await run_in_threadpool(self.current)
+        if cursor == self._cursor:
+            return
+        self._states[cursor] = state
+        while len(self._states) > KEPT_STATES:
+            self._states.popitem(last=False)
+        self._cursor = cursor
+        self._events = {}
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _event(self, since: Optional[str]) -> bytes:
+        encoded = self._events.get(since)
+        if encoded is None:
+            state = self._states[self._cursor]
+            before = self._states.get(since) if since is not None else None
+            if before is None:
+                kind, data = "snapshot", {"cursor": self._cursor, **state}
+            else:
+                kind, data = "delta", {"cursor": self._cursor, "since": since, **diff(before, state)}
+            encoded = f"id: {self._cursor}\nevent: {kind}\ndata: ".encode() + dumps(data) + b"\n\n"
+            self._events[since] = encoded
+        return encoded
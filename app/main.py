@@ -1,12 +1,26 @@
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app import metrics, startup
+from app.tenants import TenantMiddleware
 from app.config import settings
 from app.router import router
+from app.workers import shutdown_pool
 
 logging.basicConfig(level=settings.log_level)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.warm_up()
+    metrics.start_publishing()
+    yield
+    shutdown_pool()
+    metrics.stop_publishing()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="AI Compliance Tracker API",
     version="2.0.0",
     description="Real-time compliance metrics & AI‑driven insights"
@@ -18,9 +32,23 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+# Outermost, so everything inside sees the path without its /tenants/<id> prefix
+app.add_middleware(TenantMiddleware, header=settings.tenant_header)
 
 app.include_router(router)
 
 @app.get("/", tags=["Health"])
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """503 until the dataset and model have loaded; ``/`` only tells the process is up"""
+    status = startup.status()
+    return JSONResponse(status, status_code=200 if startup.is_ready() else 503)
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Request latencies, stage timings, store size and memory, for Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
\ No newline at end of file
@@ -0,0 +1,304 @@
+"""Counters, gauges and histograms served by ``/metrics`` in the Prometheus
+text format (version 0.0.4).
+
+Each uvicorn worker keeps its own samples and publishes them to a file in
+``METRICS_DIR`` every few seconds from a background thread; a scrape,
+whichever worker answers it, adds up the counters and histograms of every
+live worker. Gauges set with ``set()`` are per process and get a ``pid``
+label; gauges with a ``collect`` callback are computed by the answering
+process at scrape time.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from starlette.routing import Match
+
+from app.config import settings
+
+METRICS_DIR = os.path.join(settings.data_dir, "metrics")
+# Seconds between two publications of this process's samples
+FLUSH_INTERVAL = 5.0
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: Dict[str, "Metric"] = {}
+_flush_lock = Lock()
+_stop_publishing = Event()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = Lock()
+        _registry[name] = self
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> Dict[Tuple[str, ...], object]:
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+    def merge(self, total: Dict[Tuple[str, ...], object], other: Dict[Tuple[str, ...], object]):
+        """Add another process's ``samples()`` into ``total``"""
+        for key, value in other.items():
+            total[key] = total.get(key, 0) + value
+
+    def lines(self, samples: Dict[Tuple[str, ...], object]) -> Iterator[str]:
+        for key, value in sorted(samples.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Union[float, Dict[Tuple[str, ...], float]]]] = None):
+        super().__init__(name, help, labels)
+        # Computed when scraped, by the process answering the scrape: a value,
+        # or values by label tuple when the gauge has labels
+        self.collect = collect
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> Dict[Tuple[str, ...], object]:
+        if self.collect is not None:
+            value = self.collect()
+            return value if isinstance(value, dict) else {(): value}
+        return {key + (str(os.getpid()),): value for key, value in super().samples().items()}
+
+    def merge(self, total: Dict[Tuple[str, ...], object], other: Dict[Tuple[str, ...], object]):
+        if self.collect is None:
+            total.update(other)
+
+    def lines(self, samples: Dict[Tuple[str, ...], object]) -> Iterator[str]:
+        names = self.labels if self.collect is not None else self.labels + ("pid",)
+        for key, value in sorted(samples.items()):
+            yield f"{self.name}{_labels(names, key)} {_number(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        # Per bucket (not cumulative) counts, the +Inf bucket, then the sum
+        slot = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[slot] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the seconds the block took, including when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, total: Dict[Tuple[str, ...], object], other: Dict[Tuple[str, ...], object]):
+        for key, counts in other.items():
+            if key in total:
+                total[key] = [a + b for a, b in zip(total[key], counts)]
+            else:
+                total[key] = list(counts)
+
+    def lines(self, samples: Dict[Tuple[str, ...], object]) -> Iterator[str]:
+        names = self.labels + ("le",)
+        for key, counts in sorted(samples.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(counts[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to answer a request, until its last body byte",
+                            ("method", "route", "status"))
+STAGE_SECONDS = Histogram("compliance_stage_seconds", "Time spent in one internal processing stage", ("stage",))
+RESIDENT_MEMORY = Gauge("process_resident_memory_bytes", "Resident memory of the web worker process")
+
+
+def stage(name: str):
+    """Time a block as one ``compliance_stage_seconds`` observation, e.g. ``with stage("store_write"):``"""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def _resident_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _snapshot() -> Dict[str, List]:
+    RESIDENT_MEMORY.set(_resident_bytes())
+    return {
+        name: [[list(key), value] for key, value in metric.samples().items()]
+        for name, metric in _registry.items()
+        if not (isinstance(metric, Gauge) and metric.collect is not None)
+    }
+
+
+def flush():
+    """Publish this process's samples for scrapes answered by other workers"""
+    with _flush_lock:
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(_snapshot(), f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"Error writing metrics to {METRICS_DIR}: {e}")
+
+
+def start_publishing():
+    """Flush every ``FLUSH_INTERVAL`` seconds from a background thread, off the event loop"""
+    _stop_publishing.clear()
+    Thread(target=_publish, name="metrics", daemon=True).start()
+
+
+def stop_publishing():
+    """Stop the background flushes and publish the final samples"""
+    _stop_publishing.set()
+    flush()
+
+
+def _publish():
+    while not _stop_publishing.wait(FLUSH_INTERVAL):
+        flush()
+
+
+def _other_processes() -> Iterator[Dict[str, List]]:
+    """Samples published by the other live workers; files of exited ones are removed"""
+    try:
+        entries = list(os.scandir(METRICS_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        pid, ext = os.path.splitext(entry.name)
+        if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        if not pid_alive(int(pid)):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(entry.path) as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def pid_alive(pid: int) -> bool:
+    """Whether a process with this id exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def render() -> str:
+    """Every metric of every live worker, in the text exposition format"""
+    RESIDENT_MEMORY.set(_resident_bytes())
+    totals = {name: metric.samples() for name, metric in _registry.items()}
+    for published in _other_processes():
+        for name, samples in published.items():
+            metric = _registry.get(name)
+            if metric is not None:
+                metric.merge(totals[name], {tuple(key): value for key, value in samples})
+    out = []
+    for name, metric in _registry.items():
+        out.append(f"# HELP {name} {metric.help}")
+        out.append(f"# TYPE {name} {metric.kind}")
+        out.extend(metric.lines(totals[name]))
+    return "\n".join(out) + "\n"
+
+
+class MetricsMiddleware:
+    """Records ``http_request_duration_seconds`` by route template (``/api/v1/jobs/{job_id}``,
+    not the raw path, so job ids don't each get a series)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                    route=_route(scope), status=str(status))
+
+
+def _route(scope) -> str:
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
@@ -14,6 +14,41 @@ class StatusLevel(str, Enum):
     FAILING  = "Failing"
     WARNING  = "Warning"
 
+class UploadMode(str, Enum):
+    REPLACE = "replace"
+    UPSERT  = "upsert"
+
+class JobStatus(str, Enum):
+    QUEUED    = "queued"
+    RUNNING   = "running"
+    SUCCEEDED = "succeeded"
+    FAILED    = "failed"
+
+class CheckSort(str, Enum):
+    LAST_CHECKED      = "last_checked"
+    LAST_CHECKED_DESC = "-last_checked"
+    RISK_SCORE        = "risk_score"
+    RISK_SCORE_DESC   = "-risk_score"
+
+class TrendGranularity(str, Enum):
+    HOUR  = "hour"
+    DAY   = "day"
+    WEEK  = "week"
+    MONTH = "month"
+
+class OverviewSection(str, Enum):
+    DASHBOARD   = "dashboard"
+    STATISTICS  = "statistics"
+    AI_INSIGHTS = "ai_insights"
+    FRAMEWORKS  = "frameworks"
+    PROVIDERS   = "providers"
+
+class TrendDimension(str, Enum):
+    FRAMEWORK = "framework"
+    PROVIDER  = "provider"
+    SEVERITY  = "severity"
+    STATUS    = "status"
+
 class ComplianceCheck(BaseModel):
     id: str
     framework: str
@@ -25,6 +60,9 @@ class ComplianceCheck(BaseModel):
     last_checked: datetime
     ai_summary: Optional[str] = None
 
+class RiskChange(ComplianceCheck):
+    previous_risk_score: float
+
 class DashboardSummary(BaseModel):
     total_checks: int
     compliant: int
@@ -43,9 +81,102 @@ class ScanResult(BaseModel):
     scanned_at: datetime
 
 class DetailedStatistics(BaseModel):
-    overview: Dict[str, float]
+    overview: Dict[str, int | float | str]
     by_severity: Dict[str, Dict[str, int]]
     by_framework: Dict[str, Dict[str, int]]
     by_provider: Dict[str, Dict[str, int]]
     by_status: Dict[str, int]
-    trends: Dict[str, int]
\ No newline at end of file
+    trends: Dict[str, int]
+
+class Overview(BaseModel):
+    # Only the requested sections are present, each as its own endpoint returns it
+    dashboard: Optional[DashboardSummary] = None
+    statistics: Optional[DetailedStatistics] = None
+    ai_insights: Optional[AiInsights] = None
+    frameworks: Optional[List[str]] = None
+    providers: Optional[List[str]] = None
+
+class TrendSeries(BaseModel):
+    start: datetime
+    end: datetime
+    granularity: TrendGranularity
+    by: Optional[TrendDimension] = None
+    # Start of each bucket (UTC); weeks start on Monday
+    buckets: List[datetime]
+    # Checks per bucket for each label of ``by`` ("total" when not split)
+    series: Dict[str, List[int]]
+
+class SearchHit(ComplianceCheck):
+    # BM25 relevance; higher is better
+    score: float
+
+class SearchResults(BaseModel):
+    query: str
+    # Matching checks in all, not only on this page
+    total: int
+    results: List[SearchHit]
+
+class RiskDistribution(BaseModel):
+    count: int
+    mean: float
+    min: float
+    max: float
+    # Nearest-rank quantiles keyed "p50", "p99.9"...; within resolution / 2 of the exact ones
+    quantiles: Dict[str, float]
+    # Checks per unit-wide risk bucket: [0, 1), [1, 2) ... [9, 10]
+    histogram: List[int]
+
+class RiskStatistics(BaseModel):
+    # Width of the bins the distributions are kept in
+    resolution: float
+    overall: RiskDistribution
+    # Dimension -> label -> distribution
+    by: Dict[str, Dict[str, RiskDistribution]]
+
+class HistoryVersion(BaseModel):
+    version: int
+    created_at: datetime
+    rows: int
+
+class CheckDiff(BaseModel):
+    from_version: int
+    to_version: int
+    # added, removed, changed, newly_failing, newly_passing, risk_changed
+    counts: Dict[str, int]
+    newly_failing: List[ComplianceCheck]
+    newly_passing: List[ComplianceCheck]
+    risk_changed: List[RiskChange]
+
+class TenantStats(BaseModel):
+    tenant: str
+    # Whether the store is loaded in this process; rows only count for resident ones
+    resident: bool
+    rows: Optional[int] = None
+    memory_bytes: int
+    hits: int
+    misses: int
+    hit_rate: Optional[float] = None
+    evictions: int
+    last_used: Optional[datetime] = None
+
+class TenantsSummary(BaseModel):
+    memory_budget_bytes: int
+    resident_bytes: int
+    tenants: List[TenantStats]
+
+class UploadJobStatus(BaseModel):
+    id: str
+    tenant: str = "default"
+    status: JobStatus
+    mode: UploadMode
+    rows_parsed: int
+    rows_rejected: int
+    bytes_processed: int
+    total_bytes: int
+    rows_per_second: float
+    eta_seconds: Optional[float] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    errors: List[str]
+    result: Optional[Dict[str, int | str]] = None
@@ -0,0 +1,113 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder gives the same bytes, only slower
+    orjson = None
+
+# Clients may keep responses but must revalidate them (cheap: usually a 304)
+CACHE_CONTROL = "no-cache"
+# Media types that select a streamed, newline-delimited JSON body
+NDJSON = "application/x-ndjson"
+_NDJSON_TYPES = {NDJSON, "application/jsonl", "application/jsonlines"}
+# For JSON bodies of URLs that also stream NDJSON (see ``wants_ndjson``)
+VARY_ACCEPT = {"Vary": "Accept"}
+
+
+def encode_json(value: Any, model: Optional[Type[BaseModel]] = None) -> Tuple[bytes, str]:
+    """Serialize ``value`` once, the way FastAPI would for ``response_model=model``.
+
+    Returns the body and a strong ETag derived from it, so equal bodies get
+    equal tags no matter which snapshot or process produced them.
+    """
+    if model is not None:
+        if not isinstance(value, model):
+            value = model.model_validate(value)
+        body = value.model_dump_json().encode()
+    else:
+        body = dumps(jsonable_encoder(value))
+    return body, _etag(body)
+
+
+def join_json(members: Sequence[Tuple[str, bytes]]) -> Tuple[bytes, str]:
+    """A JSON object of already encoded member values, with its ETag like ``encode_json``"""
+    body = b"{" + b",".join(dumps(name) + b":" + value for name, value in members) + b"}"
+    return body, _etag(body)
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def dumps(value: Any) -> bytes:
+    """Compact UTF-8 JSON of plain values (dicts, lists, str, numbers, datetimes).
+
+    Meant for rows read back from the store, which were validated on
+    ingest: the output matches pydantic's for the same ``ComplianceCheck``.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_encode_default).encode()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether ``If-None-Match`` already names ``etag`` (weak comparison, RFC 9110)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def records_response(records: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Stored records as JSON, bypassing ``response_model`` validation"""
+    return Response(dumps(records), media_type="application/json", headers=headers)
+
+
+def json_response(request: Request, encoded: Tuple[bytes, str],
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    """The pre-serialized body, or ``304 Not Modified`` if the client has it"""
+    body, etag = encoded
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def wants_ndjson(request: Request) -> bool:
+    """Whether ``Accept`` asks for NDJSON (the JSON array stays the default)"""
+    accept = request.headers.get("accept", "")
+    return any(part.split(";")[0].strip().lower() in _NDJSON_TYPES for part in accept.split(","))
+
+
+def _encode_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_response(batches: Iterable[List[Dict]], headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    """Stream records one JSON object per line, encoding a batch at a time.
+
+    The first bytes go out once the first batch is encoded and memory is
+    bounded by one batch, however many rows follow. The URL also serves
+    JSON, so the response varies on ``Accept`` and its ETag gets a suffix.
+    """
+    headers = {**(headers or {}), "Vary": "Accept"}
+    if "ETag" in headers:
+        headers["ETag"] = headers["ETag"][:-1] + '-ndjson"'
+
+    def body():
+        for batch in batches:
+            yield b"".join(dumps(record) + b"\n" for record in batch)
+    return StreamingResponse(body(), media_type=NDJSON, headers=headers)
@@ -1,92 +1,423 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request, Response
+import asyncio
+import os
+import shutil
+import tempfile
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 from app.config import settings
 from app.models import (
     ComplianceCheck, DashboardSummary, AiInsights,
-    ScanResult, DetailedStatistics, StatusLevel, SeverityLevel
+    ScanResult, DetailedStatistics, UploadMode, CheckSort, JobStatus, UploadJobStatus,
+    TrendDimension, TrendGranularity, TrendSeries, HistoryVersion, CheckDiff, TenantsSummary,
+    RiskStatistics, SearchResults, Overview, OverviewSection
 )
-from app.utils import parse_and_validate_csv
+from app.aggregates import Aggregates
+from app.columnar import CheckTable
+from app.utils import check_header
+from app.workers import get_pool
+from app.jobs import start_upload, job_status
 from app.services.dashboard import compute_dashboard
 from app.services.scan import perform_scan
 from app.services.statistics import compute_statistics
+from app.services.trends import compute_trends
+from app.services.risk import DEFAULT_QUANTILES, compute_risk_statistics
+from app.services.insights import compute_insights
 from app.ai_model import AIModel
 from app.mock_data import get_mock_compliance_checks, get_mock_dashboard_summary, get_mock_ai_insights
-from app.data_store import data_store
-from datetime import datetime
+from app.data_store import data_store, Snapshot
+from app.live import LiveFeed
+from app.metrics import Gauge
+from app import startup
+from app.tenants import current_tenant
+from app.responses import (
+    VARY_ACCEPT, dumps, encode_json, join_json, json_response, ndjson_response, records_response, wants_ndjson,
+)
+from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/api/v1")
-_ai = AIModel(settings.model_path)
+_ai = AIModel(settings.model_path, batch_size=settings.ai_batch_size,
+              cache_size=settings.ai_cache_size, executor=get_pool(), mmap=settings.model_mmap)
+startup.register("model", _ai.load)
+Gauge("compliance_model_cache_entries", "Feature rows with a cached prediction", collect=lambda: len(_ai._cache))
+
+def _snapshot(response: Response) -> Snapshot:
+    """The current data version, advertised on the response"""
+    snapshot = data_store.snapshot()
+    response.headers.update(_version_headers(snapshot))
+    return snapshot
+
+def _version_headers(snapshot: Snapshot) -> dict:
+    return {"ETag": snapshot.etag, "X-Data-Version": str(snapshot.version)}
+
+def _cached_json(request: Request, snapshot: Snapshot, key: Optional[tuple], compute, model=None) -> Response:
+    """Serve ``compute()`` as JSON bytes memoized on the snapshot under ``key``.
+
+    A new upload or clear publishes a new snapshot, which is what invalidates
+    the cache. ``key=None`` (the mock data) serializes afresh every time.
+    """
+    return json_response(request, _encoded(snapshot, key, compute, model),
+                         {"X-Data-Version": str(snapshot.version)})
+
+def _encoded(snapshot: Snapshot, key: Optional[tuple], compute, model=None) -> Tuple[bytes, str]:
+    if key is None:
+        return encode_json(compute(), model)
+    return snapshot.memo(("json",) + key, lambda: encode_json(compute(), model))
+
+# The mock data shown while a tenant has nothing uploaded: (UTC hour, snapshot)
+_mock: Optional[Tuple[str, Snapshot]] = None
+
+def _mock_source() -> Snapshot:
+    """The mock checks as a snapshot, rebuilt hourly as their timestamps are relative to now"""
+    global _mock
+    hour = datetime.utcnow().strftime("%Y-%m-%dT%H")
+    cached = _mock
+    if cached is None or cached[0] != hour:
+        mock_checks = CheckTable.from_checks(get_mock_compliance_checks())
+        cached = _mock = (hour, Snapshot(0, mock_checks, Aggregates.from_table(mock_checks)))
+    return cached[1]
+
+def _data_source(snapshot: Snapshot) -> Snapshot:
+    """``snapshot``, or the mock data while nothing is uploaded"""
+    return snapshot if len(snapshot) else _mock_source()
+
+def _sections(snapshot: Snapshot) -> Dict[str, tuple]:
+    """(memo key, compute, response model) of each landing-page section, shared
+    by its own endpoint and ``/overview`` so either fills the other's cache"""
+    if not len(snapshot):
+        # Return mock data when no real data is uploaded
+        mock = _mock_source()
+        return {
+            "dashboard": (None, get_mock_dashboard_summary, DashboardSummary),
+            "statistics": (None, lambda: compute_statistics(mock.aggregates), DetailedStatistics),
+            "ai_insights": (None, get_mock_ai_insights, AiInsights),
+            "frameworks": (None, lambda: {"frameworks": mock.frameworks()}, None),
+            "providers": (None, lambda: {"providers": mock.providers()}, None),
+        }
+    # Trends cover the last 7 days in hour buckets, so statistics hold for the current hour
+    hour = datetime.utcnow().strftime("%Y-%m-%dT%H")
+    return {
+        "dashboard": (("dashboard",), lambda: compute_dashboard(snapshot.aggregates), DashboardSummary),
+        "statistics": (("statistics", hour),
+                       lambda: compute_statistics(snapshot.aggregates, updated_at=snapshot.created_at),
+                       DetailedStatistics),
+        "ai_insights": (("ai-insights",), lambda: compute_insights(_ai, snapshot.violations()), AiInsights),
+        "frameworks": (("frameworks",), lambda: {"frameworks": snapshot.frameworks()}, None),
+        "providers": (("providers",), lambda: {"providers": snapshot.providers()}, None),
+    }
 
-@router.post("/upload", response_model=dict, tags=["Data"])
-async def upload(file: UploadFile = File(...)):
+# Sections whose endpoint wraps the value in an object under the section's
+# name; /overview takes that member as it is
+_WRAPPED = {"frameworks", "providers"}
+
+@router.post("/upload", response_model=dict, status_code=202, tags=["Data"])
+async def upload(
+    response: Response,
+    file: UploadFile = File(...),
+    mode: UploadMode = Query(UploadMode.REPLACE),
+    skip_invalid: bool = Query(False, description="Drop invalid rows instead of rejecting the upload"),
+    wait: bool = Query(False, description="Respond only once the upload has been ingested")
+):
+    """Queue the CSV for background ingestion and return a job to poll.
+
+    Replaces the dataset, or with ``mode=upsert`` merges rows by id (rows
+    with a truthy ``deleted`` column delete that id).
+    """
     if not file.filename.lower().endswith(".csv"):
         raise HTTPException(400, "Only CSV files supported")
-    content = await file.read()
-    records = parse_and_validate_csv(content)
-    data_store.set_data(records)
-    return {"message": f"Loaded {len(records)} records"}
+    path = await run_in_threadpool(_spool, file.file)
+    try:
+        _check_spooled_header(path)
+    except HTTPException:
+        os.remove(path)
+        raise
+    job = start_upload(path, mode, skip_invalid)
+
+    if wait:
+        await asyncio.wrap_future(job.future)
+        if job.status == JobStatus.FAILED:
+            raise HTTPException(400, "; ".join(job.errors))
+        response.status_code = 200
+        return job.result
+    response.headers["Location"] = f"{router.prefix}/jobs/{job.id}"
+    return {"message": "Upload accepted", "job_id": job.id, "status_url": response.headers["Location"]}
+
+def _spool(src) -> str:
+    """Copy the request's upload to a file the background job owns"""
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=".csv")
+    with os.fdopen(fd, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=1024 * 1024)
+    return path
+
+def _check_spooled_header(path: str):
+    """Reject a missing-column upload now rather than in the job"""
+    with open(path, "rb") as f:
+        header = f.readline(64 * 1024)
+    if header.endswith(b"\n") or len(header) < 64 * 1024:
+        check_header(header)
+
+@router.get("/jobs/{job_id}", response_model=UploadJobStatus, tags=["Data"])
+def upload_job(job_id: str):
+    """Progress of a background upload"""
+    status = job_status(job_id)
+    if status is None:
+        raise HTTPException(404, f"Job {job_id} not found")
+    return status
 
 @router.get("/dashboard", response_model=DashboardSummary, tags=["Metrics"])
-def dashboard():
-    if data_store.is_empty():
-        # Return mock data when no real data is uploaded
-        return get_mock_dashboard_summary()
-    return compute_dashboard(data_store.get_data())
+def dashboard(request: Request):
+    snapshot = data_store.snapshot()
+    return _cached_json(request, snapshot, *_sections(snapshot)["dashboard"])
+
+@router.get("/overview", response_model=Overview, tags=["Metrics"])
+def overview(
+    request: Request,
+    sections: List[OverviewSection] = Query(list(OverviewSection), description="Sections to include (default: all)")
+):
+    """The landing page in one round trip: the chosen sections of ``/dashboard``,
+    ``/statistics``, ``/ai-insights``, ``/frameworks`` and ``/providers``, all
+    from the same data version"""
+    snapshot = data_store.snapshot()
+    table = _sections(snapshot)
+    names = tuple(dict.fromkeys(section.value for section in sections))
+
+    def compute():
+        members = []
+        for name in names:
+            body, _ = _encoded(snapshot, *table[name])
+            if name in _WRAPPED:
+                # {"frameworks":[...]} -> [...]
+                body = body[len(dumps(name)) + 2:-1]
+            members.append((name, body))
+        return join_json(members)
+
+    if not len(snapshot):
+        encoded = compute()
+    else:
+        hour = datetime.utcnow().strftime("%Y-%m-%dT%H")
+        encoded = snapshot.memo(("overview", hour, names), compute)
+    return json_response(request, encoded, {"X-Data-Version": str(snapshot.version)})
+
+def _live_state(tenant: str):
+    """Cursor and payload of ``/dashboard/stream``: what ``/dashboard`` and
+    ``/statistics`` return for the tenant's current version and hour"""
+    snapshot = data_store.get(tenant, record=False).snapshot()
+    # Statistics trends cover the last 7 days in hour buckets, so the state also moves hourly
+    hour = datetime.utcnow().strftime("%Y-%m-%dT%H")
+
+    def compute():
+        if not len(snapshot):
+            summary, stats = get_mock_dashboard_summary(), compute_statistics(_mock_source().aggregates)
+        else:
+            summary = compute_dashboard(snapshot.aggregates)
+            stats = compute_statistics(snapshot.aggregates, updated_at=snapshot.created_at)
+        return {"version": snapshot.version, "dashboard": summary.model_dump(mode="json"),
+                "statistics": stats.model_dump(mode="json")}
+
+    return f"{snapshot.version}.{hour}", snapshot.memo(("live", hour), compute)
+
+# One feed per tenant, created on its first subscription
+_live_feeds: Dict[str, LiveFeed] = {}
+Gauge("compliance_live_subscribers", "Open /dashboard/stream connections in this process",
+      collect=lambda: sum(feed.subscribers for feed in list(_live_feeds.values())))
+
+def _live_feed() -> LiveFeed:
+    tenant = current_tenant()
+    feed = _live_feeds.get(tenant)
+    if feed is None:
+        feed = _live_feeds.setdefault(tenant, LiveFeed(partial(_live_state, tenant), settings.live_poll_interval))
+    return feed
+
+@router.get("/dashboard/stream", tags=["Metrics"], responses={200: {"content": {"text/event-stream": {}}}})
+async def dashboard_stream(
+    request: Request,
+    since: Optional[str] = Query(None, description="Cursor (event id) of the last state seen; Last-Event-ID wins")
+):
+    """Server-sent events instead of polling ``/dashboard`` and ``/statistics``.
+
+    The first event is a ``snapshot`` holding both payloads, unless the
+    cursor names a recent state; each change then sends a ``delta`` with
+    only what changed: changed keys of nested objects (null for removed
+    ones), and ``{"added", "removed"}`` for ``recent_violations``.
+    """
+    cursor = request.headers.get("last-event-id") or since
+    return StreamingResponse(_live_feed().subscribe(cursor), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @router.get("/ai-insights", response_model=AiInsights, tags=["AI"])
-def ai_insights():
-    if data_store.is_empty():
-        # Return mock AI insights when no real data is uploaded
-        return get_mock_ai_insights()
-    violations = [c.dict() for c in data_store.get_data() if c.status != StatusLevel.PASSING]
-    return _ai.generate_insights(violations)
-
-@router.get("/checks", response_model=List[ComplianceCheck], tags=["Data"])
+def ai_insights(request: Request):
+    snapshot = data_store.snapshot()
+    return _cached_json(request, snapshot, *_sections(snapshot)["ai_insights"])
+
+@router.get("/checks", response_model=List[ComplianceCheck], tags=["Data"],
+            responses={200: {"content": {"application/x-ndjson": {}}}})
 def list_checks(
+    request: Request,
     framework: Optional[str] = Query(None),
     provider: Optional[str]  = Query(None),
     severity: Optional[str]  = Query(None),
     status:   Optional[str]  = Query(None),
-    limit:    int            = Query(100)
+    limit:    Optional[int]  = Query(None, ge=0, description="Default 100; every row when streaming"),
+    offset:   int            = Query(0, ge=0),
+    cursor:   Optional[str]  = Query(None, description="X-Next-Cursor header of the previous page"),
+    sort:     Optional[CheckSort] = Query(None)
 ):
+    """Checks matching the filters; ``Accept: application/x-ndjson`` streams them"""
     # Use persistent data if available, otherwise mock data
-    data_source = data_store.get_data() if not data_store.is_empty() else get_mock_compliance_checks()
-    res = data_source
-    
-    if framework: res = [r for r in res if r.framework == framework]
-    if provider:  res = [r for r in res if r.provider == provider]
-    if severity:  res = [r for r in res if r.severity.value == severity]
-    if status:    res = [r for r in res if r.status.value == status]
-    return res[:limit]
+    snapshot = data_store.snapshot()
+    data_source = _data_source(snapshot)
+    filters = {"framework": framework, "provider": provider, "severity": severity, "status": status}
+    try:
+        if wants_ndjson(request):
+            batches = data_source.stream(filters, sort=sort.value if sort else None,
+                                         cursor=cursor, offset=offset, limit=limit)
+            return ndjson_response(batches, _version_headers(snapshot))
+        rows, next_cursor = data_source.page(filters, sort=sort.value if sort else None,
+                                             cursor=cursor, offset=offset, limit=100 if limit is None else limit)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    headers = {**_version_headers(snapshot), **VARY_ACCEPT}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    # Stored rows were validated on ingest; encode them as they are
+    return records_response(rows, headers)
+
+@router.get("/checks/search", response_model=SearchResults, tags=["Data"])
+def search_checks(
+    q: str = Query(..., min_length=1, description="Words that must all occur in the description or AI summary"),
+    framework: Optional[str] = Query(None),
+    provider: Optional[str]  = Query(None),
+    severity: Optional[str]  = Query(None),
+    status:   Optional[str]  = Query(None),
+    limit:    int            = Query(20, ge=0, le=1000),
+    offset:   int            = Query(0, ge=0)
+):
+    """Checks whose texts contain every word of ``q``, most relevant first (BM25)"""
+    snapshot = data_store.snapshot()
+    filters = {"framework": framework, "provider": provider, "severity": severity, "status": status}
+    try:
+        rows, total = _data_source(snapshot).search(q, filters, offset=offset, limit=limit)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return records_response({"query": q, "total": total, "results": rows}, _version_headers(snapshot))
+
+@router.delete("/checks/{check_id}", tags=["Data"])
+def delete_check(check_id: str):
+    """Delete a single check by id"""
+    if not data_store.delete_ids([check_id]):
+        raise HTTPException(404, f"Check {check_id} not found")
+    return {"message": f"Deleted check {check_id}"}
 
 @router.get("/frameworks", tags=["Data"])
-def frameworks():
-    data_source = data_store.get_data() if not data_store.is_empty() else get_mock_compliance_checks()
-    return {"frameworks": sorted({r.framework for r in data_source})}
+def frameworks(request: Request):
+    snapshot = data_store.snapshot()
+    return _cached_json(request, snapshot, *_sections(snapshot)["frameworks"])
 
 @router.get("/providers", tags=["Data"])
-def providers():
-    data_source = data_store.get_data() if not data_store.is_empty() else get_mock_compliance_checks()
-    return {"providers": sorted({r.provider for r in data_source})}
+def providers(request: Request):
+    snapshot = data_store.snapshot()
+    return _cached_json(request, snapshot, *_sections(snapshot)["providers"])
 
-@router.post("/scan", response_model=ScanResult, tags=["Data"])
-def scan():
-    if data_store.is_empty():
+@router.post("/scan", response_model=ScanResult, tags=["Data"],
+             responses={200: {"content": {"application/x-ndjson": {}}}})
+def scan(request: Request, response: Response):
+    """Every failing check; ``Accept: application/x-ndjson`` streams them one per line"""
+    snapshot = _snapshot(response)
+    response.headers.update(VARY_ACCEPT)
+    ndjson = wants_ndjson(request)
+    if not len(snapshot):
         # Return mock scan result when no real data is uploaded
-        mock_checks = get_mock_compliance_checks()
+        mock_checks = get_mock_compliance_checks()[:10]  # Return first 10 as scan results
+        if ndjson:
+            return ndjson_response([[check.model_dump(mode="json") for check in mock_checks]],
+                                   {**_version_headers(snapshot), "X-Scanned-At": datetime.utcnow().isoformat()})
         return ScanResult(
-            results=mock_checks[:10],  # Return first 10 as scan results
+            results=mock_checks,
             scanned_at=datetime.now()
         )
-    return perform_scan(data_store.get_data())
+    if ndjson:
+        headers = {**_version_headers(snapshot), "X-Scanned-At": datetime.utcnow().isoformat()}
+        return ndjson_response(snapshot.stream_violations(), headers)
+    return records_response(perform_scan(snapshot.violations()), {**_version_headers(snapshot), **VARY_ACCEPT})
 
 @router.get("/statistics", response_model=DetailedStatistics, tags=["Analytics"])
-def statistics():
-    if data_store.is_empty():
-        # Return mock statistics when no real data is uploaded
-        mock_checks = get_mock_compliance_checks()
-        return compute_statistics(mock_checks)
-    return compute_statistics(data_store.get_data())
+def statistics(request: Request):
+    snapshot = data_store.snapshot()
+    return _cached_json(request, snapshot, *_sections(snapshot)["statistics"])
+
+@router.get("/statistics/risk", response_model=RiskStatistics, tags=["Analytics"])
+def risk_statistics(
+    request: Request,
+    by: Optional[TrendDimension] = Query(None, description="Only this dimension (default: all of them)"),
+    q: List[float] = Query(list(DEFAULT_QUANTILES), description="Quantiles to report, each in (0, 1]")
+):
+    """Risk score percentiles and histograms overall and per group, read from
+    histograms kept up to date at ingest (0.01 resolution)"""
+    snapshot = data_store.snapshot()
+    aggregates = snapshot.aggregates if len(snapshot) else _data_source(snapshot).aggregates
+    # Only the default quantiles are kept per snapshot; other lists are too many to memoize
+    key = ("risk", by.value if by else None) if len(snapshot) and tuple(q) == DEFAULT_QUANTILES else None
+    try:
+        return _cached_json(request, snapshot, key,
+                            lambda: compute_risk_statistics(aggregates, by, q), RiskStatistics)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@router.get("/trends", response_model=TrendSeries, tags=["Analytics"])
+def trends(
+    request: Request,
+    start: Optional[datetime] = Query(None, description="Inclusive; default 7 days before end"),
+    end: Optional[datetime] = Query(None, description="Exclusive; default the end of the current hour"),
+    granularity: TrendGranularity = Query(TrendGranularity.DAY),
+    by: Optional[TrendDimension] = Query(None, description="Split the counts by this dimension")
+):
+    """Checks per time bucket of last_checked, answered from hourly counts"""
+    snapshot = data_store.snapshot()
+    aggregates = snapshot.aggregates if len(snapshot) else _data_source(snapshot).aggregates
+    if end is None:
+        end = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    if start is None:
+        start = end - timedelta(days=7)
+    # Only the default window is kept per snapshot; explicit ranges are too many to memoize
+    explicit = "start" in request.query_params or "end" in request.query_params
+    key = None if explicit or not len(snapshot) else (
+        "trends", end.isoformat(), granularity.value, by.value if by else None)
+    try:
+        return _cached_json(request, snapshot, key,
+                            lambda: compute_trends(aggregates, start, end, granularity, by), TrendSeries)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@router.get("/history", response_model=List[HistoryVersion], tags=["History"])
+def history():
+    """Recorded versions of the dataset, oldest first"""
+    if data_store.history is None:
+        return []
+    return data_store.history.describe()
+
+@router.get("/diff", response_model=CheckDiff, tags=["History"])
+def diff(
+    from_version: Optional[int] = Query(None, alias="from", description="Default: the version before `to`"),
+    to_version:   Optional[int] = Query(None, alias="to", description="Default: the latest version"),
+    limit:        int           = Query(100, ge=0, description="Checks returned per list, highest risk first")
+):
+    """Checks that started failing, started passing or changed risk between two versions"""
+    if data_store.history is None:
+        raise HTTPException(404, "History is disabled")
+    versions = data_store.history.versions()
+    if to_version is None and versions:
+        to_version = versions[-1]
+    if from_version is None:
+        earlier = [v for v in versions if to_version is not None and v < to_version]
+        if not earlier:
+            raise HTTPException(404, "No earlier version to compare with")
+        from_version = earlier[-1]
+    try:
+        return data_store.history.diff(from_version, to_version, limit)
+    except KeyError as e:
+        raise HTTPException(404, e.args[0])
 
 @router.delete("/data", tags=["Data"])
 def clear_data():
@@ -95,9 +426,10 @@ def clear_data():
     return {"message": "All data cleared, returning to mock data"}
 
 @router.get("/data/status", tags=["Data"])
-def data_status():
+def data_status(response: Response):
     """Get information about current data status"""
-    if data_store.is_empty():
+    snapshot = _snapshot(response)
+    if not len(snapshot):
         return {
             "status": "mock_data",
             "message": "Using mock data - no real data uploaded",
@@ -107,5 +439,10 @@ def data_status():
         return {
             "status": "real_data", 
             "message": "Using uploaded real data",
-            "record_count": len(data_store.get_data())
-        }
\ No newline at end of file
+            "record_count": len(snapshot)
+        }
+
+@router.get("/tenants", response_model=TenantsSummary, tags=["Data"])
+def tenants():
+    """Tenants this process has served: resident or not, estimated memory, hit rate"""
+    return data_store.describe()
@@ -0,0 +1,280 @@
+"""Full-text search over check descriptions and AI summaries.
+
+Check texts repeat a lot (one finding template, many resources), so the
+index works on distinct texts: a ``Vocabulary`` tokenizes each text once
+and keeps term -> (text id, term frequency) postings, and a ``TextIndex``
+maps every row of one table to the text ids of its two fields. Rows with
+the same pair of texts score the same, so a query scores the distinct
+pairs and only expands the best ones back to rows.
+
+Ranking is BM25 over the two fields taken together (as SQLite's FTS5
+``bm25()`` does), and every query term must occur in one of them.
+"""
+import re
+from array import array
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# BM25 term-frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+# Query terms beyond this many are ignored
+MAX_TERMS = 16
+# Postings pack the term frequency (capped) into the low bits of the text id
+TF_BITS = 16
+TF_MAX = (1 << TF_BITS) - 1
+_TOKEN = re.compile(r"[^\W_]+")
+# Too common to help ranking; neither indexed nor searched
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its no not of on or that the this to was were "
+    "will with".split()
+)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercased words of ``text``, stopwords dropped"""
+    if not text:
+        return []
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class Vocabulary:
+    """Every distinct text seen so far, tokenized once.
+
+    Shared by the text indexes of successive versions of one table, so an
+    upsert only tokenizes texts that are new. Text id 0 is the empty text.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {"": 0}
+        self._lengths = array("I", [0])
+        # term -> text id << TF_BITS | term frequency, by ascending text id
+        self._postings: Dict[str, array] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @property
+    def nbytes(self) -> int:
+        postings = sum(posting.itemsize * len(posting) for posting in self._postings.values())
+        # Keys and dict slots, roughly
+        return postings + len(self._ids) * 100 + len(self._postings) * 100
+
+    def encode(self, values) -> np.ndarray:
+        """Text id of each value (None counts as the empty text)"""
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        known = self._ids
+        ids = [known.get(text) for text in uniques.tolist()]
+        if None in ids:
+            with self._lock:
+                ids = [known.get(text) if text_id is None else text_id for text, text_id in zip(uniques.tolist(), ids)]
+                ids = [self._add(text) if text_id is None else text_id for text, text_id in zip(uniques.tolist(), ids)]
+        # factorize codes missing values as -1, which picks the appended 0
+        return np.array(ids + [0], dtype=np.int32)[codes]
+
+    def _add(self, text: str) -> int:
+        """Index a new text; the lock is held"""
+        text_id = self._ids[text] = len(self._lengths)
+        terms: Dict[str, int] = {}
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0) + 1
+        self._lengths.append(sum(terms.values()))
+        postings = self._postings
+        for term, tf in terms.items():
+            posting = postings.get(term)
+            if posting is None:
+                posting = postings[term] = array("Q")
+            posting.append(text_id << TF_BITS | min(tf, TF_MAX))
+        return text_id
+
+    def lengths(self) -> np.ndarray:
+        """Number of indexed terms in each text, by text id"""
+        with self._lock:
+            return np.array(self._lengths, dtype=np.int64)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(ascending text ids, term frequencies) of the texts containing ``term``"""
+        with self._lock:
+            packed = np.array(self._postings.get(term, ()), dtype=np.int64)
+        return packed >> TF_BITS, packed & TF_MAX
+
+
+class _Pairs:
+    """The distinct (description, ai_summary) text pairs of one table"""
+
+    def __init__(self, description: np.ndarray, summary: np.ndarray, lengths: np.ndarray):
+        codes, uniques = pd.factorize(description.astype(np.int64) << 32 | summary.astype(np.int64))
+        self.codes = codes.astype(np.int32)
+        self.description = (uniques >> 32).astype(np.int64)
+        self.summary = (uniques & 0xFFFFFFFF).astype(np.int64)
+        self.counts = np.bincount(self.codes, minlength=len(uniques))
+        self.lengths = lengths[self.description] + lengths[self.summary]
+        total = len(self.codes)
+        self.avg_length = float(self.counts @ self.lengths) / total if total else 0.0
+        # Rows of pair p, ascending: rows[starts[p]:starts[p] + counts[p]]
+        self.rows = np.argsort(self.codes, kind="stable").astype(np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        # Text ids past the vocabulary this table was encoded with do not occur in it
+        self.texts = len(lengths)
+        self.by_description = _ByText(self.description, self.counts, self.texts)
+        self.by_summary = _ByText(self.summary, self.counts, self.texts)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.codes, self.description, self.summary, self.counts, self.lengths, self.rows, self.starts)
+        return sum(a.nbytes for a in arrays) + self.by_description.nbytes + self.by_summary.nbytes
+
+    def expand(self, pairs: np.ndarray) -> np.ndarray:
+        """Rows of the given pairs, pair by pair"""
+        return self.rows[_ranges(self.starts[pairs], self.counts[pairs])]
+
+
+class _ByText:
+    """The pairs holding each text in one field, and how many rows that is"""
+
+    def __init__(self, texts: np.ndarray, counts: np.ndarray, size: int):
+        self.order = np.argsort(texts, kind="stable")
+        self.starts = np.searchsorted(texts[self.order], np.arange(size + 1))
+        self.rows = np.bincount(texts, weights=counts, minlength=size).astype(np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return self.order.nbytes + self.starts.nbytes + self.rows.nbytes
+
+    def sizes(self, texts: np.ndarray) -> np.ndarray:
+        return self.starts[texts + 1] - self.starts[texts]
+
+    def pairs(self, texts: np.ndarray) -> np.ndarray:
+        return self.order[_ranges(self.starts[texts], self.sizes(texts))]
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """``concatenate([arange(s, s + n) for s, n in zip(starts, lengths)])`` without the loop"""
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    return np.repeat(starts - offsets, lengths) + np.arange(int(lengths.sum()), dtype=np.int64)
+
+
+class TextIndex:
+    """Text ids of the ``description`` and ``ai_summary`` of every row of one table"""
+
+    def __init__(self, vocabulary: Vocabulary, description: np.ndarray, summary: np.ndarray):
+        self.vocabulary = vocabulary
+        self.description = description
+        self.summary = summary
+        self._pairs: Optional[_Pairs] = None
+
+    @classmethod
+    def build(cls, table, vocabulary: Optional[Vocabulary] = None) -> "TextIndex":
+        vocabulary = vocabulary or Vocabulary()
+        return cls(vocabulary, vocabulary.encode(table.description), vocabulary.encode(table.ai_summary))
+
+    def apply_delta(self, added, order: np.ndarray) -> "TextIndex":
+        """The index of ``concat([table, added]).take(order)``: only ``added`` is tokenized"""
+        return TextIndex(
+            self.vocabulary,
+            np.concatenate([self.description, self.vocabulary.encode(added.description)])[order],
+            np.concatenate([self.summary, self.vocabulary.encode(added.ai_summary)])[order],
+        )
+
+    @property
+    def nbytes(self) -> int:
+        pairs = self._pairs.nbytes if self._pairs is not None else 0
+        return self.description.nbytes + self.summary.nbytes + pairs + self.vocabulary.nbytes
+
+    def pairs(self) -> _Pairs:
+        if self._pairs is None:
+            self._pairs = _Pairs(self.description, self.summary, self.vocabulary.lengths())
+        return self._pairs
+
+    def score_pairs(self, terms: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, BM25 scores) of the text pairs holding every term.
+
+        Only the pairs of the rarest term are scored, so the cost follows the
+        number of matches rather than the size of the table.
+        """
+        pairs = self.pairs()
+        total = len(pairs.codes)
+        postings = []
+        for term in terms:
+            ids, tfs = self.vocabulary.postings(term)
+            keep = ids < pairs.texts
+            ids, tfs = ids[keep], tfs[keep]
+            if not len(ids):
+                return np.empty(0, dtype=np.int64), np.empty(0)
+            postings.append((ids, tfs, self._rows_with(ids)))
+
+        # Candidates: the pairs holding the rarest term in either field
+        ids = min(postings, key=lambda posting: posting[2])[0]
+        found = np.union1d(pairs.by_description.pairs(ids), pairs.by_summary.pairs(ids))
+        scores = np.zeros(len(found))
+        norm = K1 * (1 - B + B * pairs.lengths[found] / pairs.avg_length)
+        by_text = np.zeros(pairs.texts, dtype=np.int64)
+        for ids, tfs, df in postings:
+            by_text[ids] = tfs
+            tf = by_text[pairs.description[found]] + by_text[pairs.summary[found]]
+            by_text[ids] = 0
+            idf = np.log((total - df + 0.5) / (df + 0.5))
+            # As in FTS5, terms in more than half the rows still count a little
+            idf = idf if idf > 0 else 1e-6
+            scores += np.where(tf > 0, idf * tf * (K1 + 1) / (tf + norm), -np.inf)
+        matched = scores > -np.inf
+        return found[matched], scores[matched]
+
+    def _rows_with(self, ids: np.ndarray) -> int:
+        """Rows holding one of the texts ``ids`` in either field"""
+        pairs = self.pairs()
+        rows = int(pairs.by_description.rows[ids].sum() + pairs.by_summary.rows[ids].sum())
+        # Pairs with such a text in both fields were counted twice; look from the smaller side
+        holds = np.zeros(pairs.texts, dtype=bool)
+        holds[ids] = True
+        if pairs.by_description.sizes(ids).sum() <= pairs.by_summary.sizes(ids).sum():
+            both = pairs.by_description.pairs(ids)
+            both = both[holds[pairs.summary[both]]]
+        else:
+            both = pairs.by_summary.pairs(ids)
+            both = both[holds[pairs.description[both]]]
+        return rows - int(pairs.counts[both].sum())
+
+    def search(self, query: str, candidates: Optional[np.ndarray] = None, offset: int = 0,
+               limit: int = 20) -> Tuple[np.ndarray, np.ndarray, int]:
+        """(positions, scores) of one page of the rows matching ``query``, best
+        first (ties in row order), and how many rows match.
+
+        ``candidates`` (sorted positions, e.g. from the structured filters)
+        restricts the rows considered.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+        if not terms:
+            raise ValueError("Query has no searchable terms")
+        pairs = self.pairs()
+        hits, hit_scores = self.score_pairs(terms)
+        wanted = offset + limit
+        if candidates is None:
+            total = int(pairs.counts[hits].sum())
+            # Only the best pairs down to (and tied with) the one holding the last wanted row
+            best = np.argsort(-hit_scores, kind="stable")
+            hits, hit_scores = hits[best], hit_scores[best]
+            reach = int(np.searchsorted(np.cumsum(pairs.counts[hits]), wanted))
+            if reach < len(hits):
+                keep = hit_scores >= hit_scores[reach]
+                hits, hit_scores = hits[keep], hit_scores[keep]
+            positions = pairs.expand(hits)
+            scores = np.repeat(hit_scores, pairs.counts[hits])
+        else:
+            # ``hits`` is ascending, so each candidate's pair is found by bisection
+            codes = pairs.codes[candidates]
+            at = np.searchsorted(hits, codes).clip(max=max(len(hits) - 1, 0))
+            matched = hits[at] == codes if len(hits) else np.zeros(len(codes), dtype=bool)
+            positions, scores = candidates[matched], hit_scores[at[matched]]
+            total = len(positions)
+            if total > wanted and wanted:
+                cutoff = -np.partition(-scores, wanted - 1)[wanted - 1]
+                keep = scores >= cutoff
+                positions, scores = positions[keep], scores[keep]
+        order = np.lexsort((positions, -scores))[offset:wanted]
+        return positions[order], scores[order], total
+
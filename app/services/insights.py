@@ -1,7 +1,11 @@
-from typing import List, Dict, Any
-from app.ai_model import AIModel
+from typing import Dict
+
+import numpy as np
 
-_ai = AIModel  # instantiated in router
+from app.ai_model import AIModel
+from app.columnar import CheckTable, PASSING
 
-def generate_insights(violations: List[Dict[str, Any]]) -> Dict:
-    return _ai.generate_insights(violations)
\ No newline at end of file
+def compute_insights(ai: AIModel, records: CheckTable) -> Dict:
+    """AI insights over every non-passing check"""
+    violations = np.flatnonzero(records.status != PASSING)
+    return ai.generate_insights(records, violations)
@@ -0,0 +1,64 @@
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+from app.aggregates import Aggregates, RISK_BINS, RISK_STEP, TREND_DIMENSIONS
+from app.models import RiskDistribution, RiskStatistics, TrendDimension
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+# Value of each risk bin
+_BIN_VALUES = np.arange(RISK_BINS) * RISK_STEP
+# Unit-wide histogram bucket of each risk bin; a score of exactly 10 joins the last one
+_BIN_BUCKETS = np.minimum(np.floor(_BIN_VALUES + RISK_STEP / 2), 9).astype(np.int64)
+
+
+def merge_bins(histograms: Iterable[np.ndarray]) -> np.ndarray:
+    """Combine risk histograms (of other groups, tenants or processes) into one"""
+    total = np.zeros(RISK_BINS, dtype=np.int64)
+    for bins in histograms:
+        total += bins
+    return total
+
+
+def quantile_key(q: float) -> str:
+    return f"p{q * 100:g}"
+
+
+def distribution(bins: np.ndarray, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> RiskDistribution:
+    """Summary of one risk histogram, in time proportional to its (fixed) number of bins"""
+    n = int(bins.sum())
+    if not n:
+        return RiskDistribution(count=0, mean=0.0, min=0.0, max=0.0,
+                                quantiles={quantile_key(q): 0.0 for q in quantiles}, histogram=[0] * 10)
+    cumulative = np.cumsum(bins)
+    # Nearest rank: the smallest score with at least ceil(q * n) checks at or below it
+    ranks = np.maximum(np.ceil(np.asarray(quantiles, dtype=float) * n), 1)
+    positions = np.searchsorted(cumulative, ranks)
+    occupied = np.flatnonzero(bins)
+    return RiskDistribution(
+        count=n,
+        mean=round(float(bins @ _BIN_VALUES) / n, 2),
+        min=round(float(_BIN_VALUES[occupied[0]]), 2),
+        max=round(float(_BIN_VALUES[occupied[-1]]), 2),
+        quantiles={quantile_key(q): round(float(_BIN_VALUES[p]), 2) for q, p in zip(quantiles, positions.tolist())},
+        histogram=np.bincount(_BIN_BUCKETS, weights=bins, minlength=10).astype(np.int64).tolist(),
+    )
+
+
+def compute_risk_statistics(aggregates: Aggregates, by: Optional[TrendDimension] = None,
+                            quantiles: Sequence[float] = DEFAULT_QUANTILES) -> RiskStatistics:
+    """Risk score distributions overall and per label of ``by`` (every dimension when None).
+
+    Reads the histograms kept in the aggregates, so the cost does not grow
+    with the number of checks.
+    """
+    if any(not 0 < q <= 1 for q in quantiles):
+        raise ValueError("Quantiles must be in (0, 1]")
+    dims = TREND_DIMENSIONS if by is None else (by.value,)
+    by_dim: Dict[str, Dict[str, RiskDistribution]] = {
+        dim: {label: distribution(bins, quantiles) for label, bins in sorted(aggregates.risk_by[dim].items())}
+        for dim in dims
+    }
+    # Every check has exactly one severity
+    overall = merge_bins(aggregates.risk_by["severity"].values())
+    return RiskStatistics(resolution=RISK_STEP, overall=distribution(overall, quantiles), by=by_dim)
@@ -1,6 +1,9 @@
 from datetime import datetime
-from app.models import ScanResult, ComplianceCheck
+from typing import Dict
 
-def perform_scan(records: list[ComplianceCheck]) -> ScanResult:
-    failures = [r for r in records if r.status != r.StatusLevel.PASSING]
-    return ScanResult(results=failures, scanned_at=datetime.utcnow())
\ No newline at end of file
+from app.columnar import CheckTable, PASSING
+
+def perform_scan(records: CheckTable) -> Dict:
+    """Every failing check, as plain records in the ``ScanResult`` shape"""
+    failures = records.records(records.status != PASSING)
+    return {"results": failures, "scanned_at": datetime.utcnow()}
@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.aggregates import Aggregates
+from app.models import TrendDimension, TrendGranularity, TrendSeries
+
+# Longest series /trends returns (a year of hours is 8,784)
+MAX_BUCKETS = 10_000
+
+
+def to_utc_hour(value: datetime, round_up: bool = False) -> int:
+    """Hours since the epoch (naive datetimes are taken as UTC)"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    hour = np.datetime64(value, "us").astype("datetime64[h]")
+    if round_up and hour < np.datetime64(value, "us"):
+        hour += 1
+    return int(hour.astype(np.int64))
+
+
+def bucket_starts(hours: np.ndarray, granularity: TrendGranularity) -> np.ndarray:
+    """Start (datetime64[h]) of the bucket holding each hour"""
+    hours = np.asarray(hours, dtype=np.int64).astype("datetime64[h]")
+    if granularity == TrendGranularity.HOUR:
+        return hours
+    days = hours.astype("datetime64[D]")
+    if granularity == TrendGranularity.DAY:
+        starts = days
+    elif granularity == TrendGranularity.WEEK:
+        # Day 0 (1970-01-01) was a Thursday: Monday is 3 days before it
+        starts = days - (days.astype(np.int64) + 3) % 7
+    else:
+        starts = hours.astype("datetime64[M]").astype("datetime64[D]")
+    return starts.astype("datetime64[h]")
+
+
+def compute_trends(aggregates: Aggregates, start: datetime, end: datetime,
+                   granularity: TrendGranularity = TrendGranularity.DAY,
+                   by: Optional[TrendDimension] = None) -> TrendSeries:
+    """Checks per bucket whose last_checked lies in [start, end), to the hour.
+
+    Reads the hourly counts only, so the cost grows with the number of hour
+    buckets in the data, never with the number of checks.
+    """
+    first, stop = to_utc_hour(start), to_utc_hour(end, round_up=True)
+    if stop <= first:
+        raise ValueError("end must be after start")
+
+    # Every bucket overlapping the range, empty ones included; counted before any is allocated
+    first_bucket, last_bucket = bucket_starts(np.array([first, stop - 1]), granularity)
+    if granularity == TrendGranularity.MONTH:
+        first_month, last_month = first_bucket.astype("datetime64[M]"), last_bucket.astype("datetime64[M]")
+        count = int((last_month - first_month).astype(np.int64)) + 1
+    else:
+        step = {TrendGranularity.HOUR: 1, TrendGranularity.DAY: 24, TrendGranularity.WEEK: 24 * 7}[granularity]
+        count = int((last_bucket - first_bucket).astype(np.int64)) // step + 1
+    if count > MAX_BUCKETS:
+        raise ValueError(f"Range spans {count} {granularity.value} buckets; at most {MAX_BUCKETS} allowed")
+    if granularity == TrendGranularity.MONTH:
+        buckets = np.arange(first_month, last_month + 1).astype("datetime64[h]")
+    else:
+        buckets = np.arange(first_bucket, last_bucket + 1, step)
+
+    by_label = {"total": aggregates.hourly} if by is None else aggregates.hourly_by[by.value]
+    series: Dict[str, list] = {}
+    for label in sorted(by_label):
+        hourly = by_label[label]
+        hours = np.fromiter(hourly.keys(), dtype=np.int64, count=len(hourly))
+        counts = np.fromiter(hourly.values(), dtype=np.int64, count=len(hourly))
+        in_range = (hours >= first) & (hours < stop)
+        if not in_range.any() and by is not None:
+            continue
+        positions = np.searchsorted(buckets, bucket_starts(hours[in_range], granularity))
+        series[label] = np.bincount(positions, weights=counts[in_range],
+                                    minlength=len(buckets)).astype(np.int64).tolist()
+
+    return TrendSeries(
+        start=np.datetime64(first, "h").astype(datetime),
+        end=np.datetime64(stop, "h").astype(datetime),
+        granularity=granularity,
+        by=by,
+        buckets=buckets.astype(datetime).tolist(),
+        series=series,
+    )
@@ -0,0 +1,525 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.aggregates import Aggregates, RECENT_VIOLATIONS, RISK_BINS, RISK_STEP, TREND_DIMENSIONS, _US_PER_HOUR
+from app.columnar import CheckTable, SEVERITIES, STATUSES
+from app.config import settings
+from app.data_store import STREAM_BATCH_ROWS, Snapshot
+from app.history import History
+from app.indexes import decode_cursor, encode_cursor
+from app.metrics import stage
+from app.models import ComplianceCheck, SeverityLevel, StatusLevel
+from app.search import MAX_TERMS, tokenize
+from app.storage import WRITE_BATCH_ROWS, directory_bytes
+
+# SQLite's default page cache limit per connection (cache_size = -2000 KiB)
+CACHE_BYTES = 2000 * 1024
+
+COLUMNS = ("id", "framework", "provider", "severity", "status",
+           "risk_score", "description", "last_checked", "ai_summary")
+# Every column but the key, as compared to decide whether an upsert changes a row
+_VALUES = COLUMNS[1:]
+_EPOCH = datetime(1970, 1, 1)
+# Columns ``page`` may filter or sort on; they are spliced into the SQL
+_FILTERS = ("framework", "provider", "severity", "status")
+_SORTS = ("last_checked", "risk_score")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checks (
+    id           TEXT PRIMARY KEY,
+    framework    TEXT NOT NULL,
+    provider     TEXT NOT NULL,
+    severity     TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    risk_score   REAL NOT NULL,
+    description  TEXT NOT NULL,
+    last_checked INTEGER NOT NULL,  -- microseconds since the epoch, UTC
+    ai_summary   TEXT
+);
+CREATE INDEX IF NOT EXISTS checks_framework    ON checks (framework);
+CREATE INDEX IF NOT EXISTS checks_provider     ON checks (provider);
+CREATE INDEX IF NOT EXISTS checks_severity     ON checks (severity);
+CREATE INDEX IF NOT EXISTS checks_status       ON checks (status);
+CREATE INDEX IF NOT EXISTS checks_last_checked ON checks (last_checked);
+CREATE INDEX IF NOT EXISTS checks_risk_score   ON checks (risk_score);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('version', 0);
+-- Full-text index of the texts; the write paths keep it in step with checks
+CREATE VIRTUAL TABLE IF NOT EXISTS checks_fts USING fts5(
+    description, ai_summary, content = 'checks', content_rowid = 'rowid'
+);
+"""
+
+# Scratch tables of one upsert (executescript would commit the open transaction)
+_INCOMING = (
+    """CREATE TEMP TABLE IF NOT EXISTS incoming (
+        id TEXT PRIMARY KEY, framework TEXT, provider TEXT, severity TEXT, status TEXT,
+        risk_score REAL, description TEXT, last_checked INTEGER, ai_summary TEXT
+    )""",
+    "CREATE TEMP TABLE IF NOT EXISTS deleting (id TEXT PRIMARY KEY)",
+    "CREATE TEMP TABLE IF NOT EXISTS reindexing (id TEXT PRIMARY KEY)",
+    "DELETE FROM temp.incoming",
+    "DELETE FROM temp.deleting",
+    "DELETE FROM temp.reindexing",
+)
+# Full-text entries of rows about to change: removed before the write, the
+# new texts indexed after it (by id, as the write keeps each row's rowid)
+_UNINDEX = (
+    "INSERT INTO temp.reindexing SELECT i.id FROM temp.incoming i LEFT JOIN checks c ON c.id = i.id "
+    "WHERE c.id IS NULL OR c.description IS NOT i.description OR c.ai_summary IS NOT i.ai_summary",
+    "INSERT INTO checks_fts (checks_fts, rowid, description, ai_summary) "
+    "SELECT 'delete', rowid, description, ai_summary FROM checks "
+    "WHERE id IN (SELECT id FROM temp.reindexing) "
+    "OR (id IN (SELECT id FROM temp.deleting) AND id NOT IN (SELECT id FROM temp.incoming))",
+)
+_REINDEX = (
+    "INSERT INTO checks_fts (rowid, description, ai_summary) "
+    "SELECT rowid, description, ai_summary FROM checks WHERE id IN (SELECT id FROM temp.reindexing)"
+)
+
+_INSERT = f"INSERT INTO checks VALUES ({', '.join('?' * len(COLUMNS))})"
+_SELECT = f"SELECT {', '.join(COLUMNS)}, rowid FROM checks"
+
+
+class SqliteSnapshot(Snapshot):
+    """A version of the SQLite dataset; its queries run in the engine.
+
+    Nothing is held in memory but memoized results. Each query reads the
+    latest committed data, which is this version unless a write landed
+    since; the ETag still names the version the snapshot was taken at.
+    """
+
+    def __init__(self, store: "SqliteStore", version: int):
+        self.store = store
+        self.version = version
+        self.created_at = datetime.utcnow()
+        self.etag = f'W/"sqlite-{version}"'
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.memo("len", lambda: self.store.query("SELECT COUNT(*) FROM checks")[0][0])
+
+    @property
+    def table(self) -> CheckTable:
+        """Every row loaded into memory; the endpoints avoid this"""
+        return self.memo("table", lambda: _table(self.store.query(_SELECT + " ORDER BY rowid")))
+
+    @property
+    def aggregates(self) -> Aggregates:
+        return self.memo("aggregates", self._aggregates)
+
+    def _aggregates(self) -> Aggregates:
+        with stage("aggregation"):
+            return self._group()
+
+    def _group(self) -> Aggregates:
+        query = self.store.query
+        severity_code = {s.value: i for i, s in enumerate(SEVERITIES)}
+        status_code = {s.value: i for i, s in enumerate(STATUSES)}
+        recent = query(_SELECT + " WHERE status != ? ORDER BY last_checked DESC, id DESC LIMIT ?",
+                       (StatusLevel.PASSING.value, RECENT_VIOLATIONS))
+        return Aggregates.from_counts(
+            severity_status={
+                (severity_code[sev], status_code[st]): (n, risk)
+                for sev, st, n, risk in query(
+                    "SELECT severity, status, COUNT(*), TOTAL(risk_score) FROM checks GROUP BY severity, status")
+            },
+            frameworks={
+                fw: (n, risk) for fw, n, risk in query(
+                    "SELECT framework, COUNT(*), TOTAL(risk_score) FROM checks GROUP BY framework")
+            },
+            providers={
+                pr: (n, critical) for pr, n, critical in query(
+                    "SELECT provider, COUNT(*), SUM(severity = ? AND status != ?) FROM checks GROUP BY provider",
+                    (SeverityLevel.CRITICAL.value, StatusLevel.PASSING.value))
+            },
+            hourly=dict(query(
+                "SELECT last_checked / ?, COUNT(*) FROM checks GROUP BY 1", (_US_PER_HOUR,))),
+            recent=[(row[7], _check(row)) for row in recent],
+            hourly_by={dim: self._hourly_by(dim) for dim in TREND_DIMENSIONS},
+            risk_by={dim: self._risk_by(dim) for dim in TREND_DIMENSIONS},
+        )
+
+    def _hourly_by(self, dim: str) -> Dict[str, Dict[int, int]]:
+        by_label: Dict[str, Dict[int, int]] = {}
+        for label, hour, n in self.store.query(
+                f"SELECT {dim}, last_checked / ?, COUNT(*) FROM checks GROUP BY 1, 2", (_US_PER_HOUR,)):
+            by_label.setdefault(label, {})[hour] = n
+        return by_label
+
+    def _risk_by(self, dim: str) -> Dict[str, Dict[int, int]]:
+        """Checks per ``risk_bin`` of each label, binned the same way as ``risk_bin``"""
+        by_label: Dict[str, Dict[int, int]] = {}
+        for label, risk, n in self.store.query(
+                f"SELECT {dim}, MIN(MAX(CAST(risk_score / ? + 0.5 AS INTEGER), 0), ?), COUNT(*) "
+                f"FROM checks GROUP BY 1, 2", (RISK_STEP, RISK_BINS - 1)):
+            by_label.setdefault(label, {})[risk] = n
+        return by_label
+
+    def page(self, filters: Dict[str, Optional[str]], sort: Optional[str] = None, cursor: Optional[str] = None,
+             offset: int = 0, limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """Keyset pagination over (sort column, rowid); descending sorts walk the
+        index backwards, so rowid ties are descending too. Rowids do not shift
+        when rows are deleted, so cursors stay valid across deletes"""
+        sql, params = _page_query(filters, sort, cursor)
+        rows = self.store.query(sql, (*params, limit + 1, offset))
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            if rows:
+                last = rows[-1]
+                column = sort.lstrip("-") if sort else None
+                next_cursor = encode_cursor(sort, last[COLUMNS.index(column)] if column else None, last[-1],
+                                            last[0])
+        return [_record(row) for row in rows], next_cursor
+
+    def stream(self, filters: Dict[str, Optional[str]], sort: Optional[str] = None, cursor: Optional[str] = None,
+               offset: int = 0, limit: Optional[int] = None) -> Iterator[List[Dict]]:
+        sql, params = _page_query(filters, sort, cursor)
+        return self.store.stream(sql, (*params, -1 if limit is None else limit, offset))
+
+    def search(self, query: str, filters: Dict[str, Optional[str]], offset: int = 0,
+               limit: int = 20) -> Tuple[List[Dict], int]:
+        """FTS5 ``MATCH`` of every query term, ranked by ``bm25()``"""
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+        if not terms:
+            raise ValueError("Query has no searchable terms")
+        # Quoted terms, implicitly ANDed
+        where, params = ["checks_fts MATCH ?"], [" ".join(f'"{term}"' for term in terms)]
+        for dim in _FILTERS:
+            if filters.get(dim) is not None:
+                where.append(f"c.{dim} = ?")
+                params.append(filters[dim])
+        sql = f"FROM checks_fts JOIN checks c ON c.rowid = checks_fts.rowid WHERE {' AND '.join(where)}"
+        total, = self.store.query(f"SELECT COUNT(*) {sql}", params)[0]
+        rows = self.store.query(
+            f"SELECT {', '.join(f'c.{col}' for col in COLUMNS)}, c.rowid, -bm25(checks_fts) AS score {sql} "
+            f"ORDER BY score DESC, c.rowid LIMIT ? OFFSET ?", params + [limit, offset])
+        records = []
+        for row in rows:
+            record = _record(row[:-1])
+            record["score"] = round(row[-1], 4)
+            records.append(record)
+        return records, total
+
+    def stream_violations(self) -> Iterator[List[Dict]]:
+        return self.store.stream(_SELECT + " WHERE status != ? ORDER BY rowid", (StatusLevel.PASSING.value,))
+
+    def frameworks(self) -> List[str]:
+        return [fw for fw, in self.store.query("SELECT DISTINCT framework FROM checks ORDER BY framework")]
+
+    def providers(self) -> List[str]:
+        return [pr for pr, in self.store.query("SELECT DISTINCT provider FROM checks ORDER BY provider")]
+
+    def violations(self) -> CheckTable:
+        return _table(self.store.query(_SELECT + " WHERE status != ? ORDER BY rowid",
+                                       (StatusLevel.PASSING.value,)))
+
+
+def _page_query(filters: Dict[str, Optional[str]], sort: Optional[str],
+                cursor: Optional[str]) -> Tuple[str, list]:
+    """SELECT for one page of ``/checks``, taking LIMIT and OFFSET as its last two parameters"""
+    filters = {dim: value for dim, value in filters.items() if value is not None}
+    column = sort.lstrip("-") if sort else None
+    if column not in (None,) + _SORTS or not set(filters) <= set(_FILTERS):
+        raise ValueError("Unsupported filter or sort")
+    where = [f"{dim} = ?" for dim in filters]
+    params: list = list(filters.values())
+    descending = bool(sort) and sort.startswith("-")
+
+    state = decode_cursor(cursor, sort) if cursor else None
+    if state is not None:
+        if column is None:
+            where.append("rowid > ?")
+            params.append(state["p"])
+        else:
+            where.append(f"({column}, rowid) {'<' if descending else '>'} (?, ?)")
+            params += [state["k"], state["p"]]
+
+    direction = "DESC" if descending else "ASC"
+    order = f"{column} {direction}, rowid {direction}" if column else "rowid"
+    sql = (_SELECT + (" WHERE " + " AND ".join(where) if where else "")
+           + f" ORDER BY {order} LIMIT ? OFFSET ?")
+    return sql, params
+
+
+class SqliteStore:
+    """DataStore backed by an embedded SQLite database in WAL mode.
+
+    Rows stay on disk: dashboard and statistics aggregates are GROUP BY
+    queries, and ``/checks``, ``/frameworks`` and ``/providers`` are indexed
+    WHERE/ORDER BY queries. Any number of processes can share the file; a
+    version counter in ``meta`` tells them when the data changed.
+    """
+
+    def __init__(self, path: str = "compliance_data.sqlite3"):
+        self.path = path
+        self._local = threading.local()
+        # Every thread-local connection, for memory estimates
+        self._connections: List[sqlite3.Connection] = []
+        self._write_lock = threading.RLock()
+        # Past versions for /history and /diff
+        self.history: Optional[History] = None
+        if settings.history_versions > 0:
+            self.history = History(f"{path}.history", settings.history_versions)
+        # The database is opened by ``ensure_loaded()``: at warm-up, or on first use
+        self.loaded = False
+        self._snapshot: Optional[SqliteSnapshot] = None
+
+    def ensure_loaded(self):
+        """Create the schema and take the first snapshot, once"""
+        if self.loaded:
+            return
+        with self._write_lock:
+            if self.loaded:
+                return
+            conn = self._connection()
+            indexed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'checks_fts'").fetchone()
+            conn.executescript(SCHEMA)
+            if not indexed:
+                # A database from before full-text search: index its rows once
+                conn.execute("INSERT INTO checks_fts (checks_fts) VALUES ('rebuild')")
+            self._snapshot = SqliteSnapshot(self, self._version())
+            print(f"Using SQLite store {self.path} ({len(self._snapshot)} records)")
+            self.loaded = True
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=60)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            self._connections.append(conn)
+        return conn
+
+    def query(self, sql: str, params: Sequence = ()) -> list:
+        return self._connection().execute(sql, params).fetchall()
+
+    def stream(self, sql: str, params: Sequence = ()) -> Iterator[List[Dict]]:
+        """Run ``sql`` now and yield its rows as records a batch at a time.
+
+        Uses a connection of its own: a streaming response resumes the
+        iterator on whichever threadpool thread is free.
+        """
+        conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        try:
+            cursor = conn.execute(sql, params)
+        except BaseException:
+            conn.close()
+            raise
+        return self._fetch_batches(conn, cursor)
+
+    @staticmethod
+    def _fetch_batches(conn: sqlite3.Connection, cursor: sqlite3.Cursor) -> Iterator[List[Dict]]:
+        try:
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH_ROWS)
+                if not rows:
+                    return
+                yield [_record(row) for row in rows]
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """One write transaction; other processes' writers wait on the database lock"""
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _version(self) -> int:
+        return self.query("SELECT value FROM meta WHERE key = 'version'")[0][0]
+
+    def _commit(self, conn: sqlite3.Connection, current, records: Optional[CheckTable] = None,
+                delete_ids: Sequence[str] = ()):
+        """Bump the version and record it in the history, inside the write transaction"""
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        if self.history is None:
+            return
+        version, = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        try:
+            self.history.record(version, current, records, delete_ids)
+        except Exception as e:
+            print(f"Error recording version {version} in {self.history.directory}: {e}")
+
+    def snapshot(self) -> SqliteSnapshot:
+        self.ensure_loaded()
+        version = self._version()
+        if version != self._snapshot.version:
+            self._snapshot = SqliteSnapshot(self, version)
+        return self._snapshot
+
+    def set_data(self, records: Union[CheckTable, List[ComplianceCheck]]):
+        """Replace every row"""
+        if not isinstance(records, CheckTable):
+            records = CheckTable.from_checks(records)
+        self.ensure_loaded()
+        with stage("store_write"), self._write() as conn:
+            conn.execute("DELETE FROM checks")
+            conn.execute("INSERT INTO checks_fts (checks_fts) VALUES ('delete-all')")
+            conn.executemany(_INSERT, _rows(records))
+            conn.execute("INSERT INTO checks_fts (checks_fts) VALUES ('rebuild')")
+            self._commit(conn, lambda: records)
+            conn.execute("ANALYZE")
+        print(f"Saved {len(records)} records to {self.path}")
+
+    def replace_data(self, chunks: Iterable[CheckTable]) -> int:
+        """Replace every row with the rows of ``chunks``, inserting each as it arrives;
+        one transaction, so readers see the previous rows until it commits"""
+        self.ensure_loaded()
+        rows = 0
+        with self._write() as conn:
+            conn.execute("DELETE FROM checks")
+            conn.execute("INSERT INTO checks_fts (checks_fts) VALUES ('delete-all')")
+            for chunk in chunks:
+                with stage("store_write"):
+                    conn.executemany(_INSERT, _rows(chunk))
+                rows += len(chunk)
+            with stage("store_write"):
+                conn.execute("INSERT INTO checks_fts (checks_fts) VALUES ('rebuild')")
+                self._commit(conn, lambda: _tables(conn))
+                conn.execute("ANALYZE")
+        print(f"Saved {rows} records to {self.path}")
+        return rows
+
+    def append_data(self, records: CheckTable):
+        self.upsert_data(records)
+
+    def upsert_data(self, records: CheckTable, delete_ids: Sequence[str] = ()) -> Dict[str, int]:
+        """Insert or update rows by id and delete ``delete_ids``, in one transaction"""
+        changed = " OR ".join(f"checks.{col} IS NOT excluded.{col}" for col in _VALUES)
+        self.ensure_loaded()
+        with stage("store_write"), self._write() as conn:
+            for statement in _INCOMING:
+                conn.execute(statement)
+            # Later rows replace earlier ones with the same id: the last occurrence wins
+            conn.executemany(_INSERT.replace("INSERT INTO checks", "INSERT OR REPLACE INTO temp.incoming"),
+                             _rows(records))
+            conn.executemany("INSERT OR IGNORE INTO temp.deleting VALUES (?)", ((i,) for i in delete_ids))
+            incoming, = conn.execute("SELECT COUNT(*) FROM temp.incoming").fetchone()
+            inserted, = conn.execute(
+                "SELECT COUNT(*) FROM temp.incoming i WHERE NOT EXISTS (SELECT 1 FROM checks c WHERE c.id = i.id)"
+            ).fetchone()
+            for statement in _UNINDEX:
+                conn.execute(statement)
+            before = conn.total_changes
+            conn.execute(
+                f"INSERT INTO checks SELECT {', '.join(COLUMNS)} FROM temp.incoming WHERE true "
+                f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in _VALUES)} "
+                f"WHERE {changed}"
+            )
+            written = conn.total_changes - before
+            conn.execute(
+                "DELETE FROM checks WHERE id IN (SELECT id FROM temp.deleting) "
+                "AND id NOT IN (SELECT id FROM temp.incoming)"
+            )
+            deleted = conn.total_changes - before - written
+            conn.execute(_REINDEX)
+            updated = written - inserted
+            if inserted or updated or deleted:
+                self._commit(conn, lambda: _tables(conn),
+                             records, delete_ids)
+        return {
+            "inserted": inserted,
+            "updated": updated,
+            "unchanged": incoming - inserted - updated,
+            "deleted": deleted,
+        }
+
+    def delete_ids(self, ids: Sequence[str]) -> int:
+        """Delete checks by id; returns how many existed"""
+        return self.upsert_data(CheckTable.empty(), ids)["deleted"]
+
+    def get_data(self) -> CheckTable:
+        return self.snapshot().table
+
+    def get_aggregates(self) -> Aggregates:
+        return self.snapshot().aggregates
+
+    def clear_data(self):
+        self.set_data(CheckTable.empty())
+
+    def is_empty(self) -> bool:
+        return len(self.snapshot()) == 0
+
+    def index_text(self):
+        """Nothing to do: writes update the FTS5 index in their transaction"""
+
+    def memory_bytes(self) -> int:
+        """Rows stay in the database file; this is the page cache each connection may fill"""
+        return len(self._connections) * CACHE_BYTES
+
+    def disk_bytes(self) -> int:
+        """Size of the database, its WAL and the history on disk"""
+        total = sum(os.path.getsize(path) for path in (self.path, f"{self.path}-wal", f"{self.path}-shm")
+                    if os.path.exists(path))
+        if self.history is not None:
+            total += directory_bytes(self.history.directory)
+        return total
+
+
+def _rows(table: CheckTable) -> Iterator[tuple]:
+    """Parameter tuples for ``_INSERT``, built a batch of rows at a time"""
+    for start in range(0, len(table), WRITE_BATCH_ROWS):
+        batch = table.take(slice(start, start + WRITE_BATCH_ROWS))
+        frameworks = np.asarray(batch.frameworks, dtype=object)
+        providers = np.asarray(batch.providers, dtype=object)
+        yield from zip(
+            batch.ids.tolist(),
+            frameworks[batch.framework].tolist() if len(frameworks) else [],
+            providers[batch.provider].tolist() if len(providers) else [],
+            [SEVERITIES[s].value for s in batch.severity.tolist()],
+            [STATUSES[s].value for s in batch.status.tolist()],
+            batch.risk_score.tolist(),
+            batch.description.tolist(),
+            batch.last_checked.view(np.int64).tolist(),
+            batch.ai_summary.tolist(),
+        )
+
+
+def _record(row: tuple) -> Dict:
+    """Plain dict row, as ``CheckTable.records`` builds them"""
+    record = dict(zip(COLUMNS, row))
+    record["last_checked"] = _EPOCH + timedelta(microseconds=row[7])
+    return record
+
+
+def _check(row: tuple) -> ComplianceCheck:
+    record = _record(row)
+    record["severity"] = SeverityLevel(record["severity"])
+    record["status"] = StatusLevel(record["status"])
+    return ComplianceCheck.model_construct(**record)
+
+
+def _tables(conn: sqlite3.Connection) -> Iterator[CheckTable]:
+    """Every row, a table of ``WRITE_BATCH_ROWS`` at a time"""
+    cursor = conn.execute(_SELECT + " ORDER BY rowid")
+    while True:
+        rows = cursor.fetchmany(WRITE_BATCH_ROWS)
+        if not rows:
+            return
+        yield _table(rows)
+
+
+def _table(rows: list) -> CheckTable:
+    if not rows:
+        return CheckTable.empty()
+    df = pd.DataFrame([row[:len(COLUMNS)] for row in rows], columns=COLUMNS)
+    df["last_checked"] = pd.to_datetime(df["last_checked"], unit="us")
+    return CheckTable.from_frame(df)
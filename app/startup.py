@@ -0,0 +1,74 @@
+"""Background warm-up and startup timing.
+
+Uvicorn answers ``/`` (liveness) as soon as the app is imported; the
+dataset and the model register loads here, which ``warm_up()`` runs on a
+background thread once the server starts. ``/ready`` reports 503 until
+they are done. A request that arrives earlier loads what it needs itself
+(or waits for the warm-up to finish it) rather than seeing partial data.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from app.metrics import Gauge
+
+STARTUP_SECONDS = Gauge("compliance_startup_seconds",
+                        "Seconds from process start to each startup phase's end", ("phase",))
+
+_steps: List[Tuple[str, Callable[[], None]]] = []
+_seconds: Dict[str, float] = {}
+_ready = threading.Event()
+
+
+def _process_age() -> float:
+    """Seconds since this process started, from /proc (0 where that is unavailable)"""
+    try:
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesized command name; starttime is the 22nd field overall
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+_started = time.perf_counter() - _process_age()
+
+
+def register(name: str, load: Callable[[], None]):
+    """Run ``load`` during the warm-up; it must be safe to call again later"""
+    _steps.append((name, load))
+
+
+def warm_up():
+    """Start loading everything registered; returns at once"""
+    _record("imports")
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+
+def _warm_up():
+    for name, load in _steps:
+        try:
+            load()
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+        _record(name)
+    _record("ready")
+    _ready.set()
+    phases = ", ".join(f"{name} at {seconds:.2f}s" for name, seconds in _seconds.items() if name != "ready")
+    print(f"Ready {_seconds['ready']:.2f}s after start ({phases})")
+
+
+def _record(phase: str):
+    _seconds[phase] = round(time.perf_counter() - _started, 3)
+    STARTUP_SECONDS.set(_seconds[phase], phase=phase)
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def status() -> Dict:
+    return {"status": "ready" if is_ready() else "starting", "startup_seconds": dict(_seconds)}
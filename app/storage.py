@@ -0,0 +1,473 @@
+import fcntl
+import json
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.aggregates import AGGREGATES_VERSION, Aggregates
+from app.columnar import COLUMNS, CheckTable, column_bytes, to_naive_utc
+from app.metrics import pid_alive
+
+# Columns stored as plain .npy arrays; the rest are StringColumns
+NUMERIC_COLUMNS = ("framework", "provider", "severity", "status", "risk_score", "last_checked")
+STRING_COLUMNS = tuple(c for c in COLUMNS if c not in NUMERIC_COLUMNS)
+
+WRITE_BATCH_ROWS = 10_000
+
+# CHANGES holds two little-endian uint64s: a random id of this data
+# directory and a counter bumped after every committed change
+_CHANGES = struct.Struct("<QQ")
+# Names (and name prefixes) of the files a ColumnarStorage writes into its directory
+_OWNED = ("CURRENT", "CHANGES", "LOCK", "segment-", "wal-", "staging-")
+# On-disk dtype of each numeric column (arrays unpickled from worker processes may
+# carry dtype metadata .npy cannot store)
+_DTYPES = {col: np.dtype(getattr(CheckTable.empty(), col).dtype.str) for col in NUMERIC_COLUMNS}
+
+
+class StringColumn:
+    """Variable-length strings as one UTF-8 buffer plus an offsets array.
+
+    Both arrays can be memory-mapped, so opening a column is O(1). Indexing
+    with a slice/array/mask decodes only the selected rows; operations that
+    need every value (``np.asarray``, ``tolist``) decode once and cache.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, nulls: Optional[np.ndarray] = None):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+        self._decoded: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        decoded = column_bytes(self._decoded) if self._decoded is not None else 0
+        nulls = self.nulls.nbytes if self.nulls is not None else 0
+        return self.data.nbytes + self.offsets.nbytes + nulls + decoded
+
+    def _decode(self, positions: np.ndarray) -> np.ndarray:
+        starts, ends = self.offsets[positions], self.offsets[positions + 1]
+        out = np.empty(len(positions), dtype=object)
+        if not len(positions):
+            return out
+        if int(ends.max()) - int(starts.min()) > 8 * int((ends - starts).sum()):
+            # A few rows scattered over the buffer: decode each one where it is
+            data = self.data
+            out[:] = [data[s:e].tobytes().decode("utf-8") for s, e in zip(starts.tolist(), ends.tolist())]
+        else:
+            # Copy the covered byte range once; slicing a str is much cheaper than
+            # decoding each value, and byte offsets equal str offsets for ASCII
+            base = int(starts.min())
+            buf = self.data[base:int(ends.max())].tobytes()
+            starts, ends = (starts - base).tolist(), (ends - base).tolist()
+            if buf.isascii():
+                text = buf.decode("ascii")
+                out[:] = [text[s:e] for s, e in zip(starts, ends)]
+            else:
+                out[:] = [buf[s:e].decode("utf-8") for s, e in zip(starts, ends)]
+        if self.nulls is not None:
+            out[self.nulls[positions]] = None
+        return out
+
+    def __getitem__(self, idx):
+        if self._decoded is not None:
+            return self._decoded[idx]
+        if isinstance(idx, (int, np.integer)):
+            return self._decode(np.array([idx], dtype=np.int64))[0]
+        return self._decode(np.arange(len(self), dtype=np.int64)[idx])
+
+    def __array__(self, dtype=None):
+        if self._decoded is None:
+            self._decoded = self._decode(np.arange(len(self), dtype=np.int64))
+        return self._decoded
+
+    def tolist(self) -> list:
+        return np.asarray(self).tolist()
+
+
+class ColumnarStorage:
+    """Crash-safe columnar files plus a write-ahead log, shareable by processes.
+
+    Layout under ``directory``::
+
+        CURRENT            name of the live segment (swapped by atomic rename)
+        segment-<gen>/     one .npy file per numeric column, .bin/.offsets.npy per
+                           string column, meta.json and the pickled aggregates
+        wal-<gen>.log      JSON lines of upserts made since segment <gen>
+        CHANGES            change counter, memory-mapped by every process
+        LOCK               flock()ed: shared while reading, exclusive while writing
+
+    Loading memory-maps the segment and replays only its WAL. A process that
+    sees the change counter move catches up by replaying the WAL from the
+    byte offset it last read, or reloads if the segment was swapped.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.generation = 0
+        self.wal_rows = 0
+        # Bytes of the WAL applied so far; everything after it is unread or torn
+        self.wal_offset = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(self._path("LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+        # Stores are dropped rather than closed (e.g. evicted tenants): close the fd with this object
+        weakref.finalize(self, os.close, self._lock_fd)
+        self._changes = self._map_changes()
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.directory, *parts)
+
+    @property
+    def wal_file(self) -> str:
+        return self._path(f"wal-{self.generation:06d}.log")
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path("CURRENT"))
+
+    def _map_changes(self) -> mmap.mmap:
+        with self.lock():
+            fd = os.open(self._path("CHANGES"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < _CHANGES.size:
+                    os.write(fd, _CHANGES.pack(int.from_bytes(os.urandom(8), "little"), 0))
+                    os.fsync(fd)
+                return mmap.mmap(fd, _CHANGES.size)
+            finally:
+                os.close(fd)
+
+    @property
+    def store_id(self) -> str:
+        return f"{_CHANGES.unpack_from(self._changes)[0]:016x}"
+
+    def changes(self) -> int:
+        """How many changes have been committed by any process (no syscall)"""
+        return _CHANGES.unpack_from(self._changes)[1]
+
+    def bump_changes(self) -> int:
+        """Record one committed change; call while holding the exclusive lock"""
+        store_id, changes = _CHANGES.unpack_from(self._changes)
+        _CHANGES.pack_into(self._changes, 0, store_id, changes + 1)
+        return changes + 1
+
+    @contextmanager
+    def lock(self, shared: bool = False, blocking: bool = True):
+        """Inter-process lock; also hold an in-process lock, flock() does not exclude threads.
+
+        Yields whether the lock was taken (always True when ``blocking``).
+        """
+        try:
+            fcntl.flock(self._lock_fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                        | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def disk_bytes(self) -> int:
+        """Size of the files this storage owns; others may share the directory (metrics, job spools)"""
+        total = 0
+        for entry in os.scandir(self.directory):
+            # Temporaries (.segment-<gen>.tmp, CURRENT.tmp) count with what they become
+            if not entry.name.lstrip(".").startswith(_OWNED):
+                continue
+            try:
+                total += directory_bytes(entry.path) if entry.is_dir() else entry.stat().st_size
+            except FileNotFoundError:
+                continue
+        return total
+
+    def live_generation(self) -> Optional[int]:
+        """Generation named by CURRENT on disk (may differ from the loaded one)"""
+        try:
+            with open(self._path("CURRENT")) as f:
+                return int(f.read().strip().rsplit("-", 1)[1])
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> Tuple[CheckTable, Optional[Aggregates]]:
+        """Memory-map the live segment; aggregates are None if they must be rebuilt"""
+        with open(self._path("CURRENT")) as f:
+            segment = f.read().strip()
+        self.generation = int(segment.rsplit("-", 1)[1])
+        path = self._path(segment)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        columns = {
+            col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r")
+            for col in NUMERIC_COLUMNS
+        }
+        for col in STRING_COLUMNS:
+            offsets = np.load(os.path.join(path, f"{col}.offsets.npy"), mmap_mode="r")
+            data_file = os.path.join(path, f"{col}.bin")
+            data = (np.memmap(data_file, dtype=np.uint8, mode="r")
+                    if os.path.getsize(data_file) else np.empty(0, dtype=np.uint8))
+            nulls_file = os.path.join(path, f"{col}.nulls.npy")
+            nulls = np.load(nulls_file, mmap_mode="r") if os.path.exists(nulls_file) else None
+            columns[col] = StringColumn(data, offsets, nulls)
+        table = CheckTable(**columns, frameworks=meta["frameworks"], providers=meta["providers"])
+
+        aggregates = None
+        if meta.get("aggregates_version") == AGGREGATES_VERSION:
+            try:
+                with open(os.path.join(path, "aggregates.pkl"), "rb") as f:
+                    aggregates = pickle.load(f)
+            except Exception as e:
+                print(f"Error loading aggregates from {path}: {e}")
+        return table, aggregates
+
+    def read_wal(self, offset: int = 0) -> Iterator[Tuple[CheckTable, List[str]]]:
+        """Yield the (upserted rows, deleted ids) entries logged since the live
+        segment, starting at byte ``offset``"""
+        if not offset:
+            self.wal_rows = 0
+        self.wal_offset = offset
+        if not os.path.exists(self.wal_file):
+            return
+        with open(self.wal_file, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated line")
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append; everything before it is
+                    # intact, and the next append overwrites it
+                    print(f"Ignoring incomplete entry at the end of {self.wal_file}")
+                    break
+                self.wal_offset += len(line)
+                self.wal_rows += len(entry["upsert"]) + len(entry["delete"])
+                yield table_from_json(entry["upsert"]), entry["delete"]
+
+    def append_wal(self, records: CheckTable, delete_ids: Sequence[str]):
+        line = (json.dumps({"upsert": json_records(records), "delete": list(delete_ids)}) + "\n").encode()
+        with open(self.wal_file, "ab") as f:
+            if f.tell() > self.wal_offset:
+                f.truncate(self.wal_offset)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.wal_offset += len(line)
+        self.wal_rows += len(records) + len(delete_ids)
+
+    def write_snapshot(self, table: CheckTable, aggregates: Aggregates):
+        """Write ``table`` as a new segment, publish it and drop the old segment and WAL"""
+        writer = self.segment_writer()
+        try:
+            writer.append(table)
+            self.publish(writer, aggregates)
+        except BaseException:
+            writer.abort()
+            raise
+
+    def segment_writer(self) -> "SegmentWriter":
+        """A writer staging a new segment; ``publish`` it under the exclusive lock"""
+        for entry in os.scandir(self.directory):
+            # Staging directories of processes that died mid-upload
+            name = entry.name.split("-")
+            if name[0] == ".staging" and len(name) == 3 and name[1].isdigit() and not pid_alive(int(name[1])):
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return SegmentWriter(self._path(f".staging-{os.getpid()}-{os.urandom(4).hex()}"))
+
+    def publish(self, writer: "SegmentWriter", aggregates: Aggregates):
+        """Finish ``writer``'s segment, make it live and drop the old segment and WAL;
+        hold the exclusive lock"""
+        staged = writer.finish(aggregates)
+        # Number past what CURRENT names, even if this process has not loaded it yet
+        live = self.live_generation()
+        generation = max(self.generation, live or 0) + 1
+        segment = f"segment-{generation:06d}"
+        # A leftover from a crash before CURRENT was swapped is not referenced by anything
+        shutil.rmtree(self._path(segment), ignore_errors=True)
+        os.rename(staged, self._path(segment))
+        _atomic_write(self._path("CURRENT"), segment)
+        _fsync_dir(self.directory)
+
+        self.generation = generation
+        self.wal_rows = 0
+        self.wal_offset = 0
+        if live is not None:
+            # The segment CURRENT named before the swap; never the one it names now. The new
+            # segment is already live, so a leftover file is not worth failing the write over
+            old_wal = self._path(f"wal-{live:06d}.log")
+            try:
+                if os.path.exists(old_wal):
+                    os.remove(old_wal)
+            except OSError as e:
+                print(f"Error removing {old_wal}: {e}")
+            shutil.rmtree(self._path(f"segment-{live:06d}"), ignore_errors=True)
+
+
+class SegmentWriter:
+    """Writes the columns of a segment one table at a time into a staging directory.
+
+    Only the table being appended is held in memory, so a segment of any
+    size is written with memory bounded by the caller's chunk size. Numeric
+    columns and string offsets are appended raw and become ``.npy`` files in
+    ``finish``, when the framework/provider codes are also remapped to the
+    sorted labels of the whole segment.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        os.makedirs(path)
+        # Label -> code, in the order labels were first seen
+        self._labels: Dict[str, Dict[str, int]] = {"framework": {}, "provider": {}}
+        self._files = {}
+        for col in NUMERIC_COLUMNS:
+            self._files[col] = open(os.path.join(path, f"{col}.raw"), "wb")
+        for col in STRING_COLUMNS:
+            self._files[col] = open(os.path.join(path, f"{col}.bin"), "wb")
+            self._files[f"{col}.offsets"] = open(os.path.join(path, f"{col}.offsets.raw"), "wb")
+            self._files[f"{col}.nulls"] = open(os.path.join(path, f"{col}.nulls.raw"), "wb")
+        self._positions = dict.fromkeys(STRING_COLUMNS, 0)
+        self._has_nulls = dict.fromkeys(STRING_COLUMNS, False)
+
+    def append(self, table: CheckTable):
+        """Add the rows of ``table`` after those already written"""
+        for col in NUMERIC_COLUMNS:
+            array = np.asarray(getattr(table, col)).astype(_DTYPES[col], copy=False)
+            if col in self._labels and len(array):
+                seen = self._labels[col]
+                labels = table.frameworks if col == "framework" else table.providers
+                array = np.array([seen.setdefault(label, len(seen)) for label in labels], dtype=np.int32)[array]
+            self._files[col].write(array.tobytes())
+        for col in STRING_COLUMNS:
+            column = getattr(table, col)
+            for start in range(0, len(column), WRITE_BATCH_ROWS):
+                values = column[start:start + WRITE_BATCH_ROWS].tolist()
+                encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+                nulls = np.array([v is None for v in values], dtype=bool)
+                lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+                ends = self._positions[col] + np.cumsum(lengths)
+                self._positions[col] += int(lengths.sum())
+                self._has_nulls[col] |= bool(nulls.any())
+                self._files[col].write(b"".join(encoded))
+                self._files[f"{col}.offsets"].write(ends.tobytes())
+                self._files[f"{col}.nulls"].write(nulls.tobytes())
+        self.rows += len(table)
+
+    def finish(self, aggregates: Aggregates) -> str:
+        """Write the ``.npy`` files, aggregates and meta.json; returns the staged directory"""
+        for f in self._files.values():
+            f.close()
+        labels = {col: sorted(seen) for col, seen in self._labels.items()}
+        for col in NUMERIC_COLUMNS:
+            remap = None
+            if col in self._labels:
+                remap = np.empty(len(labels[col]), dtype=np.int32)
+                remap[[self._labels[col][label] for label in labels[col]]] = np.arange(len(labels[col]))
+            self._to_npy(f"{col}.raw", f"{col}.npy", _DTYPES[col], self.rows, remap=remap)
+        for col in STRING_COLUMNS:
+            self._to_npy(f"{col}.offsets.raw", f"{col}.offsets.npy", np.dtype(np.int64), self.rows + 1, first=0)
+            if self._has_nulls[col]:
+                self._to_npy(f"{col}.nulls.raw", f"{col}.nulls.npy", np.dtype(bool), self.rows)
+            else:
+                os.remove(os.path.join(self.path, f"{col}.nulls.raw"))
+        with open(os.path.join(self.path, "aggregates.pkl"), "wb") as f:
+            pickle.dump(aggregates, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({
+                "rows": self.rows,
+                "frameworks": labels["framework"],
+                "providers": labels["provider"],
+                "aggregates_version": AGGREGATES_VERSION,
+            }, f)
+        for name in os.listdir(self.path):
+            _fsync_file(os.path.join(self.path, name))
+        return self.path
+
+    def _to_npy(self, raw: str, npy: str, dtype: np.dtype, rows: int,
+                remap: Optional[np.ndarray] = None, first=None):
+        """Copy a raw column into an ``.npy`` file a batch at a time"""
+        with open(os.path.join(self.path, raw), "rb") as src, open(os.path.join(self.path, npy), "wb") as dst:
+            np.lib.format.write_array_header_1_0(dst, {
+                "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (rows,),
+            })
+            if first is not None:
+                dst.write(np.array([first], dtype=dtype).tobytes())
+            while True:
+                batch = np.fromfile(src, dtype=dtype, count=WRITE_BATCH_ROWS)
+                if not len(batch):
+                    break
+                dst.write((remap[batch] if remap is not None else batch).tobytes())
+        os.remove(os.path.join(self.path, raw))
+
+    def abort(self):
+        """Drop everything written so far"""
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def directory_bytes(path: str) -> int:
+    """Total size of the files under ``path``, 0 if it does not exist"""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_bytes(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def _atomic_write(path: str, content: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def table_from_json(data: list) -> CheckTable:
+    """Build a table from JSON records; they were validated before they were written"""
+    if not data:
+        return CheckTable.empty()
+    df = pd.DataFrame(data)
+    df["last_checked"] = to_naive_utc(df["last_checked"], format="ISO8601")
+    return CheckTable.from_frame(df)
+
+
+def json_records(table: CheckTable, idx=None) -> List[dict]:
+    """Rows as JSON-serializable dicts (ISO timestamps)"""
+    data = table.records(idx)
+    last_checked = table.last_checked if idx is None else table.last_checked[idx]
+    for item, ts in zip(data, np.datetime_as_string(last_checked, unit="us")):
+        item["last_checked"] = ts
+    return data
@@ -0,0 +1,180 @@
+"""Tenant-scoped data stores.
+
+Each request names its tenant with the ``X-Tenant-ID`` header (see
+``settings.tenant_header``) or a ``/tenants/<id>`` path prefix, e.g.
+``/tenants/acme/api/v1/dashboard``; requests naming neither use the default
+tenant, whose data lives where a single-tenant deployment keeps it.
+
+Stores load lazily on first use. Once the resident ones estimate more
+memory than ``settings.tenant_memory_mb``, the least recently used are
+dropped; their data stays on disk and is reloaded when next needed. A
+request keeps the store it resolved first, so an eviction never changes
+the data under it.
+"""
+import re
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from app.metrics import Counter
+from app.models import TenantStats, TenantsSummary
+
+DEFAULT_TENANT = "default"
+# Tenant ids double as directory names
+TENANT_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+_PATH_PREFIX = re.compile(r"/tenants/([^/]+)(/.*)")
+
+_tenant: ContextVar[str] = ContextVar("tenant", default=DEFAULT_TENANT)
+# The store the current request resolved, so every access in it sees the same one
+_resolved: ContextVar[Optional[Any]] = ContextVar("tenant_store", default=None)
+
+LOOKUPS = Counter("compliance_tenant_lookups_total", "Requests resolving a tenant's store, by whether it was resident",
+                  ("tenant", "result"))
+EVICTIONS = Counter("compliance_tenant_evictions_total", "Stores dropped from memory to stay within the budget",
+                    ("tenant",))
+
+
+def current_tenant() -> str:
+    return _tenant.get()
+
+
+class _Usage:
+    __slots__ = ("hits", "misses", "evictions", "last_used")
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_used: Optional[datetime] = None
+
+
+class TenantStores:
+    """The stores of every tenant, resident ones in least recently used order.
+
+    Attribute access is forwarded to the current tenant's store, so
+    ``data_store.snapshot()`` reads whichever tenant the request names.
+    """
+
+    def __init__(self, create: Callable[[str], Any], memory_budget: int):
+        # Builds the (not yet loaded) store of a tenant
+        self._create = create
+        self.memory_budget = memory_budget
+        self._stores: "OrderedDict[str, Any]" = OrderedDict()
+        self._usage: Dict[str, _Usage] = {}
+        self._lock = Lock()
+
+    def get(self, tenant: str, record: bool = True) -> Any:
+        """The tenant's store, loaded; ``record=False`` keeps it out of the hit rate"""
+        with self._lock:
+            store = self._stores.get(tenant)
+            hit = store is not None
+            if hit:
+                self._stores.move_to_end(tenant)
+            else:
+                store = self._stores[tenant] = self._create(tenant)
+            if record:
+                usage = self._usage.setdefault(tenant, _Usage())
+                usage.last_used = datetime.utcnow()
+                if hit:
+                    usage.hits += 1
+                else:
+                    usage.misses += 1
+                LOOKUPS.inc(tenant=tenant, result="hit" if hit else "miss")
+        if not hit:
+            store.ensure_loaded()
+            self.trim()
+        return store
+
+    def current(self) -> Any:
+        """The store of the request's tenant"""
+        store = _resolved.get()
+        if store is None:
+            store = self.get(current_tenant())
+            _resolved.set(store)
+        return store
+
+    def __getattr__(self, name: str):
+        return getattr(self.current(), name)
+
+    def resident(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stores)
+
+    def trim(self):
+        """Drop least recently used stores until the rest fit the memory budget"""
+        with self._lock:
+            sizes = {tenant: store.memory_bytes() for tenant, store in self._stores.items()}
+            total = sum(sizes.values())
+            # The most recently used store always stays
+            for tenant in list(self._stores)[:-1]:
+                if total <= self.memory_budget:
+                    break
+                del self._stores[tenant]
+                total -= sizes[tenant]
+                self._usage.setdefault(tenant, _Usage()).evictions += 1
+                EVICTIONS.inc(tenant=tenant)
+                print(f"Evicted tenant {tenant} ({sizes[tenant] / 2**20:.1f} MiB) from memory")
+
+    def describe(self) -> TenantsSummary:
+        """Memory and hit rate of every tenant this process has served"""
+        with self._lock:
+            stores = dict(self._stores)
+            usage = {tenant: (u.hits, u.misses, u.evictions, u.last_used) for tenant, u in self._usage.items()}
+        tenants = []
+        for tenant in sorted(set(usage) | set(stores)):
+            hits, misses, evictions, last_used = usage.get(tenant, (0, 0, 0, None))
+            store = stores.get(tenant)
+            tenants.append(TenantStats(
+                tenant=tenant,
+                resident=store is not None,
+                rows=len(store.snapshot()) if store is not None else None,
+                memory_bytes=store.memory_bytes() if store is not None else 0,
+                hits=hits,
+                misses=misses,
+                hit_rate=round(hits / (hits + misses), 4) if hits + misses else None,
+                evictions=evictions,
+                last_used=last_used,
+            ))
+        return TenantsSummary(
+            memory_budget_bytes=self.memory_budget,
+            resident_bytes=sum(t.memory_bytes for t in tenants),
+            tenants=tenants,
+        )
+
+
+class TenantMiddleware:
+    """Sets the request's tenant from a ``/tenants/<id>`` prefix (which is
+    stripped before routing) or else the tenant header"""
+
+    def __init__(self, app, header: str):
+        self.app = app
+        self.header = header.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tenant = None
+        match = _PATH_PREFIX.fullmatch(scope["path"])
+        if match:
+            tenant = match.group(1)
+            scope = dict(scope, path=match.group(2), raw_path=match.group(2).encode())
+        else:
+            for name, value in scope["headers"]:
+                if name == self.header:
+                    tenant = value.decode("latin-1")
+                    break
+        if tenant is not None and not TENANT_ID.fullmatch(tenant):
+            await JSONResponse({"detail": f"Invalid tenant id {tenant!r}"}, status_code=400)(scope, receive, send)
+            return
+        tenant_token = _tenant.set(tenant or DEFAULT_TENANT)
+        store_token = _resolved.set(None)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _resolved.reset(store_token)
+            _tenant.reset(tenant_token)
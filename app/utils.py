@@ -1,26 +1,187 @@
-import pandas as pd
+import io
+import time
 import uuid
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
 from fastapi import HTTPException
-from app.models import ComplianceCheck
+
+from app.columnar import CheckTable, SEVERITIES, STATUSES, to_naive_utc
 
 REQUIRED_COLUMNS = {
     "framework", "provider", "severity", "status",
     "risk_score", "description", "last_checked"
 }
 
-def parse_and_validate_csv(content: bytes) -> list[ComplianceCheck]:
+# How many offending rows are listed in a validation error
+MAX_REPORTED_ERRORS = 10
+
+# Optional upsert column: truthy rows delete the check with that id
+DELETE_COLUMN = "deleted"
+_TRUTHY = {"1", "true", "yes", "y"}
+
+class InvalidRowsError(HTTPException):
+    """400 listing offending rows as (0-based row in the chunk, invalid columns).
+
+    Chunks may be validated in another process before the rows ahead of them
+    are counted, so the chunk's ``first_row`` can be supplied afterwards.
+    """
+
+    def __init__(self, total: int, errors: List[Tuple[int, List[str]]], first_row: int = 0):
+        self.total = total
+        self.errors = errors
+        self.first_row = first_row
+        super().__init__(400, detail=f"{total} invalid rows ({'; '.join(self.messages())})")
+
+    def __reduce__(self):
+        return InvalidRowsError, (self.total, self.errors, self.first_row)
+
+    def messages(self) -> List[str]:
+        return [f"row {self.first_row + row + 1}: invalid " + ", ".join(cols) for row, cols in self.errors]
+
+    def shifted(self, first_row: int) -> "InvalidRowsError":
+        return InvalidRowsError(self.total, self.errors, self.first_row + first_row)
+
+class ParsedChunk(NamedTuple):
+    records: CheckTable
+    delete_ids: List[str]
+    rows: int
+    # Invalid rows left out of ``records`` when parsing with ``skip_invalid``
+    rejected: Optional[InvalidRowsError] = None
+    # Seconds spent reading the CSV, and checking and typing its values
+    parse_seconds: float = 0.0
+    validate_seconds: float = 0.0
+
+def parse_and_validate_csv(content: bytes) -> CheckTable:
+    header, _, body = content.partition(b"\n")
+    check_header(header)
+    return parse_csv_block(header + b"\n", body).records
+
+def check_header(header: bytes):
+    try:
+        columns = pd.read_csv(io.BytesIO(header), nrows=0).columns
+    except Exception as e:
+        raise HTTPException(400, f"Invalid CSV format: {e}")
+
+    missing = REQUIRED_COLUMNS - set(columns)
+    if missing:
+        raise HTTPException(400, detail=f"Missing columns: {missing}")
+
+def read_csv_blocks(file: BinaryIO, block_size: int) -> Iterator[Tuple[bytes, bytes]]:
+    """Yield ``(header, block)`` pairs where each block holds whole CSV records.
+
+    Only ``block_size`` bytes (plus one partial record) are held at a time. A
+    block is cut at the last newline outside a quoted field, so quoted values
+    may still contain newlines.
+    """
+    header = b""
+    buf = b""
+    while True:
+        data = file.read(block_size)
+        if not data:
+            break
+        buf += data
+        if not header:
+            newline = buf.find(b"\n")
+            if newline < 0:
+                continue
+            header, buf = buf[:newline + 1], buf[newline + 1:]
+            check_header(header)
+        cut = _last_record_end(buf)
+        if cut:
+            yield header, buf[:cut]
+            buf = buf[cut:]
+
+    if not header:
+        header, buf = buf, b""
+        check_header(header)
+    if buf.strip():
+        yield header, buf
+
+def _last_record_end(buf: bytes) -> int:
+    cut = buf.rfind(b"\n") + 1
+    # An odd number of quotes before the cut means it falls inside a quoted field
+    while cut and buf.count(b'"', 0, cut) % 2:
+        cut = buf.rfind(b"\n", 0, cut - 1) + 1
+    return cut
+
+def parse_csv_block(header: bytes, block: bytes, first_row: int = 0,
+                    allow_deletes: bool = False, skip_invalid: bool = False) -> ParsedChunk:
+    """Parse and validate one block of CSV records into a columnar chunk.
+
+    With ``allow_deletes``, rows flagged in the ``deleted`` column are only
+    required to carry an ``id`` and are returned as ``delete_ids``. With
+    ``skip_invalid``, invalid rows are dropped and reported as ``rejected``
+    instead of failing the block.
+    """
+    start = time.perf_counter()
     try:
-        df = pd.read_csv(pd.io.common.BytesIO(content))
+        df = pd.read_csv(io.BytesIO(header + block), dtype=str)
     except Exception as e:
         raise HTTPException(400, f"Invalid CSV format: {e}")
+    parsed = time.perf_counter()
+
+    delete_ids: List[str] = []
+    rows = len(df)
+    if allow_deletes and DELETE_COLUMN in df.columns:
+        flagged = df[DELETE_COLUMN].fillna("").str.strip().str.lower().isin(_TRUTHY)
+        if flagged.any():
+            if "id" not in df.columns or df.loc[flagged, "id"].isna().any():
+                raise HTTPException(400, detail="Rows marked as deleted must have an id")
+            delete_ids = df.loc[flagged, "id"].tolist()
+            df = df[~flagged]
+    valid, rejected = split_invalid(df, first_row)
+    if rejected is not None and not skip_invalid:
+        raise rejected
+    records = frame_to_table(valid)
+    return ParsedChunk(records, delete_ids, rows, rejected, parsed - start, time.perf_counter() - parsed)
+
+def validate_frame(df: pd.DataFrame, first_row: int = 0) -> CheckTable:
+    """Vectorized equivalent of validating every row through ComplianceCheck"""
+    valid, rejected = split_invalid(df, first_row)
+    if rejected is not None:
+        raise rejected
+    return frame_to_table(valid)
 
+def split_invalid(df: pd.DataFrame, first_row: int = 0) -> Tuple[pd.DataFrame, Optional[InvalidRowsError]]:
+    """The valid rows with typed values, and an error describing the rest.
+
+    ``first_row`` is the number of data rows before this chunk; together
+    with the frame's index it gives 1-based row numbers in errors.
+    """
     missing = REQUIRED_COLUMNS - set(df.columns)
     if missing:
         raise HTTPException(400, detail=f"Missing columns: {missing}")
 
-    df["last_checked"] = pd.to_datetime(df["last_checked"], errors="raise")
+    risk_score = pd.to_numeric(df["risk_score"], errors="coerce")
+    last_checked = to_naive_utc(df["last_checked"], format="mixed", errors="coerce")
+    invalid = {
+        "framework": df["framework"].isna().to_numpy(),
+        "provider": df["provider"].isna().to_numpy(),
+        "severity": ~df["severity"].isin([s.value for s in SEVERITIES]).to_numpy(),
+        "status": ~df["status"].isin([s.value for s in STATUSES]).to_numpy(),
+        "risk_score": ~risk_score.between(0.0, 10.0).to_numpy(),
+        "description": df["description"].isna().to_numpy(),
+        "last_checked": np.isnat(last_checked),
+    }
+    bad = np.logical_or.reduce(list(invalid.values()))
+    rejected = None
+    if bad.any():
+        errors = [
+            (int(df.index[i]), [col for col, mask in invalid.items() if mask[i]])
+            for i in np.flatnonzero(bad)[:MAX_REPORTED_ERRORS]
+        ]
+        rejected = InvalidRowsError(int(bad.sum()), errors, first_row)
+
+    df = df.assign(risk_score=risk_score, last_checked=last_checked)
+    return (df[~bad].copy() if rejected is not None else df), rejected
+
+def frame_to_table(df: pd.DataFrame) -> CheckTable:
+    """Table from rows that passed ``split_invalid``; missing ids get a uuid4"""
     if "id" not in df.columns:
         df["id"] = [str(uuid.uuid4()) for _ in range(len(df))]
-
-    records = df.to_dict(orient="records")
-    return [ComplianceCheck(**r) for r in records]
\ No newline at end of file
+    elif df["id"].isna().any():
+        missing_ids = df["id"].isna()
+        df.loc[missing_ids, "id"] = [str(uuid.uuid4()) for _ in range(int(missing_ids.sum()))]
+    return CheckTable.from_frame(df)
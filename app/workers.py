@@ -0,0 +1,46 @@
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Optional
+
+from app.config import settings
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pool() -> Optional[Executor]:
+    """Process pool for CPU-bound work, or None to run work in the calling thread.
+
+    Workers are spawned (not forked) on first use so they never inherit the
+    server's threads, sockets or memory-mapped segments; functions sent to
+    them must live in modules that import without side effects.
+    """
+    global _pool
+    if settings.worker_processes <= 0:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.worker_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+def pool_width() -> int:
+    """How many tasks are worth keeping in flight at once"""
+    return max(1, settings.worker_processes)
+
+def submit(fn, *args) -> Future:
+    """Schedule ``fn(*args)`` on the pool, or run it now when there is no pool"""
+    pool = get_pool()
+    if pool is not None:
+        return pool.submit(fn, *args)
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,98 @@
+"""Synthetic compliance checks shaped like ``app.mock_data``, at any size.
+
+    python -m benchmarks.datagen --rows 10000000 checks.csv
+
+Frameworks and providers follow the mock data's labels with a skewed
+mix (a couple of them hold most checks), most checks pass, failures
+concentrate in the higher severities, risk follows severity, and
+``last_checked`` clusters in the last hours like a scanner's output.
+Rows are generated and written in chunks, so 10M rows need little memory.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+FRAMEWORKS = ("SOC2", "GDPR", "HIPAA", "PCI-DSS", "ISO27001")
+FRAMEWORK_WEIGHTS = (0.35, 0.25, 0.15, 0.15, 0.10)
+PROVIDERS = ("AWS", "Azure", "GCP")
+PROVIDER_WEIGHTS = (0.55, 0.30, 0.15)
+SEVERITIES = ("Low", "Medium", "High", "Critical")
+SEVERITY_WEIGHTS = (0.40, 0.30, 0.20, 0.10)
+# Chance that a check of each severity is Failing / Warning (the rest pass)
+FAILING_BY_SEVERITY = (0.03, 0.08, 0.20, 0.35)
+WARNING_BY_SEVERITY = (0.05, 0.10, 0.10, 0.10)
+# Base risk score of each severity; scores spread +-1.5 around it
+RISK_BY_SEVERITY = (1.5, 4.0, 7.0, 9.0)
+DESCRIPTIONS = (
+    "Unencrypted data transmission detected",
+    "Personal data retention policy violation",
+    "Healthcare data access logging insufficient",
+    "Payment card data encryption needs review",
+    "Information security management system compliant",
+    "Access controls properly configured",
+    "Data processing consent verified",
+    "Risk assessment process documented",
+)
+SUMMARY_RATE = 0.3
+CHUNK_ROWS = 500_000
+
+
+def generate_frame(rows: int, seed: int = 0, start: int = 0, now: Optional[datetime] = None) -> pd.DataFrame:
+    """``rows`` checks with ids ``cv-<start>`` onwards, in the CSV upload's columns"""
+    rng = np.random.default_rng([seed, start])
+    now = now or datetime.utcnow()
+    severity = rng.choice(len(SEVERITIES), rows, p=SEVERITY_WEIGHTS)
+    draw = rng.random(rows)
+    failing = draw < np.take(FAILING_BY_SEVERITY, severity)
+    warning = ~failing & (draw < np.take(FAILING_BY_SEVERITY, severity) + np.take(WARNING_BY_SEVERITY, severity))
+    status = np.where(failing, "Failing", np.where(warning, "Warning", "Passing"))
+    risk = np.clip(np.take(RISK_BY_SEVERITY, severity) + rng.uniform(-1.5, 1.5, rows), 0, 10).round(1)
+    # Exponential age: most checks ran in the last day, a long tail up to 90 days
+    age = np.minimum(rng.exponential(24 * 3600, rows), 90 * 86400).astype("timedelta64[s]")
+    ids = range(start, start + rows)
+    with_summary = (rng.random(rows) < SUMMARY_RATE).tolist()
+    return pd.DataFrame({
+        "id": [f"cv-{i:08d}" for i in ids],
+        "framework": np.take(FRAMEWORKS, rng.choice(len(FRAMEWORKS), rows, p=FRAMEWORK_WEIGHTS)),
+        "provider": np.take(PROVIDERS, rng.choice(len(PROVIDERS), rows, p=PROVIDER_WEIGHTS)),
+        "severity": np.take(SEVERITIES, severity),
+        "status": status,
+        "risk_score": risk,
+        "description": np.take(DESCRIPTIONS, rng.integers(0, len(DESCRIPTIONS), rows)),
+        "last_checked": (np.datetime64(now, "s") - age).astype(str),
+        "ai_summary": [f"Automated review of check {i}" if summary else "" for i, summary in zip(ids, with_summary)],
+    })
+
+
+def generate_chunks(rows: int, seed: int = 0, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    now = datetime.utcnow()
+    for start in range(0, rows, chunk_rows):
+        yield generate_frame(min(chunk_rows, rows - start), seed, start, now)
+
+
+def write_csv(path: str, rows: int, seed: int = 0) -> int:
+    """Write ``rows`` checks to ``path``; returns the file size in bytes"""
+    with open(path, "w", newline="") as f:
+        for i, chunk in enumerate(generate_chunks(rows, seed)):
+            chunk.to_csv(f, index=False, header=i == 0)
+        return f.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    size = write_csv(args.output, args.rows, args.seed)
+    print(f"Wrote {args.rows} rows ({size / 1e6:.1f} MB) to {args.output} "
+          f"in {timedelta(seconds=round(time.perf_counter() - start))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Latency, throughput and memory of the API endpoints, measured in-process.
+
+    python -m benchmarks.harness --rows 100000 --output results.json
+    python -m benchmarks.harness --rows 100000 --compare results.json
+
+Generates a synthetic dataset (``benchmarks.datagen``), uploads it
+through ``/upload``, then drives each read endpoint through the ASGI app
+with httpx: ``--requests`` sequential calls for latency percentiles, then
+the same number spread over ``--concurrency`` clients for throughput.
+The first call after the upload is reported separately (``first_ms``),
+as most endpoints cache their response per data version.
+
+Results are written as JSON; ``--compare`` exits non-zero when a p50,
+p99, upload time or memory figure regressed by more than ``--tolerance``.
+Settings come from the environment as usual (e.g. STORAGE_BACKEND=sqlite).
+Needs httpx, which the app itself does not.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# The app reads its settings at import time
+_workdir = tempfile.mkdtemp(prefix="bench-")
+os.environ.setdefault("DATA_DIR", os.path.join(_workdir, "data"))
+os.environ.setdefault("SQLITE_PATH", os.path.join(_workdir, "data.sqlite3"))
+os.environ.setdefault("MODEL_PATH", "model.joblib")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.main import app  # noqa: E402
+from app.workers import shutdown_pool  # noqa: E402
+from benchmarks.datagen import write_csv  # noqa: E402
+
+# (name, method, path) of every endpoint measured after the upload
+ENDPOINTS = (
+    ("dashboard", "GET", "/api/v1/dashboard"),
+    ("statistics", "GET", "/api/v1/statistics"),
+    ("risk_statistics", "GET", "/api/v1/statistics/risk"),
+    ("checks", "GET", "/api/v1/checks?limit=100"),
+    ("checks_filtered", "GET", "/api/v1/checks?limit=100&framework=HIPAA&status=Failing&sort=-risk_score"),
+    ("checks_10k", "GET", "/api/v1/checks?limit=10000"),
+    ("search", "GET", "/api/v1/checks/search?q=data+encryption"),
+    ("search_filtered", "GET", "/api/v1/checks/search?q=access&framework=HIPAA&status=Failing"),
+    ("scan", "POST", "/api/v1/scan"),
+    ("ai_insights", "GET", "/api/v1/ai-insights"),
+    ("overview", "GET", "/api/v1/overview"),
+)
+# Figures compared by --compare, all "lower is better", with the change each must
+# exceed besides --tolerance to count (timer and scheduler noise)
+COMPARED = {"p50_ms": 1.0, "p99_ms": 2.0, "seconds": 0.5, "peak_rss_mb": 16.0}
+
+
+def memory_mb() -> Dict[str, float]:
+    """Current and peak resident memory of this process, peak of its worker processes"""
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                status[key] = int(value.split()[0]) / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"rss_mb": round(status["VmRSS"], 1), "peak_rss_mb": round(status["VmHWM"], 1),
+            "workers_peak_rss_mb": round(children, 1)}
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    values = np.asarray(samples)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50_ms": round(p50, 2), "p90_ms": round(p90, 2), "p99_ms": round(p99, 2),
+            "mean_ms": round(values.mean(), 2), "max_ms": round(values.max(), 2)}
+
+
+async def request(client: httpx.AsyncClient, method: str, path: str) -> float:
+    start = time.perf_counter()
+    response = await client.request(method, path)
+    await response.aread()
+    elapsed = (time.perf_counter() - start) * 1000
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {path} -> {response.status_code}: {response.text[:200]}")
+    return elapsed
+
+
+async def measure(client: httpx.AsyncClient, method: str, path: str, requests: int, concurrency: int) -> Dict:
+    first = await request(client, method, path)
+    latencies = [await request(client, method, path) for _ in range(requests)]
+
+    queue = iter(range(requests))
+
+    async def worker():
+        for _ in queue:
+            await request(client, method, path)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"first_ms": round(first, 2), **summarize(latencies),
+            "requests_per_second": round(requests / elapsed, 1), **memory_mb()}
+
+
+async def run(rows: int, requests: int, concurrency: int, seed: int) -> Dict:
+    csv_path = os.path.join(_workdir, "checks.csv")
+    start = time.perf_counter()
+    size = write_csv(csv_path, rows, seed)
+    print(f"Generated {rows} rows ({size / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+    results: Dict = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        with open(csv_path, "rb") as f:
+            body = f.read()
+        start = time.perf_counter()
+        response = await client.post("/api/v1/upload?wait=true", files={"file": ("checks.csv", body)})
+        elapsed = time.perf_counter() - start
+        del body
+        if response.status_code != 200:
+            raise RuntimeError(f"Upload failed: {response.status_code} {response.text[:200]}")
+        results["upload"] = {"seconds": round(elapsed, 2), "rows_per_second": round(rows / elapsed),
+                             "megabytes_per_second": round(size / 1e6 / elapsed, 1), **memory_mb()}
+        print(f"  {'upload':<16} {elapsed:8.2f}s  {rows / elapsed:10.0f} rows/s")
+
+        for name, method, path in ENDPOINTS:
+            result = await measure(client, method, path, requests, concurrency)
+            results[name] = result
+            print(f"  {name:<16} p50 {result['p50_ms']:8.2f}ms  p99 {result['p99_ms']:8.2f}ms  "
+                  f"{result['requests_per_second']:8.1f} req/s  first {result['first_ms']:8.2f}ms")
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Figures that got worse than ``baseline`` by more than ``tolerance`` (a fraction)"""
+    regressions = []
+    for name, result in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        for key, noise in COMPARED.items():
+            if key not in result or not before.get(key):
+                continue
+            if result[key] > before[key] * (1 + tolerance) and result[key] - before[key] > noise:
+                regressions.append(f"{name}.{key}: {before[key]} -> {result[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=50, help="Calls per endpoint (sequential and concurrent)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    print(f"Benchmarking {settings.storage_backend} store in {_workdir}")
+    try:
+        endpoints = asyncio.run(run(args.rows, args.requests, args.concurrency, args.seed))
+    finally:
+        shutdown_pool()
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "rows": args.rows,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "storage_backend": settings.storage_backend,
+            "worker_processes": settings.worker_processes,
+        },
+        "endpoints": endpoints,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Compare the /checks read path before and after the trusted serializer.
+
+    python -m benchmarks.serialization [--rows 100000] [--limit 10000] [--repeat 20]
+
+"legacy" is what FastAPI did with ``response_model=List[ComplianceCheck]``:
+build pydantic objects, re-validate them and JSON-encode the result.
+"fast" is what /checks does now: plain records straight to JSON bytes.
+"endpoint" times GET /checks?limit=N through the ASGI app.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("MODEL_PATH", "model.joblib")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-"))
+os.environ.setdefault("HISTORY_VERSIONS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.columnar import CheckTable  # noqa: E402
+from app.data_store import data_store  # noqa: E402
+from app.main import app  # noqa: E402
+from app.responses import dumps  # noqa: E402
+
+
+def synthetic_table(rows: int, seed: int = 0) -> CheckTable:
+    rng = np.random.default_rng(seed)
+    return CheckTable.from_frame(pd.DataFrame({
+        "id": [f"check-{i}" for i in range(rows)],
+        "framework": rng.choice(["SOC2", "ISO27001", "HIPAA", "PCI-DSS", "GDPR"], rows),
+        "provider": rng.choice(["AWS", "Azure", "GCP"], rows),
+        "severity": rng.choice(["Critical", "High", "Medium", "Low"], rows),
+        "status": rng.choice(["Passing", "Failing", "Warning"], rows),
+        "risk_score": rng.integers(0, 100, rows) / 10,
+        "description": [f"Control {i % 500} is not configured as required" for i in range(rows)],
+        "last_checked": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 90 * 86400, rows), unit="s"),
+        "ai_summary": None,
+    }))
+
+
+def timed(fn, repeat: int) -> list:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    data_store.set_data(synthetic_table(args.rows))
+    snapshot = data_store.snapshot()
+    route = next(r for r in app.routes if getattr(r, "path", "") == "/api/v1/checks")
+    positions = np.arange(min(args.limit, args.rows))
+
+    def legacy():
+        content = asyncio.run(serialize_response(field=route.response_field,
+                                                 response_content=snapshot.table.rows(positions)))
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def fast():
+        return dumps(snapshot.page({}, limit=args.limit)[0])
+
+    assert legacy() == fast(), "serializers disagree"
+    client = TestClient(app)
+    results = {
+        "legacy": timed(legacy, args.repeat),
+        "fast": timed(fast, args.repeat),
+        "endpoint": timed(lambda: client.get(f"/api/v1/checks?limit={args.limit}").content, args.repeat),
+    }
+    print(f"/checks?limit={args.limit} over {args.rows} rows, {args.repeat} runs (ms)")
+    for name, samples in results.items():
+        print(f"  {name:<9} median {statistics.median(samples):8.1f}   min {min(samples):8.1f}")
+    print(f"  speedup   {statistics.median(results['legacy']) / statistics.median(results['fast']):.1f}x")
+
+
+if __name__ == "__main__":
+    main()